@@ -51,7 +51,7 @@ config.General.transferLogs = True
 config.section_("JobType")
 config.JobType.pluginName = 'Analysis'
 config.JobType.psetName = 'PSet.py'
-config.JobType.inputFiles = ['../processors/ST.py', '../processors/branchfilter.txt', '../scripts/haddnano.py']
+config.JobType.inputFiles = ['../processors/ST.py', '../processors/branchfilter.txt', '../processors/outputpolicy.txt', '../scripts/haddnano.py']
 config.JobType.scriptExe = 'crab_script.sh'
 config.JobType.maxMemoryMB = 2500
 config.JobType.maxJobRuntimeMin = 300
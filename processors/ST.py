@@ -12,6 +12,7 @@ from PhysicsTools.NanoAODTools.postprocessing.framework.postprocessor \
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel \
     import Collection, Object
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
+from PhysicsTools.NanoAODTools.postprocessing.framework.filtergroup import FilterGroup
 from PhysicsTools.NanoAODTools.postprocessing.framework.crabhelper import inputFiles
 from PhysicsTools.NanoAODTools.modules import *
 
@@ -35,6 +36,16 @@ parser.add_argument('-i','--input', dest='inputFiles', action='append', default=
 parser.add_argument('-o','--output', dest='output', default='.')
 parser.add_argument('--maxEvents', dest='maxEvents', type=int, default=None)
 parser.add_argument('--crab', dest='crab', action='store_true', default=False)
+parser.add_argument('--syst-arrays', dest='systArrays', action='store_true', default=False,
+                    help='write the reconstructed variables as one array branch over the systematic variations')
+parser.add_argument('--output-policy', dest='outputPolicy', action='store_true', default=False,
+                    help='narrow the types and precisions of the new branches as in outputpolicy.txt')
+parser.add_argument('--push-down', dest='pushDown', action='store_true', default=False,
+                    help='add the preselections of the modules (the trigger skim) to the cut: the events they reject are not read')
+parser.add_argument('--metrics-json', dest='metricsFile', default=None,
+                    help='append the job progress as JSON lines to this file')
+parser.add_argument('--metrics-prom', dest='metricsPromFile', default=None,
+                    help='write the job progress in the Prometheus text format to this file')
 
 args = parser.parse_args()
 print(args)
@@ -105,6 +116,18 @@ jerSFUncertaintyFiles = {
 }
 
 def leptonSequence():
+    muonTrigger = SingleMuonTriggerSelection(
+        inputCollection=lambda event: event.tightMuons,
+        outputName="IsoMuTrigger",
+        storeWeights=True,
+        doVariations=not args.nosys,
+    )
+    electronTrigger = SingleElectronTriggerSelection(
+        inputCollection=lambda event: event.tightElectrons,
+        outputName="IsoElectronTrigger",
+        storeWeights=True,
+        doVariations=not args.nosys,
+    )
     seq = [
         MuonSelection(
             inputCollection=lambda event: Collection(event, "Muon"),
@@ -119,12 +142,7 @@ def leptonSequence():
             doVariations = not args.nosys,
             additionalSyst=True,
         ),
-        SingleMuonTriggerSelection(
-            inputCollection=lambda event: event.tightMuons,
-            outputName="IsoMuTrigger",
-            storeWeights=True,
-            doVariations=not args.nosys,
-        ),
+        muonTrigger,
         
         MuonVeto(
             inputCollection=lambda event: event.tightMuons_unselected,
@@ -143,21 +161,21 @@ def leptonSequence():
             storeWeights=True,
             doVariations = not args.nosys,
         ),
-        SingleElectronTriggerSelection(
-            inputCollection=lambda event: event.tightElectrons,
-            outputName="IsoElectronTrigger",
-            storeWeights=True,
-            doVariations=not args.nosys,
-        ),
+        electronTrigger,
         ElectronVeto(
             inputCollection=lambda event: event.tightElectrons_unselected,
             outputName = "looseElectrons",
             electronMinPt = 10.,
             electronMaxEta = 2.4,
         ),
-        EventSkim(selection=lambda event: (event.IsoMuTrigger_flag > 0) or (event.IsoElectronTrigger_flag > 0)),
-        EventSkim(selection=lambda event: (len(event.tightMuons) + len(event.tightElectrons)) == 1),
-        EventSkim(selection=lambda event: (len(event.looseMuons) + len(event.looseElectrons)) == 0),
+        FilterGroup([
+            EventSkim(
+                selection=lambda event: (event.IsoMuTrigger_flag > 0) or (event.IsoElectronTrigger_flag > 0),
+                preselection="(%s) || (%s)"%(muonTrigger.triggerCut(), electronTrigger.triggerCut())
+            ),
+            EventSkim(selection=lambda event: (len(event.tightMuons) + len(event.tightElectrons)) == 1),
+            EventSkim(selection=lambda event: (len(event.looseMuons) + len(event.looseElectrons)) == 0),
+        ], name="leptons"),
         
     ]
     return seq
@@ -192,17 +210,23 @@ def jetSelection(jetDict):
             )
         )
 
-    systNames = jetDict.keys()
+    systNames = ["nominal"] + sorted(systName for systName in jetDict.keys() if systName != "nominal")
 
+    # bitmask of the variations passing the jet (and b-tag) requirements
     seq.append(
-        EventSkim(selection=lambda event, systNames=systNames: 
-            any([getattr(event, "nselectedJets_"+systName) >= 2 for systName in systNames])
+        VariationSkim(
+            variations=systNames,
+            selection=lambda event, systName: getattr(event, "nselectedJets_"+systName) >= 2,
+            outputName="passJets",
         )
     )
     if args.ntags>=0:
         seq.append(
-            EventSkim(selection=lambda event, systNames=systNames: 
-                any([len(filter(lambda jet: jet.isBTagged,getattr(event,"selectedJets_"+systName))) == args.ntags for systName in systNames])
+            VariationSkim(
+                variations=systNames,
+                selection=lambda event, systName: sum(1 for jet in getattr(event,"selectedJets_"+systName) if jet.isBTagged) == args.ntags,
+                outputName="passBTags",
+                previousStage="passJets",
             )
         )
     
@@ -288,7 +312,7 @@ def eventReconstruction(uncertaintyDict):
 
 
 analyzerChain = [
-    EventSkim(selection=lambda event: event.nTrigObj > 0),
+    EventSkim(selection=lambda event: event.nTrigObj > 0, preselection="nTrigObj > 0"),
     MetFilter(
         globalOptions=globalOptions,
         outputName="MET_filter"
@@ -297,6 +321,7 @@ analyzerChain = [
 analyzerChain.extend(leptonSequence())
 
 if args.isData:
+    systematicsAxis = ["nominal"]
     analyzerChain.extend(
         jetSelection({
             "nominal": lambda event: Collection(event,"Jet")
@@ -371,6 +396,7 @@ else:
             uncertaintyDict['jes'+jesUncertaintyName+"Up"] = (lambda event,sys=jesUncertaintyName: getattr(event,"selectedJets_jes"+sys+"Up"), lambda event,sys=jesUncertaintyName: getattr(event,"met_jes"+sys+"Up"))
             uncertaintyDict['jes'+jesUncertaintyName+"Down"] = (lambda event,sys=jesUncertaintyName: getattr(event,"selectedJets_jes"+sys+"Down"), lambda event,sys=jesUncertaintyName: getattr(event,"met_jes"+sys+"Down"))
 
+    systematicsAxis = ["nominal"] + sorted(systName for systName in uncertaintyDict.keys() if systName != "nominal")
     analyzerChain.extend(
         eventReconstruction(uncertaintyDict)
     )
@@ -448,7 +474,13 @@ p = PostProcessor(
     maxEntries= args.maxEvents,
     provenance=args.crab,
     fwkJobReport=args.crab,
-    haddFileName='nano.root'
+    haddFileName='nano.root',
+    pushDown=args.pushDown,
+    metricsFile=args.metricsFile,
+    metricsPromFile=args.metricsPromFile,
+    systematicsLayout=systematicsAxis if args.systArrays else None,
+    outputPolicy=(('./outputpolicy.txt' if args.crab else os.path.dirname(__file__) + '/outputpolicy.txt')
+                  if args.outputPolicy else None)
 )
 
 p.run()
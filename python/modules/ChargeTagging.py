@@ -48,6 +48,12 @@ class ChargeTagging(Module):
 
     def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
         self.out = wrappedOutputTree
+        branches = ["nglobal", "global_jetIdx", "global_eta", "global_phi"]
+        for featureCfg in self.featureDict.values():
+            branches += featureCfg["branches"]
+            if "max" in featureCfg:
+                branches.append(featureCfg["length"])
+        inputTree.declareBranches(branches)
         self.setup(inputTree)
 
     def setupTFEval(self,tree,modelFile):
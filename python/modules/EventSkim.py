@@ -10,9 +10,11 @@ from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
 
 
 class EventSkim(Module):
-    def __init__(self, selection=lambda event: True, outputName=None):
+    def __init__(self, selection=lambda event: True, outputName=None, preselection=None):
         self.selection = selection
         self.outputName = outputName
+        # TTreeFormula expression of input branches true for all the events passing selection
+        self.preselectionCut = preselection
 
     def beginJob(self):
         pass
@@ -28,6 +30,11 @@ class EventSkim(Module):
     def endFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
         pass
 
+    def preselection(self):
+        if self.outputName is not None:
+            return None # events are not rejected
+        return self.preselectionCut
+
     def analyze(self, event):
         if self.outputName is not None:
             self.out.fillBranch(self.outputName, self.selection(event))
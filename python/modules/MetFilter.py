@@ -27,6 +27,23 @@ class MetFilter(Module):
     def endFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
         pass
 
+    def preselection(self):
+        if self.outputName is not None:
+            return None # events are not rejected
+        flags = [
+            "Flag_goodVertices",
+            "Flag_globalSuperTightHalo2016Filter",
+            "Flag_HBHENoiseFilter",
+            "Flag_HBHENoiseIsoFilter",
+            "Flag_EcalDeadCellTriggerPrimitiveFilter",
+            "Flag_BadPFMuonFilter",
+            "Flag_BadPFMuonDzFilter",
+            "Flag_ecalBadCalibFilter",
+        ]
+        if self.globalOptions["isData"]:
+            flags.append("Flag_eeBadScFilter")
+        return " && ".join("%s!=0"%flag for flag in flags)
+
     def passFilters(self,event):
         #https://twiki.cern.ch/twiki/bin/view/CMS/MissingETOptionalFiltersRun2
         if event.Flag_goodVertices==0:
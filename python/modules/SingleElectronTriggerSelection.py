@@ -71,6 +71,16 @@ class SingleElectronTriggerSelection(Module):
         
     def endFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
         pass
+
+    def triggerCut(self):
+        """TTreeFormula expression of the trigger flag, e.g. for the preselection of a skim on it"""
+        if Module.globalOptions["year"] == '2016' or Module.globalOptions["year"] == '2016preVFP':
+            return "HLT_Ele27_WPTight_Gsf!=0"
+        elif Module.globalOptions["year"] == '2017':
+            return "HLT_Ele32_WPTight_Gsf_L1DoubleEG!=0"
+        elif Module.globalOptions["year"] == '2018':
+            return "HLT_Ele32_WPTight_Gsf!=0"
+        return "0"
         
     def analyze(self, event):
         """process event, return True (go to next module) or False (fail, go to next event)"""
@@ -77,6 +77,16 @@ class SingleMuonTriggerSelection(Module):
         
     def endFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
         pass
+
+    def triggerCut(self):
+        """TTreeFormula expression of the trigger flag, e.g. for the preselection of a skim on it"""
+        if Module.globalOptions["year"] == '2016' or Module.globalOptions["year"] == '2016preVFP':
+            return "HLT_IsoMu24>0 || HLT_IsoTkMu24>0"
+        elif Module.globalOptions["year"] == '2017':
+            return "HLT_IsoMu27>0"
+        elif Module.globalOptions["year"] == '2018':
+            return "HLT_IsoMu24!=0"
+        return "0"
         
     def analyze(self, event):
         """process event, return True (go to next module) or False (fail, go to next event)"""
@@ -0,0 +1,65 @@
+import os
+import sys
+import math
+import json
+import ROOT
+import random
+
+from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection
+from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
+
+
+class VariationSkim(Module):
+    '''
+    Evaluates a selection for each systematic variation and stores which ones
+    passed as a bitmask (bit i for variations[i]) in the uint64 branch
+    outputName. The variations are written to the output file as the
+    comma-separated string <outputName>_variations. With previousStage (the
+    outputName of another VariationSkim), only the variations which passed it
+    are tried, so that the mask is the one of the whole selection so far.
+    Events are rejected if no variation passes, unless requireAny is False.
+    '''
+
+    def __init__(
+        self,
+        variations,
+        selection=lambda event, systName: True,
+        outputName="variationMask",
+        previousStage=None,
+        requireAny=True
+    ):
+        if len(variations) > 64:
+            raise RuntimeError("At most 64 variations fit in the mask, got %d" % len(variations))
+        self.variations = list(variations)
+        self.selection = selection
+        self.outputName = outputName
+        self.previousStage = previousStage
+        self.requireAny = requireAny
+
+    @staticmethod
+    def bit(variations, systName):
+        '''mask of the variation systName, e.g. to select events with (mask & bit) != 0'''
+        return 1 << list(variations).index(systName)
+
+    def beginJob(self):
+        pass
+
+    def endJob(self):
+        pass
+
+    def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+        self.out = wrappedOutputTree
+        self.out.branch(self.outputName, "l", title="bit i set if variation i of %s_variations passed" % self.outputName)
+        self.out.setMetadata(self.outputName + "_variations", ",".join(self.variations))
+
+    def endFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+        pass
+
+    def analyze(self, event):
+        previous = getattr(event, self.previousStage) if self.previousStage is not None else (1 << len(self.variations)) - 1
+        mask = 0
+        for i, systName in enumerate(self.variations):
+            if (previous >> i) & 1 and self.selection(event, systName):
+                mask |= 1 << i
+        self.out.fillBranch(self.outputName, mask)
+        return mask != 0 or not self.requireAny
@@ -18,6 +18,7 @@ from ElectronVeto import ElectronVeto
 #aux
 from CombineLeptons import CombineLeptons
 from EventSkim import EventSkim
+from VariationSkim import VariationSkim
 from EventInfo import EventInfo
 from MetFilter import MetFilter
 
@@ -0,0 +1,61 @@
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+
+
+class BasketBudget:
+    """Fit the baskets of an output tree in a memory budget.
+
+       A tree keeps in memory one basket per branch, holding the entries
+       of the current cluster until it is flushed. After warmup entries (or
+       for a tree already filled), the uncompressed size per entry of each
+       branch is measured, the autoflush cluster is chosen so that a cluster
+       of all the branches fits in maxMemory, and the basket of each branch
+       is sized to hold one cluster.
+    """
+
+    def __init__(self, maxMemory, warmup=100, minCluster=100, maxCluster=1000000,
+                 minBasketSize=1024, maxBasketSize=16 * 1024 * 1024, basketOverhead=512):
+        self.maxMemory = maxMemory
+        self.warmup = warmup
+        self.minCluster = minCluster
+        self.maxCluster = maxCluster
+        self.minBasketSize = minBasketSize
+        self.maxBasketSize = maxBasketSize
+        self.basketOverhead = basketOverhead  # TBasket and TKey objects
+
+    def plan(self, tree, nEntries=None):
+        """Return (cluster size, {branch name: basket size}, expected peak memory in bytes)"""
+        if nEntries == None:
+            nEntries = tree.GetEntries()
+        branches = list(tree.GetListOfBranches())
+        perEntry = dict((b.GetName(), max(b.GetTotalSize(), 1) / float(max(nEntries, 1)))
+                        for b in branches)
+        total = sum(perEntry.values())
+        available = self.maxMemory - len(branches) * self.basketOverhead
+        # the baskets of one cluster, plus the compression buffer of the largest one
+        cluster = int(available / (total * 1.2)) if total > 0 and available > 0 else self.minCluster
+        cluster = max(self.minCluster, min(self.maxCluster, cluster))
+        sizes = {}
+        for name, size in perEntry.items():
+            size = int(cluster * size * 1.1) + 1
+            sizes[name] = min(self.maxBasketSize, max(self.minBasketSize, (size + 511) // 512 * 512))
+        peak = sum(sizes.values()) + (max(sizes.values()) if sizes else 0) + len(branches) * self.basketOverhead
+        return cluster, sizes, peak
+
+    def apply(self, tree, nEntries=None, reference=None):
+        """Set the autoflush and the basket sizes of tree, return the expected peak memory.
+
+           The sizes per entry are measured on reference (e.g. the input of a
+           merge) if given, else on tree.
+        """
+        cluster, sizes, peak = self.plan(reference if reference != None else tree, nEntries)
+        tree.SetAutoFlush(cluster)
+        for b in tree.GetListOfBranches():
+            if b.GetName() in sizes:
+                b.SetBasketSize(sizes[b.GetName()])
+        print("Tree %s: autoflush every %d entries, %d baskets of %d bytes in total, expected peak memory %.1f MB (budget %.1f MB)" % (
+            tree.GetName(), cluster, len(sizes), sum(sizes.values()), peak / 1048576., self.maxMemory / 1048576.))
+        if peak > self.maxMemory:
+            print("Warning: the baskets of tree %s can't fit in the memory budget, even with clusters of %d entries" % (
+                tree.GetName(), cluster))
+        return peak
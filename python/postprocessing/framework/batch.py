@@ -0,0 +1,159 @@
+from PhysicsTools.NanoAODTools.postprocessing.framework.treeReaderArrayTools import useBranch
+import numpy
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+
+
+_rootLeafType2Numpy = {
+    'Bool_t': numpy.bool_,
+    'Char_t': numpy.int8,
+    'UChar_t': numpy.uint8,
+    'Short_t': numpy.int16,
+    'UShort_t': numpy.uint16,
+    'Int_t': numpy.int32,
+    'UInt_t': numpy.uint32,
+    'Long64_t': numpy.int64,
+    'ULong64_t': numpy.uint64,
+    'Float_t': numpy.float32,
+    'Double_t': numpy.float64,
+}
+
+_readColumnCode = """
+#include "TTree.h"
+#include "TBranch.h"
+#include "TLeaf.h"
+#include "TEntryList.h"
+#include <cstring>
+
+namespace nanoBatch {
+// Copy the values of the leaf name for the entries first...first+n-1 of
+// elist (of the tree if null) to out, of at most capacity values, and the
+// number of values of each entry to counts. The baskets of the branch (and
+// of its count branch) are read directly, without TTreeFormula, and the
+// branches are read back at the entry they were at. Return the number of
+// values, -1 if they don't fit, -2 on read errors.
+Long64_t readColumn(TTree *tree, const char *name, TEntryList *elist, Long64_t first, Long64_t n,
+                    void *out, Long64_t capacity, Long64_t *counts) {
+   TBranch *branch = tree->GetBranch(name);
+   TLeaf *leaf = branch ? branch->GetLeaf(name) : nullptr;
+   if (!leaf) return -2;
+   TBranch *countBranch = leaf->GetLeafCount() ? leaf->GetLeafCount()->GetBranch() : nullptr;
+   const Long64_t previous = branch->GetReadEntry();
+   const Long64_t previousCount = countBranch ? countBranch->GetReadEntry() : -1;
+   const Int_t size = leaf->GetLenType();
+   char *dest = static_cast<char *>(out);
+   Long64_t nValues = 0;
+   for (Long64_t i = 0; i < n; ++i) {
+      const Long64_t entry = elist ? elist->GetEntry(first + i) : first + i;
+      if (entry < 0 || branch->GetEntry(entry) < 0) {
+         nValues = -2;
+         break;
+      }
+      const Int_t len = leaf->GetLen();
+      if (nValues + len > capacity) {
+         nValues = -1;
+         break;
+      }
+      std::memcpy(dest + nValues * size, leaf->GetValuePointer(), len * size);
+      counts[i] = len;
+      nValues += len;
+   }
+   if (countBranch && previousCount >= 0) countBranch->GetEntry(previousCount);
+   if (previous >= 0) branch->GetEntry(previous);
+   return nValues;
+}
+}
+"""
+_readColumnDeclared = False
+
+
+class EventBatch:
+    """A chunk of consecutive entries of an InputTree, seen as NumPy columns.
+
+       Value branches are returned as arrays with one element per entry,
+       variable-length branches as (offsets, contents) pairs, where the
+       values of entry k are contents[offsets[k]:offsets[k+1]].
+       The boolean array mask holds the accept decision of the modules run
+       so far; rejected entries are still present in the columns.
+    """
+
+    def __init__(self, tree, entries, outputTree=None):
+        self._tree = tree
+        self._outputTree = outputTree
+        self.entries = numpy.asarray(entries, dtype=numpy.int64)
+        self.mask = numpy.ones(len(self.entries), dtype=bool)
+        self.events = [None] * len(self.entries)
+        self.extrabranches = [{} for _ in self.entries]
+        self.records = [[] for _ in self.entries]
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def array(self, branchName):
+        """Return the values of a single-value branch as a NumPy array"""
+        if branchName not in self._columns:
+            leaf = self._leaf(branchName)
+            if bool(leaf.GetLeafCount()) or leaf.GetLen() != 1:
+                raise RuntimeError("Branch %s is not a value" % branchName)
+            self._columns[branchName] = self._read(
+                branchName, len(self.entries), leaf.GetTypeName())
+        return self._columns[branchName]
+
+    def jagged(self, branchName):
+        """Return the values of a variable-length branch as (offsets, contents)"""
+        if branchName not in self._columns:
+            leaf = self._leaf(branchName)
+            if not bool(leaf.GetLeafCount()):
+                raise RuntimeError("Branch %s is not a variable-length value array" % branchName)
+            counts = self.array(leaf.GetLeafCount().GetName())
+            offsets = numpy.zeros(len(counts) + 1, dtype=numpy.int64)
+            numpy.cumsum(counts, out=offsets[1:])
+            contents = self._read(
+                branchName, int(offsets[-1]), leaf.GetTypeName())
+            self._columns[branchName] = (offsets, contents)
+        return self._columns[branchName]
+
+    def extra(self, name, default=None):
+        """Return the values filled by earlier modules for an output branch, one per entry"""
+        return [e.get(name, default) for e in self.extrabranches]
+
+    def fillBranch(self, name, values, offsets=None):
+        """Fill an output branch for all the entries still accepted.
+
+           values has one element per entry, or is the contents array of a
+           variable-length branch if offsets is given.
+        """
+        lenVar = self._outputTree.countBranch(name) if offsets is not None and self._outputTree != None else None
+        for k in numpy.flatnonzero(self.mask):
+            val = values[offsets[k]:offsets[k + 1]] if offsets is not None else values[k]
+            self.records[k].append((name, val))
+            self.extrabranches[k][name] = val
+            if lenVar:
+                # as OutputTree.fillBranch, for the modules run after
+                self.extrabranches[k][lenVar] = int(offsets[k + 1] - offsets[k])
+
+    def _leaf(self, branchName):
+        branch = self._tree.GetBranch(branchName)
+        if not branch:
+            raise RuntimeError("Can't find branch '%s'" % branchName)
+        useBranch(self._tree, branchName)
+        return branch.GetLeaf(branchName)
+
+    def _read(self, branchName, nValues, typ):
+        """Read nValues values of type typ of branchName over the entries, in their native type"""
+        global _readColumnDeclared
+        if not _readColumnDeclared:
+            if not ROOT.gInterpreter.Declare(_readColumnCode):
+                raise RuntimeError("Could not compile the batch column reader")
+            _readColumnDeclared = True
+        if typ not in _rootLeafType2Numpy:
+            raise RuntimeError("Branch %s has the unsupported type %s" % (branchName, typ))
+        values = numpy.zeros(nValues, dtype=_rootLeafType2Numpy[typ])
+        counts = numpy.zeros(len(self.entries), dtype=numpy.int64)
+        n = ROOT.nanoBatch.readColumn(
+            self._tree, branchName, self._tree._entrylist, int(self.entries[0]), len(self.entries),
+            values.view(numpy.uint8), nValues, counts)
+        if n != nValues:
+            raise RuntimeError("Read %d values of branch %s, expected %d" % (n, branchName, nValues))
+        return values
@@ -1,47 +1,202 @@
+import hashlib
+import json
 import re
 
+# the special characters of the TTree::SetBranchStatus wildcards
+_wildcard = re.compile(r"(\*|\?|\[[^\]]*\])")
+# runs of keep/drop lines per compiled expression, as python 2 allows at most 100 groups
+_runsPerMatcher = 20
+
+
+def wildcardToRegex(pattern):
+    """Regular expression matching the same names as the TTree::SetBranchStatus pattern"""
+    ret = []
+    for i, part in enumerate(_wildcard.split(pattern)):
+        if i % 2 == 0:
+            ret.append(re.escape(part))
+        elif part == "*":
+            ret.append(".*")
+        elif part == "?":
+            ret.append(".")
+        else:
+            ret.append(part)
+    return "".join(ret)
+
+
+def schemaHash(branchNames):
+    """Hash of a list of branch names, identifying the trees with the same branches"""
+    return hashlib.sha1("\n".join(branchNames).encode("utf-8")).hexdigest()
+
 
 class BranchSelection():
+    """Keep/drop lines applied in order to the branches of a tree, the last
+       line matching a branch deciding if it is kept.
+
+       All the lines are compiled in one regular expression, with a group
+       for each run of consecutive keep or drop lines, tried from the last
+       one. What is kept and dropped is computed once for each list of branch
+       names (see schemaHash) and cached in resolved, so that the files of a
+       dataset with the same branches don't match the patterns again.
+    """
+
     def __init__(self, filename):
         comment = re.compile(r"#.*")
-        ops = []
-        for line in open(filename, 'r'):
-            line = line.strip()
-            if len(line) == 0 or line[0] == '#':
-                continue
-            line = re.sub(comment, "", line)
-            while line[-1] == "\\":
-                line = line[:-1] + " " + file.next().strip()
+        ops = []  # (regular expression, status, is a keep/drop wildcard)
+        with open(filename, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if len(line) == 0 or line[0] == '#':
+                    continue
                 line = re.sub(comment, "", line)
-            try:
-                (op, sel) = line.split()
-                if op == "keep":
-                    ops.append((sel, 1))
-                elif op == "drop":
-                    ops.append((sel, 0))
-                elif op == "keepmatch":
-                    ops.append((re.compile("(:?%s)$" % sel), 1))
-                elif op == "dropmatch":
-                    ops.append((re.compile("(:?%s)$" % sel), 0))
-                else:
-                    print("Error in file %s, line '%s': "% (filename, line)
-                        + ": it's not (keep|keepmatch|drop|dropmatch) "
+                while line[-1] == "\\":
+                    line = line[:-1] + " " + next(f).strip()
+                    line = re.sub(comment, "", line)
+                try:
+                    (op, sel) = line.split()
+                    if op == "keep":
+                        ops.append((wildcardToRegex(sel), 1, True))
+                    elif op == "drop":
+                        ops.append((wildcardToRegex(sel), 0, True))
+                    elif op == "keepmatch":
+                        ops.append((sel, 1, False))
+                    elif op == "dropmatch":
+                        ops.append((sel, 0, False))
+                    else:
+                        print("Error in file %s, line '%s': "% (filename, line)
+                            + ": it's not (keep|keepmatch|drop|dropmatch) "
+                            + "<branch_pattern>"
+                        )
+                except ValueError as e:
+                    print("Error in file %s, line '%s': " % (filename, line)
+                        + "it's not (keep|keepmatch|drop|dropmatch) "
                         + "<branch_pattern>"
                     )
-            except ValueError as e:
-                print("Error in file %s, line '%s': " % (filename, line)
-                    + "it's not (keep|keepmatch|drop|dropmatch) "
-                    + "<branch_pattern>"
-                )
+        self.fileName = filename
         self._ops = ops
+        # schemaHash -> (kept, dropped, dropped count branches of kept branches)
+        self.resolved = {}
+        runs = []  # [status, patterns] of consecutive lines with the same status
+        # the keep/drop lines, with the index of their run, for the branches of friends
+        self._wildcards = []
+        for sel, stat, isWildcard in ops:
+            if runs and runs[-1][0] == stat:
+                runs[-1][1].append(sel)
+            else:
+                runs.append([stat, [sel]])
+            if isWildcard:
+                self._wildcards.append((re.compile("(?:%s)\\Z" % sel), stat, len(runs) - 1))
+        groups = ["(?P<%s%d>%s)" % ("k" if stat else "d", irun, "|".join("(?:%s)" % sel for sel in sels))
+                  for irun, (stat, sels) in reversed(list(enumerate(runs)))]
+        self._matchers = self._compile(groups)
+        self._keepMatchers = self._compile([g for g in groups if g.startswith("(?P<k")])
+
+    @staticmethod
+    def _compile(groups):
+        return [re.compile("(?:%s)\\Z" % "|".join(groups[i:i + _runsPerMatcher]))
+                for i in range(0, len(groups), _runsPerMatcher)]
+
+    @staticmethod
+    def _lastRun(name, matchers):
+        """(index of the last run of lines matching name, status), (-1, 1) if none does"""
+        for matcher in matchers:
+            m = matcher.match(name)
+            if m:
+                return int(m.lastgroup[1:]), int(m.lastgroup[0] == "k")
+        return -1, 1
+
+    def _lastWildcardRun(self, name, keepOnly=False):
+        """As _lastRun, with only the keep (and drop) lines: the keepmatch and
+           dropmatch lines are applied to the branches of the tree itself and
+           not to the ones of its friends"""
+        for regex, stat, irun in reversed(self._wildcards):
+            if (stat or not keepOnly) and regex.match(name):
+                return irun, stat
+        return -1, 1
+
+    @staticmethod
+    def _branches(tree):
+        """The branches of tree and of its friends, which SetBranchStatus also sets"""
+        ret = list(tree.GetListOfBranches())
+        friends = tree.GetListOfFriends()
+        if friends:
+            for friend in friends:
+                if friend.GetTree():
+                    ret += BranchSelection._branches(friend.GetTree())
+        return ret
+
+    def resolve(self, tree):
+        """Return the names of the branches of tree (and of its friends) kept
+           and dropped, and the dropped count branches of kept branches,
+           computed once per schemaHash"""
+        branches = self._branches(tree)
+        names, seen = [], set()
+        for b in branches:
+            if b.GetName() not in seen:
+                names.append(b.GetName())
+                seen.add(b.GetName())
+        key = schemaHash(names)
+        if key not in self.resolved:
+            own = set(b.GetName() for b in tree.GetListOfBranches())
+
+            def lastRun(n, keepOnly=False):
+                if n in own:
+                    return self._lastRun(n, self._keepMatchers if keepOnly else self._matchers)
+                return self._lastWildcardRun(n, keepOnly)
+            last = dict((n, lastRun(n)) for n in names)
+            status = dict((n, last[n][1]) for n in names)
+            # as SetBranchStatus, a keep line also keeps the count branches of
+            # the branches it matches, unless they are dropped afterwards
+            activated, redrop = set(), set()
+            for b in branches:
+                for leaf in b.GetListOfLeaves():
+                    count = leaf.GetLeafCount()
+                    if not count:
+                        continue
+                    countName = count.GetBranch().GetName()
+                    if countName not in status or status[countName]:
+                        continue
+                    if lastRun(b.GetName(), keepOnly=True)[0] > last[countName][0]:
+                        activated.add(countName)
+                    elif status[b.GetName()]:
+                        redrop.add(countName)
+            for n in activated:
+                status[n] = 1
+            redrop = [n for n in redrop if not status[n]]
+            self.resolved[key] = ([n for n in names if status[n]], [n for n in names if not status[n]], redrop)
+        return self.resolved[key]
 
     def selectBranches(self, tree):
-        tree.SetBranchStatus("*", 1)
-        branchNames = [b.GetName() for b in tree.GetListOfBranches()]
-        for bre, stat in self._ops:
-            if type(bre) == re._pattern_type:
-                for n in branchNames:
-                    if re.match(bre, n):
-                        tree.SetBranchStatus(n, stat)
-            else:
-                tree.SetBranchStatus(bre, stat)
+        kept, dropped, redrop = self.resolve(tree)
+        if len(dropped) <= len(kept):
+            tree.SetBranchStatus("*", 1)
+            for n in dropped:
+                tree.SetBranchStatus(n, 0)
+        else:
+            tree.SetBranchStatus("*", 0)
+            for n in kept:
+                tree.SetBranchStatus(n, 1)
+            for n in redrop:
+                tree.SetBranchStatus(n, 0)
+
+    def selectedBranches(self, tree):
+        """Return the names of the branches kept, leaving the branch status of tree unchanged"""
+        return list(self.resolve(tree)[0])
+
+    def merge(self, resolved):
+        """Add the resolved selections of another instance, e.g. of a worker process"""
+        self.resolved.update(resolved)
+
+    def writeResolved(self, fname):
+        """Write the branches kept and dropped for each schema as JSON"""
+        with open(fname, 'w') as f:
+            json.dump(dict(selection=self.fileName, schemas=[
+                dict(schema=key, kept=kept, dropped=dropped)
+                for key, (kept, dropped, redrop) in sorted(self.resolved.items())]), f, indent=1)
+
+
+def writeBranchSelection(filename, keepBranches):
+    """Write a BranchSelection file keeping only the branches keepBranches"""
+    with open(filename, 'w') as f:
+        f.write("drop *\n")
+        for name in sorted(keepBranches):
+            f.write("keep %s\n" % name)
@@ -0,0 +1,72 @@
+import numpy
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+
+
+class BufferMerger:
+    """Merge the output of the worker processes into one file while they run.
+
+       This is what ROOT's TBufferMerger does for threads, done here for the
+       forked workers of PostProcessor.runParallel. Each worker writes its
+       output to a TMemFile, so that the compression is done in parallel by
+       the workers; every flushEvery entries and at the end of each file, the
+       content of the TMemFile is sent (send) to the main process and the
+       TMemFile is reset. The main process appends it to fileName by an
+       incremental merge (merge), which copies the compressed baskets.
+       The entries of the different workers are interleaved in the output.
+    """
+
+    def __init__(self, fileName, compressionLevel=0, compressionAlgo=None, flushEvery=20000):
+        self.fileName = fileName
+        self.compressionLevel = compressionLevel
+        self.compressionAlgo = compressionAlgo
+        self.flushEvery = flushEvery
+        self.queue = None  # where the workers send their output, set before forking
+        self._merger = None
+        self._nParts = 0
+
+    def openFile(self, name):
+        """Make the in-memory output file of a worker"""
+        memFile = ROOT.TMemFile(name, "RECREATE", "", self.compressionLevel)
+        if self.compressionLevel:
+            memFile.SetCompressionAlgorithm(self.compressionAlgo)
+        return memFile
+
+    def send(self, memFile):
+        """Send the content of memFile, already written, to the main process and reset it"""
+        size = memFile.GetSize()
+        buff = numpy.zeros(size, dtype=numpy.uint8)
+        n = memFile.CopyTo(buff, size)
+        self.queue.put(("output", None, buff[:n].tobytes()))
+        # keeps the trees, without their entries
+        memFile.ResetAfterMerge(ROOT.nullptr)
+
+    def flush(self, memFile):
+        """Write memFile and send it"""
+        memFile.Write()
+        self.send(memFile)
+
+    def open(self):
+        """Open the output file, in the main process"""
+        self._merger = ROOT.TFileMerger(False, False)
+        self._merger.SetNotrees(False)
+        self._merger.SetFastMethod(True)
+        self._merger.SetPrintLevel(0)
+        settings = 100 * self.compressionAlgo + self.compressionLevel if self.compressionLevel else 0
+        if not self._merger.OutputFile(self.fileName, "RECREATE", settings):
+            raise RuntimeError("Could not open the merged output file %s" % self.fileName)
+
+    def merge(self, data):
+        """Append the content of a worker TMemFile sent by send"""
+        self._nParts += 1
+        part = ROOT.TMemFile("%s.part%d" % (self.fileName, self._nParts), data, len(data), "READ")
+        ROOT.SetOwnership(part, False)
+        self._merger.AddAdoptFile(part, False)
+        if not self._merger.PartialMerge(ROOT.TFileMerger.kAllIncremental):
+            raise RuntimeError("Could not merge the output of a worker into %s" % self.fileName)
+        self._merger.Reset()
+
+    def close(self):
+        self._merger.GetOutputFile().Close()
+        print("Merged %d parts into %s" % (self._nParts, self.fileName))
+        self._merger = None
@@ -0,0 +1,96 @@
+import json
+import time
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+
+# compressions tried by "auto", from the fastest to the smallest
+autoCandidates = ["LZ4:4", "ZLIB:1", "ZLIB:6", "LZMA:4", "LZMA:9"]
+
+
+def parseCompression(compression):
+    """Return (level, algorithm) for a compression string (algo):(level), (0, None) for none"""
+    if compression == "none":
+        return 0, None
+    ROOT.gInterpreter.ProcessLine("#include <Compression.h>")
+    (algo, level) = compression.split(":")
+    if algo == "LZMA":
+        return int(level), ROOT.ROOT.kLZMA
+    elif algo == "ZLIB":
+        return int(level), ROOT.ROOT.kZLIB
+    elif algo == "LZ4":
+        return int(level), ROOT.ROOT.kLZ4
+    raise RuntimeError("Unsupported compression %s" % algo)
+
+
+def benchmarkCompression(tree, candidates=autoCandidates, minEntries=1000, branchSelection=None):
+    """Copy the first clusters of tree (at least minEntries entries) with each
+       compression in a memory file, return the write time and sizes of each"""
+    if branchSelection:
+        branchSelection.selectBranches(tree)
+    clusterIter = tree.GetClusterIterator(0)
+    nEntries = clusterIter()
+    while nEntries < min(minEntries, tree.GetEntries()):
+        nEntries = clusterIter()
+    nEntries = min(nEntries, tree.GetEntries())
+
+    def copy(level, algo):
+        prevdir = ROOT.gDirectory
+        memFile = ROOT.TMemFile("compressionBenchmark.root", "RECREATE", "", level)
+        if algo != None:
+            memFile.SetCompressionAlgorithm(algo)
+        memFile.cd()
+        t0 = time.time()
+        copied = tree.CopyTree("1", "", nEntries)
+        copied.FlushBaskets()
+        seconds = time.time() - t0
+        ret = (seconds, copied.GetZipBytes(), copied.GetTotBytes())
+        memFile.Close()
+        prevdir.cd()
+        return ret
+
+    # the time to read and copy the entries, not counted in the compression time
+    baseline = min(copy(0, None)[0], copy(0, None)[0])
+    results = []
+    for compression in candidates:
+        seconds, zipBytes, totBytes = copy(*parseCompression(compression))
+        seconds = max(seconds - baseline, 1e-6)
+        results.append(dict(
+            compression=compression, entries=nEntries, seconds=seconds, zipBytes=zipBytes,
+            totBytes=totBytes, ratio=totBytes / float(max(zipBytes, 1)),
+            throughput=totBytes / seconds))
+    tree.SetBranchStatus("*", 1)
+    return results
+
+
+def chooseCompression(results, objective="balanced"):
+    """Choose among the benchmarkCompression results for the objective:
+       speed (fastest), size (smallest) or balanced (smallest among the ones
+       at most twice as slow as the fastest)"""
+    if objective == "speed":
+        return min(results, key=lambda r: (r["seconds"], r["zipBytes"]))["compression"]
+    elif objective == "size":
+        return min(results, key=lambda r: (r["zipBytes"], r["seconds"]))["compression"]
+    elif objective == "balanced":
+        fastest = min(r["seconds"] for r in results)
+        return min([r for r in results if r["seconds"] <= 2 * fastest],
+                   key=lambda r: (r["zipBytes"], r["seconds"]))["compression"]
+    raise RuntimeError("Unknown compression objective %s" % objective)
+
+
+def autoCompression(fname, compression="auto", branchSelection=None):
+    """Benchmark the compressions on the Events tree of fname, return the
+       chosen compression and a JSON record of the choice.
+       compression is auto[:speed|size|balanced]."""
+    objective = compression.split(":")[1] if ":" in compression else "balanced"
+    inFile = ROOT.TFile.Open(fname)
+    tree = inFile.Get("Events")
+    if tree == None:
+        tree = inFile.Get("Friends")
+    results = benchmarkCompression(tree, branchSelection=branchSelection)
+    inFile.Close()
+    chosen = chooseCompression(results, objective)
+    print("Compression benchmark on %d entries of %s:" % (results[0]["entries"], fname))
+    for r in results:
+        print("  %-8s ratio %6.2f, %8.1f MB/s%s" % (
+            r["compression"], r["ratio"], r["throughput"] / 1048576., "  <-- chosen (%s)" % objective if r["compression"] == chosen else ""))
+    return chosen, json.dumps(dict(chosen=chosen, objective=objective, sample=fname, results=results))
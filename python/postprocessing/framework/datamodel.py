@@ -1,24 +1,29 @@
-from PhysicsTools.NanoAODTools.postprocessing.framework.treeReaderArrayTools import InputTree
+from PhysicsTools.NanoAODTools.postprocessing.framework.treeReaderArrayTools import InputTree, accessorTable, getAccessor, useBranch
 import ROOT
 import math
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 
 
-class Event:
+class Event(object):
     """Class that allows seeing an entry of a PyROOT TTree as an Event"""
+    __slots__ = ('_tree', '_entry', '_getters', '__dict__')
 
     def __init__(self, tree, entry):
         self._tree = tree
         self._entry = entry
+        self._getters = accessorTable(tree, "")
         self._tree.gotoEntry(entry)
 
     def __getattr__(self, name):
-        if name in self.__dict__:
-            return self.__dict__[name]
-        return self._tree.readBranch(name)
+        if name[:2] == "__" and name[-2:] == "__":
+            raise AttributeError(name)
+        getter = self._getters.get(name)
+        if getter is None:
+            getter = getAccessor(self._tree, self._getters, "", name)
+        return getter(self, None)
 
     def __getitem__(self, attr):
-        return self.__getattr__(attr)
+        return getattr(self, attr)
 
     def eval(self, expr):
         """Evaluate an expression, as TTree::Draw would do. 
@@ -36,6 +41,8 @@ class Event:
                                     message='creating converter for unknown type "const char\*\[\]"$')
         if expr not in self._tree._exprs:
             formula = ROOT.TTreeFormula(expr, expr, self._tree)
+            for i in range(formula.GetNcodes()):
+                useBranch(self._tree, formula.GetLeaf(i).GetBranch().GetName())
             if formula.IsInteger():
                 formula.go = formula.EvalInstance64
             else:
@@ -53,29 +60,29 @@ class Event:
         return formula.go()
 
 
-class Object:
+class Object(object):
     """Class that allows seeing a set branches plus possibly an index as an Object"""
+    __slots__ = ('_event', '_prefix', '_index', '_getters', '__dict__')
 
     def __init__(self, event, prefix, index=None):
         self._event = event
         self._prefix = prefix + "_"
         self._index = index
+        self._getters = accessorTable(event._tree, self._prefix)
 
     def __getattr__(self, name):
-        if name in self.__dict__:
-            return self.__dict__[name]
         if name[:2] == "__" and name[-2:] == "__":
-            raise AttributeError
-        val = getattr(self._event, self._prefix + name)
-        if self._index != None:
-            val = val[self._index]
-        # convert char to integer number
-        val = ord(val) if type(val) == str else val
+            raise AttributeError(name)
+        getter = self._getters.get(name)
+        if getter is None:
+            getter = getAccessor(self._event._tree, self._getters, self._prefix, name)
+        # the accessor converts char to integer number
+        val = getter(self._event, self._index)
         self.__dict__[name] = val  # cache
         return val
 
     def __getitem__(self, attr):
-        return self.__getattr__(attr)
+        return getattr(self, attr)
 
     def p4(self, corr_pt=None):
         ret = ROOT.TLorentzVector()
@@ -106,7 +113,9 @@ class Object:
         return self.__repr__()
 
 
-class Collection:
+class Collection(object):
+    __slots__ = ('_event', '_prefix', '_len', '_cache', '__dict__')
+
     def __init__(self, event, prefix, lenVar=None):
         self._event = event
         self._prefix = prefix
@@ -1,5 +1,8 @@
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Event
-from PhysicsTools.NanoAODTools.postprocessing.framework.treeReaderArrayTools import clearExtraBranches
+from PhysicsTools.NanoAODTools.postprocessing.framework.treeReaderArrayTools import clearExtraBranches, pruneBranches, setCacheBranches, usedBranches
+from PhysicsTools.NanoAODTools.postprocessing.framework.batch import EventBatch
+import numpy
+import re
 import sys
 import time
 import ROOT
@@ -39,6 +42,18 @@ class Module(object):
         """process event, return True (go to next module) or False (fail, go to next event)"""
         pass
 
+    # Modules can optionally define
+    #
+    #   def analyzeBatch(self, batch):
+    #       """process an EventBatch, return a boolean array (one per entry) or None to accept all"""
+    #
+    # which is used instead of analyze when eventLoop runs with a batchSize.
+    #
+    #   def preselection(self):
+    #       """a TTreeFormula expression of input branches, true for all the events analyze can accept, or None"""
+    #
+    # which the PostProcessor adds to the pre-selection cut (see pushDownPreselection).
+
     def addObject(self, obj):
         setattr(self, obj.GetName(), obj)
         self.objs.append(getattr(self, obj.GetName()))
@@ -53,9 +68,53 @@ class Module(object):
         setattr(self, obj.GetName(), objlist)
 
 
-def eventLoop(modules, inputFile, outputFile, inputTree, wrappedOutputTree, maxEvents=-1, eventRange=None, progress=(10000, sys.stdout), filterOutput=True):
+def hasBatchInterface(module):
+    return callable(getattr(module, 'analyzeBatch', None))
+
+
+_expressionToken = re.compile(
+    r"(\d+\.?\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)|([A-Za-z_]\w*(?:::\w+)*)(\s*\()?")
+
+
+def expressionBranches(expression):
+    """names of the branches used in a TTreeFormula expression (not the numbers and functions)"""
+    return set(m.group(2) for m in _expressionToken.finditer(expression) if m.group(2) and not m.group(3))
+
+
+def pushDownPreselection(modules, inputTree):
+    """Return the preselection expressions of the modules which can be
+       evaluated before the event loop, and the branches they read.
+
+       An expression is kept if all its names are branches of inputTree, so
+       that it doesn't depend on the previous modules (unless they make
+       branches with the same names, which the OutputTree then refuses,
+       see OutputTree.protectBranches), and if no previous module writes to
+       a histogram file, as its histograms would miss the events removed.
+    """
+    expressions, branches = [], set()
+    for m in modules:
+        if getattr(m, 'writeHistFile', False):
+            break
+        expression = m.preselection() if callable(getattr(m, 'preselection', None)) else None
+        if not expression:
+            continue
+        names = expressionBranches(expression)
+        missing = [name for name in names if not inputTree.GetBranch(name)]
+        if missing:
+            print("Not using the preselection %s of %s, missing branches %s" % (
+                expression, m.__class__.__name__, ", ".join(sorted(missing))))
+            continue
+        expressions.append(expression)
+        branches |= names
+    return expressions, branches
+
+
+def eventLoop(modules, inputFile, outputFile, inputTree, wrappedOutputTree, maxEvents=-1, eventRange=None, progress=(10000, sys.stdout), filterOutput=True, batchSize=None, learnBranchUsage=None, profiler=None, memoryMonitor=None, metrics=None):
     for m in modules:
         m.beginFile(inputFile, outputFile, inputTree, wrappedOutputTree)
+    if wrappedOutputTree != None:
+        wrappedOutputTree.layoutBranches()
+    readerVersion = inputTree._ttreereaderversion
 
     t0 = time.time()
     tlast = t0
@@ -67,28 +126,162 @@ def eventLoop(modules, inputFile, outputFile, inputTree, wrappedOutputTree, maxE
     if maxEvents > 0:
         entries = min(entries, maxEvents)
 
-    for ie, i in enumerate(range(entries) if eventRange == None else eventRange):
-        if maxEvents > 0 and ie >= maxEvents:
-            break
-        e = Event(inputTree, i)
-        clearExtraBranches(inputTree)
-        doneEvents += 1
-        ret = True
-        for m in modules:
-            ret = m.analyze(e)
-            if not ret:
-                break
-        if ret:
-            acceptedEvents += 1
-        if (ret or not filterOutput) and wrappedOutputTree != None:
-            wrappedOutputTree.fill()
-        if progress:
-            if ie > 0 and ie % progress[0] == 0:
-                t1 = time.time()
-                progress[1].write("Processed %8d/%8d entries, %5.2f%% (elapsed time %7.1fs, curr speed %8.3f kHz, avg speed %8.3f kHz), accepted %8d/%8d events (%5.2f%%)\n" % (
-                    ie, entries, ie / float(0.01 * entries), t1 - t0, (progress[0] / 1000.) / (max(t1 - tlast, 1e-9)), ie / 1000. / (max(t1 - t0, 1e-9)), acceptedEvents, doneEvents, acceptedEvents / (0.01 * doneEvents)))
-                tlast = t1
+    indices = range(entries) if eventRange == None else eventRange
+    if maxEvents > 0:
+        indices = indices[:maxEvents]
+    if batchSize and any(hasBatchInterface(m) for m in modules):
+        doneEvents, acceptedEvents = _batchLoop(
+            modules, inputTree, wrappedOutputTree, indices, entries,
+            batchSize, progress, filterOutput, t0, learnBranchUsage, profiler, memoryMonitor, metrics)
+    else:
+        for ie, i in enumerate(indices):
+            e = Event(inputTree, i)
+            clearExtraBranches(inputTree)
+            doneEvents += 1
+            ret = True
+            if profiler != None:
+                ret = profiler.analyze(modules, e)
+            else:
+                for m in modules:
+                    ret = m.analyze(e)
+                    if not ret:
+                        break
+            if ret:
+                acceptedEvents += 1
+                if profiler != None:
+                    profiler.accepted()
+            if (ret or not filterOutput) and wrappedOutputTree != None:
+                wrappedOutputTree.fill()
+            if learnBranchUsage and doneEvents == learnBranchUsage:
+                _pruneInputBranches(inputTree, wrappedOutputTree, doneEvents)
+            if memoryMonitor != None:
+                memoryMonitor.event()
+            if metrics != None:
+                metrics.update(doneEvents, acceptedEvents)
+            if progress:
+                if ie > 0 and ie % progress[0] == 0:
+                    t1 = time.time()
+                    _printProgress(progress, ie, entries, t0, tlast, t1, progress[0], acceptedEvents, doneEvents)
+                    tlast = t1
+    readerRemakes = inputTree._ttreereaderversion - readerVersion
+    print("The TTreeReader was remade %d times after beginFile, by branches read for the first time" % readerRemakes)
     for m in modules:
         m.endFile(inputFile, outputFile, inputTree, wrappedOutputTree)
+    if metrics != None:
+        metrics.endFile(doneEvents, acceptedEvents, readerRemakes)
 
     return (doneEvents, acceptedEvents, time.time() - t0)
+
+
+def _pruneInputBranches(inputTree, wrappedOutputTree, doneEvents):
+    """disable the input branches not read so far and not copied to the output"""
+    keep = wrappedOutputTree.requiredInputBranches() if wrappedOutputTree != None else set()
+    pruned = pruneBranches(inputTree, keep)
+    print("Disabled %d input branches not read in the first %d entries" % (len(pruned), doneEvents))
+    if not getattr(inputTree, '_cacheBranchesFixed', False):
+        setCacheBranches(inputTree, usedBranches(inputTree) | keep)
+
+
+def _printProgress(progress, ie, entries, t0, tlast, t1, nSinceLast, acceptedEvents, doneEvents):
+    progress[1].write("Processed %8d/%8d entries, %5.2f%% (elapsed time %7.1fs, curr speed %8.3f kHz, avg speed %8.3f kHz), accepted %8d/%8d events (%5.2f%%)\n" % (
+        ie, entries, ie / float(0.01 * entries), t1 - t0, (nSinceLast / 1000.) / (max(t1 - tlast, 1e-9)), ie / 1000. / (max(t1 - t0, 1e-9)), acceptedEvents, doneEvents, acceptedEvents / (0.01 * doneEvents)))
+
+
+def _batchChunks(indices, batchSize):
+    """split indices in chunks of at most batchSize consecutive entries"""
+    chunk = []
+    for i in indices:
+        if chunk and (len(chunk) == batchSize or i != chunk[-1] + 1):
+            yield chunk
+            chunk = []
+        chunk.append(i)
+    if chunk:
+        yield chunk
+
+
+def _batchLoop(modules, inputTree, wrappedOutputTree, indices, entries, batchSize, progress, filterOutput, t0, learnBranchUsage=None, profiler=None, memoryMonitor=None, metrics=None):
+    """Run the modules on chunks of entries.
+
+       Consecutive modules implementing analyzeBatch run vectorized on the
+       whole chunk, the others run event by event on the entries accepted so
+       far. The fillBranch calls are recorded per entry and replayed in entry
+       order when filling the output, so that the output is the same as with
+       the event-by-event loop.
+    """
+    # (implements analyzeBatch, index of the first module, modules)
+    segments = []
+    for im, m in enumerate(modules):
+        isBatch = hasBatchInterface(m)
+        if segments and segments[-1][0] == isBatch:
+            segments[-1][2].append(m)
+        else:
+            segments.append((isBatch, im, [m]))
+
+    tlast = t0
+    doneAtLast = 0  # events processed at tlast
+    doneEvents = 0
+    acceptedEvents = 0
+    for chunk in _batchChunks(indices, batchSize):
+        batch = EventBatch(inputTree, chunk, wrappedOutputTree)
+        for isBatch, offset, segment in segments:
+            if isBatch:
+                if wrappedOutputTree != None:
+                    wrappedOutputTree.record(None)
+                for im, m in enumerate(segment):
+                    if profiler != None:
+                        nBefore = batch.mask.sum()
+                        ret = profiler.analyzeBatch(offset + im, m, batch)
+                    else:
+                        ret = m.analyzeBatch(batch)
+                    if ret is not None:
+                        batch.mask &= numpy.asarray(ret, dtype=bool)
+                    if profiler != None:
+                        profiler.rejected(offset + im, nBefore - batch.mask.sum())
+                continue
+            for k in numpy.flatnonzero(batch.mask):
+                e = batch.events[k]
+                if e is None:
+                    e = batch.events[k] = Event(inputTree, chunk[k])
+                else:
+                    inputTree.gotoEntry(chunk[k])
+                inputTree._extrabranches = batch.extrabranches[k]
+                if wrappedOutputTree != None:
+                    wrappedOutputTree.record(batch.records[k])
+                if profiler != None:
+                    if not profiler.analyze(segment, e, offset):
+                        batch.mask[k] = False
+                    continue
+                for m in segment:
+                    if not m.analyze(e):
+                        batch.mask[k] = False
+                        break
+
+        if wrappedOutputTree != None:
+            wrappedOutputTree.record(None)
+        if profiler != None:
+            profiler.accepted(batch.mask.sum())
+        for k, i in enumerate(chunk):
+            ret = batch.mask[k]
+            if ret:
+                acceptedEvents += 1
+            if (ret or not filterOutput) and wrappedOutputTree != None:
+                inputTree.gotoEntry(i)
+                inputTree._extrabranches = batch.extrabranches[k]
+                wrappedOutputTree.replay(batch.records[k])
+                wrappedOutputTree.fill()
+        clearExtraBranches(inputTree)
+
+        if progress and (doneEvents + len(chunk)) // progress[0] > doneEvents // progress[0]:
+            t1 = time.time()
+            _printProgress(progress, doneEvents + len(chunk), entries, t0, tlast, t1,
+                           doneEvents + len(chunk) - doneAtLast, acceptedEvents, doneEvents + len(chunk))
+            tlast = t1
+            doneAtLast = doneEvents + len(chunk)
+        if learnBranchUsage and doneEvents < learnBranchUsage <= doneEvents + len(chunk):
+            _pruneInputBranches(inputTree, wrappedOutputTree, doneEvents + len(chunk))
+        if memoryMonitor != None:
+            memoryMonitor.event(len(chunk))
+        if metrics != None:
+            metrics.update(doneEvents + len(chunk), acceptedEvents)
+        doneEvents += len(chunk)
+    return doneEvents, acceptedEvents
@@ -0,0 +1,109 @@
+import json
+import time
+from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
+from PhysicsTools.NanoAODTools.postprocessing.framework.profiler import moduleLabel
+
+
+class FilterGroup(Module):
+    """Modules used as filters which can run in any order, run in the
+       order rejecting the events at the lowest cost.
+
+       The modules of the group must be commutative: each one can be called on
+       any event reaching the group, whatever the others return, and doesn't
+       use what the others compute. During the first learnEvents events all
+       of them are called on every event, measuring the time per call and the
+       fraction of events passing each one; they are then run in increasing
+       order of time / (1 - pass fraction), which minimizes the expected time
+       per event for independent filters, stopping at the first rejection.
+
+       The chosen order is printed and written in the output file as the
+       JSON string FilterOrder (FilterOrder_<name> if name is set).
+       beginFile and endFile are always called in the given order.
+    """
+
+    def __init__(self, filters, learnEvents=1000, name=None):
+        Module.__init__(self)
+        self.filters = list(filters)
+        self.learnEvents = learnEvents
+        self.name = name
+        self.labels = [moduleLabel(i, m) for i, m in enumerate(self.filters)]
+        self.writeHistFile = any(getattr(m, 'writeHistFile', False) for m in self.filters)
+        self.order = list(range(len(self.filters)))
+        self.calls = [0] * len(self.filters)
+        self.passed = [0] * len(self.filters)
+        self.seconds = [0.] * len(self.filters)
+        self._nLearned = 0
+        self._learning = learnEvents > 0 and len(self.filters) > 1
+
+    def beginJob(self, histFile=None, histDirName=None):
+        for m in self.filters:
+            if getattr(m, 'writeHistFile', False):
+                m.beginJob(histFile=histFile, histDirName=histDirName)
+            else:
+                m.beginJob()
+
+    def endJob(self):
+        for m in self.filters:
+            m.endJob()
+
+    def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+        for m in self.filters:
+            m.beginFile(inputFile, outputFile, inputTree, wrappedOutputTree)
+
+    def endFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+        for m in self.filters:
+            m.endFile(inputFile, outputFile, inputTree, wrappedOutputTree)
+        if wrappedOutputTree != None and hasattr(wrappedOutputTree, 'setMetadata'):
+            wrappedOutputTree.setMetadata(
+                "FilterOrder_%s" % self.name if self.name else "FilterOrder", json.dumps(self.summary()))
+
+    def preselection(self):
+        expressions = [m.preselection() for m in self.filters if callable(getattr(m, 'preselection', None))]
+        expressions = ["(%s)" % e for e in expressions if e]
+        return " && ".join(expressions) if expressions else None
+
+    def analyze(self, event):
+        if self._learning:
+            return self._learn(event)
+        for i in self.order:
+            if not self.filters[i].analyze(event):
+                return False
+        return True
+
+    def _learn(self, event):
+        """call all the filters on event, measuring them"""
+        ret = True
+        for i, m in enumerate(self.filters):
+            t0 = time.time()
+            passed = m.analyze(event)
+            self.seconds[i] += time.time() - t0
+            self.calls[i] += 1
+            if passed:
+                self.passed[i] += 1
+            else:
+                ret = False
+        self._nLearned += 1
+        if self._nLearned >= self.learnEvents:
+            self._learning = False
+            self.order = sorted(range(len(self.filters)), key=self._rank)
+            print("Filter order%s after %d events: %s" % (
+                " of %s" % self.name if self.name else "", self._nLearned,
+                ", ".join(self.labels[i] for i in self.order)))
+        return ret
+
+    def _rank(self, i):
+        """expected time spent per rejected event, (time per call, index) for the ones rejecting nothing"""
+        timePerCall = self.seconds[i] / self.calls[i] if self.calls[i] else 0.
+        rejectRate = 1. - float(self.passed[i]) / self.calls[i] if self.calls[i] else 0.
+        if rejectRate <= 0.:
+            return (float('inf'), timePerCall, i)
+        return (timePerCall / rejectRate, timePerCall, i)
+
+    def summary(self):
+        """The order and the measured time per call and pass fraction of each filter"""
+        return dict(
+            learnEvents=self._nLearned, order=[self.labels[i] for i in self.order],
+            filters=[dict(module=self.labels[i], calls=self.calls[i],
+                          passFraction=float(self.passed[i]) / self.calls[i] if self.calls[i] else 1.,
+                          timePerCall=self.seconds[i] / self.calls[i] if self.calls[i] else 0.)
+                     for i in range(len(self.filters))])
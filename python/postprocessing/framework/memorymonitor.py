@@ -0,0 +1,136 @@
+import inspect
+import json
+import os
+import resource
+try:
+    import tracemalloc
+except ImportError:  # python 2
+    tracemalloc = None
+
+
+def currentRSS():
+    """Resident set size of this process in bytes (the peak one if /proc is not available)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def linearFit(xs, ys):
+    """Return slope and r^2 of the least squares line through the points (xs, ys)"""
+    n = len(xs)
+    if n < 2:
+        return 0., 0.
+    mx = sum(xs) / float(n)
+    my = sum(ys) / float(n)
+    sxx = sum((x - mx) ** 2 for x in xs)
+    syy = sum((y - my) ** 2 for y in ys)
+    sxy = sum((x - mx) * (y - my) for x, y in zip(xs, ys))
+    if sxx == 0:
+        return 0., 0.
+    return sxy / sxx, (sxy * sxy / (sxx * syy) if syy else 0.)
+
+
+class MemoryMonitor:
+    """Sample the memory of the process every sampleEvery events.
+
+       The RSS is always sampled; with tracemalloc (python 3) also the Python
+       heap, with the memory still allocated from the source file of each
+       module class, and the top allocators since the first sample.
+       A module is flagged as leaking if the memory retained by its file grows
+       linearly (r^2 > minR2) by more than minBytesPerEvent per event.
+    """
+
+    def __init__(self, modules, sampleEvery=10000, traceHeap=True, minBytesPerEvent=1., minR2=0.9, nTop=10):
+        self.sampleEvery = sampleEvery
+        self.minBytesPerEvent = minBytesPerEvent
+        self.minR2 = minR2
+        self.nTop = nTop
+        self.traceHeap = traceHeap and tracemalloc != None
+        # source file -> names of the module classes defined there
+        self.moduleFiles = {}
+        for m in modules:
+            try:
+                fname = inspect.getsourcefile(type(m))
+            except TypeError:
+                continue
+            if fname:
+                names = self.moduleFiles.setdefault(os.path.abspath(fname), [])
+                if type(m).__name__ not in names:
+                    names.append(type(m).__name__)
+        self.nEvents = 0
+        self.samples = []
+        self._firstSnapshot = None
+        self._lastSnapshot = None
+
+    def start(self):
+        if self.traceHeap and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.sample()
+
+    def stop(self):
+        if self.traceHeap and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def event(self, n=1):
+        """Count n processed events, sampling when passing a multiple of sampleEvery"""
+        before = self.nEvents
+        self.nEvents += n
+        if self.nEvents // self.sampleEvery > before // self.sampleEvery:
+            self.sample()
+
+    def sample(self):
+        sample = dict(events=self.nEvents, rss=currentRSS())
+        if self.traceHeap:
+            snapshot = tracemalloc.take_snapshot()
+            sample["heap"] = tracemalloc.get_traced_memory()[0]
+            perFile = dict((fname, 0) for fname in self.moduleFiles)
+            for stat in snapshot.statistics("filename"):
+                fname = os.path.abspath(stat.traceback[0].filename)
+                if fname in perFile:
+                    perFile[fname] = stat.size
+            sample["modules"] = perFile
+            if self._firstSnapshot == None:
+                self._firstSnapshot = snapshot
+            self._lastSnapshot = snapshot
+        self.samples.append(sample)
+
+    def summary(self):
+        events = [s["events"] for s in self.samples]
+        ret = dict(sampleEvery=self.sampleEvery, samples=self.samples)
+        ret["rssPerEvent"], ret["rssR2"] = linearFit(events, [s["rss"] for s in self.samples])
+        if self.traceHeap and self.samples:
+            ret["heapPerEvent"], ret["heapR2"] = linearFit(events, [s["heap"] for s in self.samples])
+            ret["modules"] = []
+            for fname, names in self.moduleFiles.items():
+                slope, r2 = linearFit(events, [s["modules"][fname] for s in self.samples])
+                ret["modules"].append(dict(
+                    modules=names, file=fname, bytesPerEvent=slope, r2=r2,
+                    retained=self.samples[-1]["modules"][fname],
+                    leaking=(len(self.samples) >= 4 and slope > self.minBytesPerEvent and r2 > self.minR2)))
+            ret["modules"].sort(key=lambda m: -m["bytesPerEvent"])
+            ret["topAllocators"] = [
+                dict(location="%s:%d" % (d.traceback[0].filename, d.traceback[0].lineno), sizeDiff=d.size_diff, size=d.size)
+                for d in self._lastSnapshot.compare_to(self._firstSnapshot, "lineno")[:self.nTop]]
+        return ret
+
+    def printSummary(self):
+        summary = self.summary()
+        print("Memory after %d events: RSS %.1f MB, growing by %.1f bytes/event (r2 %.2f)" % (
+            self.nEvents, self.samples[-1]["rss"] / 1048576. if self.samples else 0, summary["rssPerEvent"], summary["rssR2"]))
+        if "heapPerEvent" not in summary:
+            return
+        print("Python heap %.1f MB, growing by %.1f bytes/event (r2 %.2f)" % (
+            self.samples[-1]["heap"] / 1048576., summary["heapPerEvent"], summary["heapR2"]))
+        for m in summary["modules"]:
+            print("%-50s retained %10d bytes, %8.1f bytes/event (r2 %.2f)%s" % (
+                ",".join(m["modules"]), m["retained"], m["bytesPerEvent"], m["r2"],
+                "  <-- grows linearly with the number of events" if m["leaking"] else ""))
+        print("Top allocators since the first sample:")
+        for a in summary["topAllocators"]:
+            print("  %-80s %+12d bytes (%d total)" % (a["location"], a["sizeDiff"], a["size"]))
+
+    def writeJSON(self, fname):
+        with open(fname, 'w') as f:
+            json.dump(self.summary(), f, indent=1)
@@ -0,0 +1,124 @@
+import json
+import os
+import time
+import ROOT
+from PhysicsTools.NanoAODTools.postprocessing.framework.memorymonitor import currentRSS
+
+
+class MetricsSink:
+    """Periodically write the progress of the job for the job monitoring.
+
+       Every interval seconds the events processed and accepted, the current
+       and average rates, the bytes read from the input files, the RSS and,
+       if a ModuleProfiler is given, the share of the time spent in each
+       module are appended as one line to jsonFile (JSON-lines) and/or written
+       to promFile in the Prometheus text format, to be collected by the
+       textfile collector of a node exporter (the file is replaced atomically).
+       labels are added to every Prometheus metric and JSON line.
+    """
+
+    def __init__(self, jsonFile=None, promFile=None, interval=30., labels={}, profiler=None):
+        self.jsonFile = jsonFile
+        self.promFile = promFile
+        self.interval = interval
+        self.labels = dict(labels)
+        self.profiler = profiler
+        self.filesDone = 0
+        self.readerRemakes = 0  # TTreeReader remakes after beginFile, in all the files
+        self._doneBefore = 0  # in the files already processed
+        self._acceptedBefore = 0
+        self._tstart = None
+        self._tlast = None
+        self._doneLast = 0
+
+    def forWorker(self, iworker, profiler=None):
+        """Return a sink writing to per-worker files, with a worker label"""
+        def workerName(fname):
+            if fname == None:
+                return None
+            base, ext = os.path.splitext(fname)
+            return "%s.worker%d%s" % (base, iworker, ext)
+        labels = dict(self.labels, worker=str(iworker))
+        return MetricsSink(workerName(self.jsonFile), workerName(self.promFile),
+                           self.interval, labels, profiler)
+
+    def start(self):
+        self._tstart = self._tlast = time.time()
+        self._doneLast = 0
+        self.emit(0, 0)
+
+    def update(self, doneEvents, acceptedEvents):
+        """Called by the event loop with the events done and accepted in the current file"""
+        if self._tlast == None:
+            self.start()
+        if time.time() - self._tlast >= self.interval:
+            self.emit(doneEvents, acceptedEvents)
+
+    def endFile(self, doneEvents, acceptedEvents, readerRemakes=0):
+        self._doneBefore += doneEvents
+        self.readerRemakes += readerRemakes
+        self._acceptedBefore += acceptedEvents
+        self.filesDone += 1
+        self.emit(0, 0)
+
+    def metrics(self, doneEvents=0, acceptedEvents=0):
+        """Return the current values as a dict"""
+        now = time.time()
+        if self._tstart == None:
+            self._tstart = self._tlast = now
+        done = self._doneBefore + doneEvents
+        ret = dict(self.labels)
+        ret.update(
+            time=now, eventsProcessed=done,
+            eventsAccepted=self._acceptedBefore + acceptedEvents,
+            eventRate=(done - self._doneLast) / max(now - self._tlast, 1e-9),
+            avgEventRate=done / max(now - self._tstart, 1e-9),
+            bytesRead=ROOT.TFile.GetFileBytesRead(),
+            rss=currentRSS(), filesDone=self.filesDone, readerRemakes=self.readerRemakes)
+        if self.profiler != None:
+            summary = self.profiler.summary()
+            totWall = sum(m["wallTime"] for m in summary)
+            ret["moduleTimeShares"] = dict(
+                (m["module"], m["wallTime"] / totWall if totWall else 0.) for m in summary)
+        return ret
+
+    def emit(self, doneEvents=0, acceptedEvents=0):
+        metrics = self.metrics(doneEvents, acceptedEvents)
+        if self.jsonFile:
+            with open(self.jsonFile, 'a') as f:
+                f.write(json.dumps(metrics, sort_keys=True) + "\n")
+        if self.promFile:
+            tmpName = self.promFile + ".tmp"
+            with open(tmpName, 'w') as f:
+                f.write(self.prometheusText(metrics))
+            os.rename(tmpName, self.promFile)
+        self._tlast = metrics["time"]
+        self._doneLast = metrics["eventsProcessed"]
+
+    def prometheusText(self, metrics):
+        def labelString(extra={}):
+            labels = dict(self.labels, **extra)
+            if not labels:
+                return ""
+            return "{%s}" % ",".join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                     for k, v in sorted(labels.items()))
+        lines = []
+        for name, kind, key, doc in (
+                ("nanoaod_events_processed_total", "counter", "eventsProcessed", "Events processed by the modules"),
+                ("nanoaod_events_accepted_total", "counter", "eventsAccepted", "Events accepted by all the modules"),
+                ("nanoaod_event_rate_hz", "gauge", "eventRate", "Events processed per second since the previous update"),
+                ("nanoaod_event_rate_avg_hz", "gauge", "avgEventRate", "Events processed per second since the start"),
+                ("nanoaod_bytes_read_total", "counter", "bytesRead", "Bytes read from the input files"),
+                ("nanoaod_rss_bytes", "gauge", "rss", "Resident set size of the process"),
+                ("nanoaod_files_done_total", "counter", "filesDone", "Input files completed"),
+                ("nanoaod_reader_remakes_total", "counter", "readerRemakes", "TTreeReader remakes after beginFile"),
+                ("nanoaod_last_update_seconds", "gauge", "time", "Time of the update")):
+            lines += ["# HELP %s %s" % (name, doc), "# TYPE %s %s" % (name, kind),
+                      "%s%s %r" % (name, labelString(), float(metrics[key]))]
+        if "moduleTimeShares" in metrics:
+            name = "nanoaod_module_time_share"
+            lines += ["# HELP %s Fraction of the module time spent in each module" % name,
+                      "# TYPE %s gauge" % name]
+            for module, share in sorted(metrics["moduleTimeShares"].items()):
+                lines.append("%s%s %r" % (name, labelString({"module": module}), float(share)))
+        return "\n".join(lines) + "\n"
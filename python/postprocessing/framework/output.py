@@ -1,68 +1,157 @@
-from PhysicsTools.NanoAODTools.postprocessing.framework.treeReaderArrayTools import setExtraBranch
-from array import array
+from PhysicsTools.NanoAODTools.postprocessing.framework.treeReaderArrayTools import setExtraBranch, LazyValue, currentTreeEntry
+import numpy
 import ROOT
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 
 
-_rootBranchType2PythonArray = {
-    'b': 'B',
-    'B': 'b',
-    'i': 'I',
-    'I': 'i',
-    'F': 'f',
-    'D': 'd',
-    'l': 'L',
-    'L': 'l',
-    'O': 'B'
+_rootBranchType2Numpy = {
+    'b': numpy.uint8,
+    'B': numpy.int8,
+    's': numpy.uint16,
+    'S': numpy.int16,
+    'i': numpy.uint32,
+    'I': numpy.int32,
+    'F': numpy.float32,
+    'D': numpy.float64,
+    'l': numpy.uint64,
+    'L': numpy.int64,
+    'O': numpy.bool_
 }
 
 
+def reduceMantissaToNbitsRounding(values, bits):
+    """Vectorized ReduceMantissaToNbitsRounding(bits), in place on a float32 array"""
+    shift = 23 - bits
+    if shift <= 0:
+        return values
+    i32 = values.view(numpy.uint32)
+    roundUp = ((i32 & numpy.uint32(1 << (shift - 1))) != 0) & (
+        ((i32 & numpy.uint32(0x007FFFFF)) >> numpy.uint32(shift)) < numpy.uint32((1 << bits) - 2))
+    i32 &= numpy.uint32((0xFFFFFFFF >> shift) << shift)
+    i32 += roundUp.astype(numpy.uint32) << numpy.uint32(shift)
+    return values
+
+
 class OutputBranch:
+    """An output branch with a NumPy buffer.
+
+       Besides OutputTree.fillBranch, modules can keep the OutputBranch
+       returned by OutputTree.branch and fill it with set(values), which
+       copies all the values at once, sets the length branch and only makes
+       the values readable by later modules (as event attributes) if the
+       branch was created with export=True.
+    """
+
     def __init__(
             self, tree, name, rootBranchType, n=1,
-            lenVar=None, title=None, limitedPrecision=False
+            lenVar=None, title=None, limitedPrecision=False,
+            counter=None, owner=None, export=False
     ):
         n = int(n)
-        self.buff = array(
-            _rootBranchType2PythonArray[rootBranchType], n * [0. if rootBranchType in 'FD' else 0])
+        self.name = name
+        self.rootBranchType = rootBranchType
+        self.title = title
+        self.buff = numpy.zeros(max(n, 1), dtype=_rootBranchType2Numpy[rootBranchType])
         self.lenVar = lenVar
+        self.counter = counter  # the OutputBranch of lenVar, if made by the OutputTree
         self.n = n
+        self.owner = owner
+        self.export = export
+        self.precisionBits = limitedPrecision if limitedPrecision and rootBranchType == 'F' else None
         self.precision = ROOT.ReduceMantissaToNbitsRounding(
-            limitedPrecision) if limitedPrecision and rootBranchType == 'F' else lambda x: x
+            limitedPrecision) if self.precisionBits else lambda x: x
+        self._lazy = LazyValue(self.value)
+        # check that the values fit, for types narrowed by an OutputPolicy
+        self.checkRange = False
+        self.branch = None
+        if tree is not None:
+            self.attach(tree)
+
+    def attach(self, tree):
+        """Make the branch in tree (done in the constructor, unless tree is None)"""
+        name, rootBranchType = self.name, self.rootBranchType
         # check if a branch was already there
         existingBranch = tree.GetBranch(name)
         if (existingBranch):
             self.branch = existingBranch
             self.branch.SetAddress(self.buff)
         else:
-            if lenVar != None:
+            if self.lenVar != None:
                 self.branch = tree.Branch(
-                    name, self.buff, "%s[%s]/%s" % (name, lenVar, rootBranchType))
-            elif n == 1:
+                    name, self.buff, "%s[%s]/%s" % (name, self.lenVar, rootBranchType))
+            elif self.n == 1:
                 self.branch = tree.Branch(
                     name, self.buff, name + "/" + rootBranchType)
             else:
                 self.branch = tree.Branch(
-                    name, self.buff, "%s[%d]/%s" % (name, n, rootBranchType))
-        if title:
-            self.branch.SetTitle(title)
+                    name, self.buff, "%s[%d]/%s" % (name, self.n, rootBranchType))
+        if self.title:
+            self.branch.SetTitle(self.title)
 
     def fill(self, val):
+        """Copy val to the buffer, return the number of values"""
+        if not hasattr(val, '__len__') and hasattr(val, '__iter__'):
+            val = list(val)  # e.g. a generator, consumed once
+        if self.checkRange:
+            self._checkRange(val)
         if self.lenVar:
-            if len(self.buff) < len(val):  # realloc
-                self.buff = array(self.buff.typecode, max(
-                    len(val), 2 * len(self.buff)) * [0. if self.buff.typecode in 'fd' else 0])
-                self.branch.SetAddress(self.buff)
-            for i, v in enumerate(val):
-                self.buff[i] = self.precision(v)
+            nVal = len(val)
+            if len(self.buff) < nVal:  # realloc
+                self.buff = numpy.zeros(max(nVal, 2 * len(self.buff)), dtype=self.buff.dtype)
+                if self.branch:
+                    self.branch.SetAddress(self.buff)
+            if nVal:
+                self.buff[:nVal] = val
+                if self.precisionBits:
+                    reduceMantissaToNbitsRounding(self.buff[:nVal], self.precisionBits)
+            return nVal
         elif self.n == 1:
             self.buff[0] = self.precision(val)
+            return 1
         else:
             if len(val) != self.n:
                 raise RuntimeError("Mismatch in filling branch %s of fixed length %d with %d values (%s)" % (
-                    self.branch.GetName(), self.n, len(val), val))
-            for i, v in enumerate(val):
-                self.buff[i] = v
+                    self.name, self.n, len(val), val))
+            self.buff[:] = val
+            if self.precisionBits:
+                reduceMantissaToNbitsRounding(self.buff, self.precisionBits)
+            return self.n
+
+    def setCount(self, n):
+        """Fill a branch used as the length of array branches"""
+        if self.checkRange:
+            self._checkRange(n)
+        self.buff[0] = n
+
+    def _checkRange(self, val):
+        vals = numpy.asarray(val if hasattr(val, '__len__') else [val])
+        if vals.size:
+            info = numpy.iinfo(self.buff.dtype)
+            if vals.min() < info.min or vals.max() > info.max:
+                raise RuntimeError("Values out of the range of branch %s (%s): %s" % (self.name, self.buff.dtype, val))
+
+    def set(self, values):
+        """Fill the branch with values (a sequence or NumPy array for array branches)"""
+        owner = self.owner
+        if owner is not None and owner._recorder is not None:
+            owner._recordSet(self, values)
+            return
+        nVal = self.fill(values)
+        if self.counter is not None:
+            self.counter.setCount(nVal)
+        if self.export:
+            extra = owner._intree._extrabranches
+            extra[self.name] = self._lazy
+            if self.counter is not None:
+                extra[self.lenVar] = self.counter._lazy
+
+    def value(self):
+        """Current value of the branch, as filled for this event"""
+        if self.lenVar:
+            return self.buff[:int(self.counter.buff[0])].copy() if self.counter is not None else self.buff.copy()
+        elif self.n == 1:
+            return self.buff[0].item()
+        return self.buff.copy()
 
 
 class OutputTree:
@@ -71,37 +160,225 @@ class OutputTree:
         self._tree = ttree
         self._intree = intree
         self._branches = {}
+        self._recorder = None
+        self._policy = None  # OutputPolicy
+        self._basketBudget = None
+        self._nFilled = 0
+        self._systematics = None  # axis of the systematics layout
+        self._pendingSyst = []  # branches waiting for layoutBranches
+        self._metadata = {}  # strings written with the tree
+        self._flushEvery = None
+        self._flush = None
+        self._protected = set()  # branches the modules can't make
+
+    def setMetadata(self, name, text):
+        """Write the string text as the TObjString name in the output file, with the tree"""
+        self._metadata[name] = text
+
+    def setBasketBudget(self, budget):
+        """Size the baskets and autoflush with a BasketBudget after its warmup entries"""
+        self._basketBudget = budget
+
+    def protectBranches(self, names):
+        """Refuse to make branches with these names, e.g. read by the pre-selection"""
+        self._protected = set(names)
+
+    def setFlush(self, every, flush):
+        """Call flush() every this many filled entries, e.g. to send the output written so far"""
+        self._flushEvery = every
+        self._flush = flush
+
+    def _countFill(self):
+        self._nFilled += 1
+        if self._basketBudget and self._nFilled == self._basketBudget.warmup:
+            self._basketBudget.apply(self._tree, self._nFilled)
+        if self._flushEvery and self._nFilled % self._flushEvery == 0:
+            self._flush()
+
+    def setOutputPolicy(self, policy):
+        """Narrow the types and limit the precision of the branches made from now on as set by policy"""
+        self._policy = policy
+
+    def _makeBranch(self, tree, name, rootBranchType, **kwargs):
+        """Make an OutputBranch, applying the OutputPolicy to new branches"""
+        if self._policy == None or self._tree.GetBranch(name):
+            return OutputBranch(tree, name, rootBranchType, **kwargs)
+        narrowedType, kwargs['limitedPrecision'] = self._policy.apply(
+            name, rootBranchType, kwargs.get('limitedPrecision', False))
+        br = OutputBranch(tree, name, narrowedType, **kwargs)
+        br.checkRange = narrowedType != rootBranchType and narrowedType != 'O'
+        return br
+
+    def setSystematicsLayout(self, systNames):
+        """Store the single-value branches named <variable>_<syst>, with syst
+           in systNames, as one array branch <variable> of len(systNames)
+           values, in the order of systNames, which is written to the
+           output file as the SystematicsAxis string. Variables with only one
+           of the systematics stay single-value branches.
+           The modules still fill (and read back) them by their full name.
+        """
+        self._systematics = list(systNames)
+        self.setMetadata("SystematicsAxis", ",".join(self._systematics))
+
+    def _splitSystematic(self, name):
+        """Return (variable, syst) if name ends with one of the systematics, else None"""
+        best = None
+        for syst in self._systematics:
+            if name.endswith("_" + syst) and len(name) > len(syst) + 1 and (best == None or len(syst) > len(best)):
+                best = syst
+        return (name[:-len(best) - 1], best) if best != None else None
+
+    def layoutBranches(self):
+        """Make the array branches of the systematics layout, once all the modules made their branches"""
+        if not self._pendingSyst:
+            return
+        pending, self._pendingSyst = self._pendingSyst, []
+        # the length of array branches must stay a branch
+        lenVars = set(br.lenVar for br in self._branches.values() if br.lenVar)
+        groups = {}
+        variables = []
+        for br in pending:
+            if br.name in lenVars:
+                br.attach(self._tree)
+                continue
+            variable, syst = self._splitSystematic(br.name)
+            if variable not in groups:
+                variables.append(variable)
+                groups[variable] = []
+            groups[variable].append((syst, br))
+        for variable in variables:
+            members = groups[variable]
+            # a single variation (e.g. <weight>_nominal, with _up and _down
+            # not on the axis) stays a scalar branch
+            if len(members) < 2 or (variable in self._branches) or self._tree.GetBranch(variable) or len(
+                    set(br.rootBranchType for syst, br in members)) > 1:
+                for syst, br in members:
+                    br.attach(self._tree)
+                continue
+            array = OutputBranch(
+                self._tree, variable, members[0][1].rootBranchType, n=len(self._systematics),
+                title="%s for each systematic variation in SystematicsAxis" % variable)
+            self._branches[variable] = array
+            for syst, br in members:
+                index = self._systematics.index(syst)
+                # filling the branch fills its element of the array
+                br.buff = array.buff[index:index + 1]
 
     def branch(
             self, name, rootBranchType, n=1, lenVar=None,
-            title=None, limitedPrecision=False
+            title=None, limitedPrecision=False, export=False
     ):
+        """Make an output branch and return it.
+
+           The values can be filled with fillBranch(name, val), which also
+           makes them readable from the event by the following modules, or
+           with set(val) of the returned OutputBranch, which does that only
+           if export is True.
+        """
+        if name in self._protected or lenVar in self._protected:
+            raise RuntimeError(
+                "Branch %s is read by the preselection of a module, which was applied before the event loop: "
+                "it can't be changed by the modules (run without --push-down)" % (name if name in self._protected else lenVar))
         # and (not self._tree.GetBranch(lenVar)):
         if (lenVar != None) and (lenVar not in self._branches):
-            self._branches[lenVar] = OutputBranch(self._tree, lenVar, "i")
-        self._branches[name] = OutputBranch(
+            self._branches[lenVar] = self._makeBranch(self._tree, lenVar, "i", owner=self, export=export)
+        if self._systematics and n == 1 and lenVar == None and (not self._tree.GetBranch(name)) and self._splitSystematic(name):
+            # made by layoutBranches
+            self._branches[name] = self._makeBranch(
+                None, name, rootBranchType, title=title, limitedPrecision=limitedPrecision,
+                owner=self, export=export)
+            self._pendingSyst.append(self._branches[name])
+            return self._branches[name]
+        self._branches[name] = self._makeBranch(
             self._tree, name, rootBranchType, n=n,
-            lenVar=lenVar, title=title, limitedPrecision=limitedPrecision
+            lenVar=lenVar, title=title, limitedPrecision=limitedPrecision,
+            counter=self._branches.get(lenVar), owner=self, export=export
         )
         return self._branches[name]
 
     def fillBranch(self, name, val):
         br = self._branches[name]
-        if br.lenVar and (br.lenVar in self._branches):
-            self._branches[br.lenVar].buff[0] = len(val)
+        if self._recorder is not None:
+            if not hasattr(val, '__len__') and hasattr(val, '__iter__'):
+                val = list(val)  # e.g. a map object, consumed once
+            self._recorder.append((name, val))
+            if br.counter is not None:
+                setExtraBranch(self._intree, br.lenVar, len(val))
+            setExtraBranch(self._intree, name, val)
+            return
+        if br.counter is not None:
+            if not hasattr(val, '__len__'):
+                val = list(val)
+            br.counter.setCount(br.fill(val))
             setExtraBranch(self._intree, br.lenVar, len(val))
-        br.fill(val)
+        else:
+            br.fill(val)
         setExtraBranch(self._intree, name, val)
 
+    def countBranch(self, name):
+        """Name of the count branch made and filled with the branch name, None if it has none"""
+        br = self._branches.get(name)
+        return br.lenVar if br is not None and br.counter is not None else None
+
+    def _recordSet(self, br, values):
+        """OutputBranch.set while recording"""
+        if br.lenVar or br.n != 1:
+            # a copy, the caller may reuse its array
+            values = numpy.array(values if hasattr(values, '__len__') else list(values), dtype=br.buff.dtype)
+        self._recorder.append((br.name, values))
+        if br.export:
+            if br.counter is not None:
+                setExtraBranch(self._intree, br.lenVar, len(values))
+            setExtraBranch(self._intree, br.name, values)
+
+    def record(self, calls):
+        """Append the following fillBranch calls to the list calls instead of
+           filling the buffers (None to go back to filling directly)"""
+        self._recorder = calls
+
+    def replay(self, calls):
+        for name, val in calls:
+            br = self._branches[name]
+            nVal = br.fill(val)
+            if br.counter is not None:
+                br.counter.setCount(nVal)
+
     def tree(self):
         return self._tree
 
+    def requiredInputBranches(self):
+        """names of the input branches copied to the output"""
+        return set()
+
     def fill(self):
         self._tree.Fill()
+        if self._basketBudget or self._flushEvery:
+            self._countFill()
 
     def write(self):
         self._file.cd()
         self._tree.Write()
+        # TObjStrings, which haddnano.py keeps when merging
+        for name, text in self._metadata.items():
+            self._file.WriteTObject(ROOT.TObjString(text), name)
+
+
+_readBranchesCode = """
+#include "TObjArray.h"
+#include "TBranch.h"
+
+namespace nanoOutput {
+// Read entry of each branch of branches, return false on read errors
+bool readBranches(const TObjArray &branches, Long64_t entry) {
+   bool ok = true;
+   for (TObject *obj : branches) {
+      if (static_cast<TBranch *>(obj)->GetEntry(entry) < 0) ok = false;
+   }
+   return ok;
+}
+}
+"""
+_readBranchesDeclared = False
 
 
 class FullOutput(OutputTree):
@@ -123,6 +400,11 @@ class FullOutput(OutputTree):
         self.outputbranchSelection = outputbranchSelection
         self.maxEntries = maxEntries
         self.firstEntry = firstEntry
+        # only the branches active in inputTree are cloned, so the output
+        # branch selection is applied here rather than with a second copy
+        # of the output tree when writing it
+        if outputbranchSelection:
+            outputbranchSelection.selectBranches(inputTree)
         if fullClone:
             outputTree = inputTree.CopyTree(
                 '1', "", maxEntries if maxEntries else ROOT.TVirtualTreePlayer.kMaxEntries, firstEntry)
@@ -137,44 +419,104 @@ class FullOutput(OutputTree):
 
         OutputTree.__init__(self, outputFile, outputTree, inputTree)
         self._inputTree = inputTree
+        self._copiedBranches = set(b.GetName() for b in outputTree.GetListOfBranches())
+        self._setReadBranches(inputTree)
+        # branches made by the modules, still to be checked against outputbranchSelection
+        self._selectionPending = False
+        self.provenance = provenance
         self._otherTrees = {}
         self._otherObjects = {}
+        self._addOtherObjects(inputFile, firstEntry, jsonFilter)
+
+    def _addOtherObjects(self, inputFile, firstEntry=0, jsonFilter=None):
+        """Copy the trees and objects of inputFile other than Events, the
+           entries of the trees are added to the ones already copied"""
         for k in inputFile.GetListOfKeys():
             kn = k.GetName()
             if kn == "Events":
                 continue  # this we are doing
             elif kn in ("MetaData", "ParameterSets"):
-                if provenance:
+                if self.provenance:
                     # treat content of other trees as if associated to event 0
-                    self._otherTrees[kn] = inputFile.Get(
-                        kn).CopyTree('1' if firstEntry == 0 else '0')
+                    self._copyOtherTree(kn, inputFile.Get(kn), firstEntry == 0)
             elif kn in ("LuminosityBlocks", "Runs"):
                 if not jsonFilter:
-                    self._otherTrees[kn] = inputFile.Get(
-                        kn).CopyTree('1' if firstEntry == 0 else '0')
-                elif firstEntry == 0:
-                    _isRun = (kn == "Runs")
+                    self._copyOtherTree(kn, inputFile.Get(kn), firstEntry == 0)
+                else:
+                    # an empty tree for the parts of split files after the
+                    # first, so that all the parts can be merged
                     _it = inputFile.Get(kn)
-                    _ot = _it.CloneTree(0)
-                    for ev in _it:
-                        if (jsonFilter.filterRunOnly(ev.run) if _isRun else jsonFilter.filterRunLumi(ev.run, ev.luminosityBlock)):
+                    if kn in self._otherTrees:
+                        _ot = self._otherTrees[kn]
+                        _it.CopyAddresses(_ot)
+                    else:
+                        _ot = _it.CloneTree(0)
+                    if firstEntry == 0:
+                        for entry in jsonFilter.filterTree(_it, runOnly=(kn == "Runs")):
+                            _it.GetEntry(int(entry))
                             _ot.Fill()
                     self._otherTrees[kn] = _ot
             elif k.GetClassName() == "TTree":
                 print("Not copying unknown tree %s" % kn)
-            else:
+            elif kn not in self._otherObjects:
                 self._otherObjects[kn] = inputFile.Get(kn)
 
+    def _copyOtherTree(self, name, tree, copyEntries):
+        if name not in self._otherTrees:
+            self._otherTrees[name] = tree.CopyTree('1' if copyEntries else '0')
+        elif copyEntries:
+            self._otherTrees[name].CopyEntries(tree)
+
+    def _setReadBranches(self, inputTree):
+        """Set the input branches read for each entry filled: the ones cloned
+           in the output tree and still active (the readers of the modules
+           read their branches themselves)"""
+        global _readBranchesDeclared
+        if not _readBranchesDeclared:
+            if not ROOT.gInterpreter.Declare(_readBranchesCode):
+                raise RuntimeError("Could not compile the output branch reader")
+            _readBranchesDeclared = True
+        self._readBranches = ROOT.TObjArray()
+        for b in inputTree.GetListOfBranches():
+            if b.GetName() in self._copiedBranches and inputTree.GetBranchStatus(b.GetName()):
+                self._readBranches.Add(b)
+
+    def requiredInputBranches(self):
+        return set(self._copiedBranches)
+
+    def branch(self, *args, **kwargs):
+        ret = OutputTree.branch(self, *args, **kwargs)
+        self._selectionPending = self.outputbranchSelection != None
+        return ret
+
+    def _dropUnselectedBranches(self):
+        """Remove the branches made by the modules that outputbranchSelection drops"""
+        self._selectionPending = False
+        droppedNames = set(self.outputbranchSelection.resolve(self._tree)[1])
+        dropped = [b for b in self._tree.GetListOfBranches() if b.GetName() in droppedNames]
+        if not dropped:
+            return
+        branches, leaves = self._tree.GetListOfBranches(), self._tree.GetListOfLeaves()
+        for b in dropped:
+            for leaf in b.GetListOfLeaves():
+                leaves.Remove(leaf)
+            branches.Remove(b)
+        branches.Compress()
+        leaves.Compress()
+
     def fill(self):
-        self._inputTree.readAllBranches()
+        if self._selectionPending:
+            self._dropUnselectedBranches()
+        if not ROOT.nanoOutput.readBranches(self._readBranches, currentTreeEntry(self._inputTree)):
+            raise RuntimeError("Error reading entry %d of %s" % (
+                currentTreeEntry(self._inputTree), self._inputTree.GetName()))
         self._tree.Fill()
+        if self._basketBudget or self._flushEvery:
+            self._countFill()
 
     def write(self):
-        if self.outputbranchSelection:
-            self.outputbranchSelection.selectBranches(self._tree)
-        self._tree = self.tree().CopyTree('1', "",
-                                          self.maxEntries if self.maxEntries else ROOT.TVirtualTreePlayer.kMaxEntries, self.firstEntry)
-
+        if self._selectionPending:
+            self._dropUnselectedBranches()
         OutputTree.write(self)
         for t in self._otherTrees.values():
             t.Write()
@@ -182,9 +524,175 @@ class FullOutput(OutputTree):
             self._file.WriteTObject(ov, on)
 
 
+class RollingOutput(FullOutput):
+    """FullOutput of all the input files, written directly to a sequence of
+       output files instead of one file per input file merged at the end.
+
+       Once the current output file has maxEntries entries or maxBytes
+       compressed bytes of baskets (checked every checkEvery entries), a new
+       one is started with the next input file: the entries of an input file
+       are never split between output files, so that each output file has
+       the Runs, LuminosityBlocks and other trees of all the input files it
+       has entries of, and the files can be merged without counting a run or
+       lumi twice. An output file can therefore exceed the limits by the
+       output of one input file. The files are named fileNamePattern % index
+       (from 0), they are listed in fileNames. The other objects are taken
+       from the first input file added to each output file.
+    """
+
+    def __init__(self, fileNamePattern, compressionLevel=0, compressionAlgo=None,
+                 maxBytes=None, maxEntries=None, checkEvery=100,
+                 branchSelection=None, outputbranchSelection=None, provenance=False):
+        self.fileNamePattern = fileNamePattern
+        self.compressionLevel = compressionLevel
+        self.compressionAlgo = compressionAlgo
+        self.maxFileBytes = maxBytes
+        self.maxFileEntries = maxEntries
+        self.checkEvery = checkEvery
+        self.branchSelection = branchSelection
+        self.outputbranchSelection = outputbranchSelection
+        self.provenance = provenance
+        self.fileNames = []
+        self._file = None
+        self._rollPending = False
+
+    def _openFile(self):
+        fileName = self.fileNamePattern % len(self.fileNames)
+        outputFile = ROOT.TFile.Open(fileName, "RECREATE", "", self.compressionLevel)
+        if self.compressionLevel:
+            outputFile.SetCompressionAlgorithm(self.compressionAlgo)
+        self.fileNames.append(fileName)
+        return outputFile
+
+    def addInputFile(self, inputFile, inputTree, firstEntry=0, jsonFilter=None):
+        """Continue the output with the entries of inputTree, return the output file now open"""
+        if self._file is None:
+            FullOutput.__init__(
+                self, inputFile, inputTree, self._openFile(),
+                branchSelection=self.branchSelection,
+                outputbranchSelection=self.outputbranchSelection,
+                firstEntry=firstEntry, provenance=self.provenance,
+                jsonFilter=jsonFilter)
+            return self._file
+        missing = [b for b in self._copiedBranches if not inputTree.GetBranch(b)]
+        if missing:
+            raise RuntimeError("Can't add %s to the output %s, the branches %s are missing" % (
+                inputFile.GetName(), self._file.GetName(), ", ".join(sorted(missing))))
+        if self._rollPending:
+            self._roll()
+        # as done by CloneTree for the first input file
+        inputTree.CopyAddresses(self._tree)
+        inputTree.AddClone(self._tree)
+        if self.branchSelection:
+            self.branchSelection.selectBranches(inputTree)
+        self._setReadBranches(inputTree)
+        # the branches made by the modules, also the ones replacing input branches
+        for br in self._branches.values():
+            if br.branch:
+                br.branch.SetAddress(br.buff)
+        self._intree = inputTree
+        self._inputTree = inputTree
+        self._file.cd()
+        self._addOtherObjects(inputFile, firstEntry, jsonFilter)
+        return self._file
+
+    def branch(self, name, *args, **kwargs):
+        if name in self._branches:
+            # made for a previous input file
+            return self._branches[name]
+        return FullOutput.branch(self, name, *args, **kwargs)
+
+    def _roll(self):
+        """Write and close the current output file, continue in a new one"""
+        self._rollPending = False
+        oldFile = self._file
+        newFile = self._openFile()
+        newFile.cd()
+        newTree = self._tree.CloneTree(0)
+        # the old tree is deleted with its file, the new one is connected to
+        # the next input tree by addInputFile
+        self._tree.GetListOfClones().Remove(newTree)
+        # the trees of the input files added next are copied to empty ones
+        newOtherTrees = {}
+        for name, tree in self._otherTrees.items():
+            newOtherTrees[name] = tree.CloneTree(0)
+            tree.GetListOfClones().Remove(newOtherTrees[name])
+        self.write()
+        oldFile.Close()
+        print("Done %s" % oldFile.GetName())
+        self._file = newFile
+        self._tree = newTree
+        self._otherTrees = newOtherTrees
+        self._otherObjects = {}
+        for br in self._branches.values():
+            if br.branch is not None:
+                br.branch = newTree.GetBranch(br.name)
+
+    def fill(self):
+        FullOutput.fill(self)
+        # the next file is started with the next input file, so that there is no empty file at the end
+        n = self._tree.GetEntries()
+        if (self.maxFileEntries and n >= self.maxFileEntries) or (
+                self.maxFileBytes and n % self.checkEvery == 0 and self._tree.GetZipBytes() >= self.maxFileBytes):
+            self._rollPending = True
+
+    def close(self):
+        """Write and close the last output file, return the names of all the output files"""
+        if self._file is not None:
+            self.write()
+            self._file.Close()
+            print("Done %s" % self._file.GetName())
+            self._file = None
+        return self.fileNames
+
+
 class FriendOutput(OutputTree):
     def __init__(self, inputFile, inputTree, outputFile, treeName="Friends"):
         outputFile.cd()
         outputTree = ROOT.TTree(
             treeName, "Friend tree for " + inputTree.GetName())
         OutputTree.__init__(self, outputFile, outputTree, inputTree)
+
+
+class DeltaFriendOutput(FriendOutput):
+    """Friend tree with only the accepted entries and the branches made by the modules.
+
+       The entry number in the input tree of each accepted entry is stored in
+       the branch entry, and the name of the input file in the DeltaFriendOf
+       object, so that the output can be read together with the input file
+       (see joinDeltaFriend) instead of copying all its branches.
+    """
+
+    def __init__(self, inputFile, inputTree, outputFile, treeName="Friends", inputFileName=None):
+        FriendOutput.__init__(self, inputFile, inputTree, outputFile, treeName)
+        # the original name if inputFile is a local copy
+        self._inputFileName = inputFileName if inputFileName else inputFile.GetName()
+        self.setMetadata("DeltaFriendOf", self._inputFileName)
+        self._entry = self.branch("entry", "L")
+
+    def fill(self):
+        self._entry.set(currentTreeEntry(self._intree))
+        FriendOutput.fill(self)
+
+
+def joinDeltaFriend(inputTree, deltaTree):
+    """Add deltaTree, written by DeltaFriendOutput from inputTree, as a friend of inputTree.
+
+       The friend entries are matched through an index on their entry branch,
+       and the entry list of the entries in deltaTree is set on inputTree and
+       returned, so that e.g. inputTree.Draw() only runs on them.
+    """
+    n = deltaTree.GetEntries()
+    elist = ROOT.TEntryList("deltaFriendEntries", "", inputTree)
+    if n:
+        deltaTree.SetEstimate(n + 1)
+        deltaTree.Draw("entry", "", "goff")
+        entries = deltaTree.GetV1()
+        for i in range(n):
+            elist.Enter(int(entries[i]))
+    deltaTree.BuildIndex("entry")
+    # the index of the friend is evaluated on inputTree as its entry number
+    inputTree.SetAlias("entry", "Entry$")
+    inputTree.AddFriend(deltaTree)
+    inputTree.SetEntryList(elist)
+    return elist
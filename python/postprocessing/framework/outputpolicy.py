@@ -0,0 +1,71 @@
+import fnmatch
+import re
+
+
+# storage name: ROOT branch type
+_storageTypes = {
+    'bool': 'O',
+    'int8': 'B',
+    'uint8': 'b',
+    'int16': 'S',
+    'uint16': 's',
+    'int32': 'I',
+    'uint32': 'i',
+    'int64': 'L',
+    'uint64': 'l',
+}
+_integerTypes = set(_storageTypes.values())
+
+
+class OutputPolicy():
+    """Storage type and precision of the output branches made by the modules.
+
+       Each line of the policy file is one of
+           type <branch_pattern> (bool|int8|uint8|int16|uint16|int32|uint32|int64|uint64)
+           precision <branch_pattern> <mantissa bits>
+       with shell-style patterns (typematch/precisionmatch for regular
+       expressions), the last matching line of each kind wins. Types only
+       apply to integer and boolean branches, precisions to float branches.
+    """
+
+    def __init__(self, filename):
+        comment = re.compile(r"#.*")
+        self._types = []
+        self._precisions = []
+        for line in open(filename, 'r'):
+            line = re.sub(comment, "", line).strip()
+            if len(line) == 0:
+                continue
+            try:
+                (op, sel, value) = line.split()
+                if op in ("type", "typematch"):
+                    if value not in _storageTypes:
+                        raise ValueError(value)
+                    self._types.append((self._matcher(op.endswith("match"), sel), _storageTypes[value]))
+                elif op in ("precision", "precisionmatch"):
+                    bits = int(value)
+                    if not 1 <= bits <= 23:
+                        raise ValueError(value)
+                    self._precisions.append((self._matcher(op.endswith("match"), sel), bits))
+                else:
+                    raise ValueError(op)
+            except ValueError:
+                print("Error in file %s, line '%s': " % (filename, line)
+                    + "it's not (type|typematch) <branch_pattern> <type> "
+                    + "or (precision|precisionmatch) <branch_pattern> <bits>"
+                )
+
+    def _matcher(self, isRegex, sel):
+        return re.compile("(:?%s)$" % sel if isRegex else fnmatch.translate(sel)).match
+
+    def apply(self, name, rootBranchType, limitedPrecision=False):
+        """Return the (rootBranchType, limitedPrecision) to use for the branch name"""
+        if rootBranchType in _integerTypes:
+            for match, typ in self._types:
+                if match(name):
+                    rootBranchType = typ
+        elif rootBranchType == 'F':
+            for match, bits in self._precisions:
+                if match(name):
+                    limitedPrecision = bits
+        return rootBranchType, limitedPrecision
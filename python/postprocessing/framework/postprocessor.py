@@ -1,18 +1,62 @@
 #!/usr/bin/env python
 from PhysicsTools.NanoAODTools.postprocessing.framework.jobreport import JobReport
 from PhysicsTools.NanoAODTools.postprocessing.framework.preskimming import preSkim
-from PhysicsTools.NanoAODTools.postprocessing.framework.output import FriendOutput, FullOutput
-from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import eventLoop
+from PhysicsTools.NanoAODTools.postprocessing.framework.output import FriendOutput, FullOutput, DeltaFriendOutput, RollingOutput
+from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import eventLoop, pushDownPreselection
+from PhysicsTools.NanoAODTools.postprocessing.framework.profiler import ModuleProfiler
+from PhysicsTools.NanoAODTools.postprocessing.framework.memorymonitor import MemoryMonitor
+from PhysicsTools.NanoAODTools.postprocessing.framework.metrics import MetricsSink
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import InputTree
-from PhysicsTools.NanoAODTools.postprocessing.framework.branchselection import BranchSelection
+from PhysicsTools.NanoAODTools.postprocessing.framework.outputpolicy import OutputPolicy
+from PhysicsTools.NanoAODTools.postprocessing.framework.basketbudget import BasketBudget
+from PhysicsTools.NanoAODTools.postprocessing.framework.buffermerger import BufferMerger
+from PhysicsTools.NanoAODTools.postprocessing.framework.compressionchoice import autoCompression, parseCompression
+from PhysicsTools.NanoAODTools.postprocessing.framework.branchselection import BranchSelection, writeBranchSelection
+from PhysicsTools.NanoAODTools.postprocessing.framework.treeReaderArrayTools import usedBranches, setCacheBranches, readStatistics
 import os
 import time
 import hashlib
 import subprocess
+import traceback
+import multiprocessing
 import ROOT
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 
 
+def clusterAlignedRanges(fname, nParts, firstEntry=0, maxEntries=None):
+    """Split the Events tree of fname in at most nParts (firstEntry, maxEntries) ranges
+       covering [firstEntry, firstEntry+maxEntries) with boundaries on cluster starts"""
+    inFile = ROOT.TFile.Open(fname)
+    inTree = inFile.Get("Events")
+    if inTree == None:
+        inTree = inFile.Get("Friends")
+    lastEntry = inTree.GetEntries()
+    if maxEntries != None:
+        lastEntry = min(lastEntry, firstEntry + maxEntries)
+    starts = [firstEntry]
+    clusterIter = inTree.GetClusterIterator(firstEntry)
+    start = clusterIter()
+    while start < lastEntry:
+        if start > firstEntry:
+            starts.append(start)
+        start = clusterIter()
+    inFile.Close()
+    starts.append(lastEntry)
+
+    target = max(1, (lastEntry - firstEntry + nParts - 1) // nParts)
+    ranges = []
+    begin = firstEntry
+    for start in starts[1:]:
+        if start - begin >= target or start == lastEntry:
+            ranges.append((begin, start - begin))
+            begin = start
+    return [r for r in ranges if r[1] > 0]
+
+
 class PostProcessor:
     def __init__(
             self, outputDir, inputFiles, cut=None, branchsel=None, modules=[],
@@ -20,17 +64,53 @@ class PostProcessor:
             noOut=False, justcount=False, provenance=False, haddFileName=None,
             fwkJobReport=False, histFileName=None, histDirName=None,
             outputbranchsel=None, maxEntries=None, firstEntry=0, prefetch=False,
-            longTermCache=False
+            longTermCache=False, batchSize=None, nWorkers=1, splitFiles=False,
+            learnBranchUsage=None, branchUsageFile=None, cacheSize=None,
+            cacheBranches=None, asyncPrefetch=False, profile=False,
+            memoryMonitor=None, metricsFile=None, metricsPromFile=None,
+            metricsInterval=30., metricsLabels={}, deltaFriend=False,
+            systematicsLayout=None, outputPolicy=None, basketBudget=None,
+            maxOutputSize=None, maxOutputEntries=None, bufferMerger=False,
+            bufferMergerFlush=20000, preskimThreads=1, pushDown=False,
+            exportBranchSelection=False
     ):
         self.outputDir = outputDir
         self.inputFiles = inputFiles
         self.cut = cut
+        # threads evaluating the compiled cut (see preskimming.compileCut)
+        self.preskimThreads = preskimThreads
+        # add the preselection expressions of the modules to the cut (see
+        # eventloop.pushDownPreselection): the modules before a skim then
+        # don't see the events it rejects, and the entries counted change
+        self.pushDown = pushDown
         self.modules = modules
         self.compression = compression
+        self.compressionChoice = None  # JSON record of the choice with compression="auto[:objective]"
         self.postfix = postfix
         self.json = jsonInput
         self.noOut = noOut
         self.friend = friend
+        # write only the accepted entry numbers and the new branches, as a
+        # friend of the input file (see output.joinDeltaFriend)
+        self.deltaFriend = deltaFriend
+        # names of the systematic variations: the branches <variable>_<syst>
+        # are written as one array branch <variable> (see OutputTree.setSystematicsLayout)
+        self.systematicsLayout = systematicsLayout
+        # file with the storage types and precisions of the new branches
+        self.outputPolicy = OutputPolicy(outputPolicy) if outputPolicy else None
+        # memory in MB for the baskets of each output tree, also used by the final hadd
+        self.basketBudget = basketBudget
+        # write the output of all the input files directly to files of at most
+        # maxOutputSize MB and/or maxOutputEntries entries, instead of one file
+        # per input file (and the final hadd); named as haddFileName with _0, _1...
+        self.maxOutputSize = maxOutputSize
+        self.maxOutputEntries = maxOutputEntries
+        self.rollingOutput = None
+        # with nWorkers > 1, merge the output of the workers into one file
+        # (haddFileName) while they run, sent every bufferMergerFlush entries
+        self.useBufferMerger = bufferMerger
+        self.bufferMergerFlush = bufferMergerFlush
+        self.bufferMerger = None
         self.justcount = justcount
         self.provenance = provenance
         self.jobReport = JobReport() if fwkJobReport else None
@@ -42,11 +122,12 @@ class PostProcessor:
                 "hadd. No name specified for the output file, will use tree.root")
             self.haddFileName = "tree.root"
         self.branchsel = BranchSelection(branchsel) if branchsel else None
-        if outputbranchsel != None:
+        if outputbranchsel != None and outputbranchsel != branchsel:
             self.outputbranchsel = BranchSelection(outputbranchsel)
-        elif outputbranchsel == None and branchsel != None:
-            # Use the same branches in the output as in input
-            self.outputbranchsel = BranchSelection(branchsel)
+        elif branchsel != None:
+            # Use the same branches in the output as in input, sharing the
+            # branches resolved for each schema
+            self.outputbranchsel = self.branchsel
         else:
             self.outputbranchsel = None
 
@@ -58,6 +139,40 @@ class PostProcessor:
         self.prefetch = prefetch  # prefetch files to TMPDIR using xrdcp
         # keep cached files across runs (it's then up to you to clean up the temp)
         self.longTermCache = longTermCache
+        # process entries in chunks of batchSize for modules with analyzeBatch
+        self.batchSize = batchSize
+        # process the input files in parallel in this many forked processes
+        self.nWorkers = nWorkers
+        # with nWorkers > 1, also split each file in cluster-aligned entry ranges
+        self.splitFiles = splitFiles
+        # disable the input branches not read in the first learnBranchUsage
+        # entries of each file, and write the ones read to branchUsageFile
+        self.learnBranchUsage = learnBranchUsage
+        self.branchUsageFile = branchUsageFile
+        self.usedBranches = set()
+        self.readBranches = set()  # branches with a reader in the files processed
+        # TTreeCache size in bytes and branches to put in it (a keep/drop
+        # file, e.g. a branchUsageFile; by default ROOT learns them)
+        self.cacheSize = cacheSize
+        self.cacheBranches = BranchSelection(cacheBranches) if cacheBranches else None
+        self.asyncPrefetch = asyncPrefetch
+        # write the branches kept and dropped by the input and output branch
+        # selections for each schema, to branchSelection.json and
+        # outputBranchSelection.json in outputDir
+        self.exportBranchSelection = exportBranchSelection
+        # count calls and rejections and sample the time of each module,
+        # summary printed at the end and written to moduleProfile.json in outputDir
+        self.profile = profile
+        self.profiler = None
+        # sample the memory every this many events, summary printed at the end
+        # and written to memoryProfile.json in outputDir
+        self.memoryMonitorEvery = memoryMonitor
+        self.memoryMonitor = None
+        # every metricsInterval seconds, append the progress as JSON to
+        # metricsFile and/or write it in the Prometheus format to metricsPromFile
+        # (per-worker files with nWorkers > 1)
+        self.metrics = MetricsSink(metricsFile, metricsPromFile, metricsInterval, metricsLabels) if (
+            metricsFile or metricsPromFile) else None
 
     def prefetchFile(self, fname, verbose=True):
         tmpdir = os.environ['TMPDIR'] if 'TMPDIR' in os.environ else "/tmp"
@@ -97,29 +212,39 @@ class PostProcessor:
 
     def run(self):
         outpostfix = self.postfix if self.postfix != None else (
-            "_Friend" if self.friend else "_Skim")
+            "_Friend" if self.friend or self.deltaFriend else "_Skim")
         if not self.noOut:
 
-            if self.compression != "none":
-                ROOT.gInterpreter.ProcessLine("#include <Compression.h>")
-                (algo, level) = self.compression.split(":")
-                compressionLevel = int(level)
-                if algo == "LZMA":
-                    compressionAlgo = ROOT.ROOT.kLZMA
-                elif algo == "ZLIB":
-                    compressionAlgo = ROOT.ROOT.kZLIB
-                elif algo == "LZ4":
-                    compressionAlgo = ROOT.ROOT.kLZ4
-                else:
-                    raise RuntimeError("Unsupported compression %s" % algo)
-            else:
-                compressionLevel = 0
+            compression = self.compression
+            if compression.startswith("auto"):
+                # chosen once for all the files, so that they can be merged fast
+                compression, self.compressionChoice = autoCompression(
+                    self.inputFiles[0].split(',')[0], compression, self.outputbranchsel)
+            (compressionLevel, compressionAlgo) = parseCompression(compression)
             print("Will write selected trees to " + self.outputDir)
             if not self.justcount:
                 if not os.path.exists(self.outputDir):
                     os.system("mkdir -p " + self.outputDir)
         else:
             compressionLevel = 0
+            compressionAlgo = None
+
+        if self.deltaFriend and self.haddFileName:
+            raise RuntimeError(
+                "The delta friends of different input files can't be merged, as they refer to the entries of their input file")
+
+        rolling = (self.maxOutputSize or self.maxOutputEntries) and not self.noOut and not self.justcount
+        if rolling and (self.friend or self.deltaFriend):
+            raise RuntimeError("Friend trees refer to the entries of their input file, they can't be written to rolling output files")
+        if rolling and self.nWorkers > 1:
+            raise RuntimeError("Rolling output files are written by a single process, they can't be used with several workers")
+        parallel = self.nWorkers > 1 and (len(self.inputFiles) > 1 or self.splitFiles)
+        if self.useBufferMerger and parallel and not self.noOut and not self.justcount:
+            if self.friend or self.deltaFriend:
+                raise RuntimeError("Friend trees refer to the entries of their input file, the output of the workers can't be merged while they run")
+            self.bufferMerger = BufferMerger(
+                self.haddFileName if self.haddFileName else os.path.join(self.outputDir, "tree.root"),
+                compressionLevel, compressionAlgo, self.bufferMergerFlush)
 
         if self.noOut:
             if len(self.modules) == 0:
@@ -130,8 +255,83 @@ class PostProcessor:
         if (self.histFileName != None and self.histDirName == None) or (self.histFileName == None and self.histDirName != None):
             raise RuntimeError(
                 "Must specify both histogram file and histogram directory!")
-        elif self.histFileName != None and self.histDirName != None:
-            self.histFile = ROOT.TFile.Open(self.histFileName, "RECREATE")
+
+        if self.asyncPrefetch:
+            ROOT.gEnv.SetValue("TFile.AsyncPrefetching", 1)
+
+        # the entries go through the event loop to reach the rolling output,
+        # and to be sent to the buffer merger every flushEvery entries
+        fullClone = (len(self.modules) == 0 and not self.deltaFriend and not rolling and not self.bufferMerger)
+        if rolling:
+            outputName = self.haddFileName if self.haddFileName else os.path.join(self.outputDir, "tree.root")
+            self.rollingOutput = RollingOutput(
+                outputName.replace(".root", "_%d.root"), compressionLevel, compressionAlgo,
+                maxBytes=self.maxOutputSize * 1048576 if self.maxOutputSize else None,
+                maxEntries=self.maxOutputEntries, branchSelection=self.branchsel,
+                outputbranchSelection=self.outputbranchsel, provenance=self.provenance)
+        fileArgs = (outpostfix, fullClone, compressionLevel, compressionAlgo)
+        if (self.profile or self.metrics) and not fullClone:
+            # the metrics include the time share of each module
+            self.profiler = ModuleProfiler(self.modules)
+        if self.metrics:
+            self.metrics.profiler = self.profiler
+        if self.memoryMonitorEvery and not fullClone:
+            self.memoryMonitor = MemoryMonitor(self.modules, sampleEvery=self.memoryMonitorEvery)
+        t0 = time.time()
+        if parallel:
+            results = self.runParallel(fileArgs)
+        else:
+            self.beginJob(self.histFileName)
+            if self.memoryMonitor:
+                self.memoryMonitor.start()
+            if self.metrics:
+                self.metrics.start()
+            results = [self.processFile(fname, *fileArgs)
+                       for fname in self.inputFiles]
+            self.endJob()
+            if self.rollingOutput:
+                # the last file, left open for the following input files
+                self.rollingOutput.close()
+            self.reportMemory("memoryProfile.json")
+
+        outFileNames = []
+        totEntriesRead = 0
+        for fname, (outFileName, nall, nEntries) in zip(self.inputFiles, results):
+            totEntriesRead += nEntries
+            if outFileName:
+                outFileNames.append(outFileName)
+            if self.jobReport and nall != None:
+                self.jobReport.addInputFile(fname, nall)
+
+        print("Total time %.1f sec. to process %i events. Rate = %.1f Hz." % ((time.time() - t0), totEntriesRead, totEntriesRead / (time.time() - t0)))
+        if self.profile and self.profiler:
+            self.profiler.printSummary()
+            if not os.path.exists(self.outputDir):
+                os.system("mkdir -p " + self.outputDir)
+            self.profiler.writeJSON(os.path.join(self.outputDir, "moduleProfile.json"))
+        if self.exportBranchSelection:
+            self.writeBranchSelections()
+
+        if self.rollingOutput:
+            # already the final files
+            outFileNames = self.rollingOutput.fileNames
+            print("Wrote %d output files: %s" % (len(outFileNames), " ".join(outFileNames)))
+        elif self.bufferMerger:
+            outFileNames = [self.bufferMerger.fileName]
+        elif self.haddFileName:
+            haddnano = "./haddnano.py" if os.path.isfile(
+                "./haddnano.py") else "haddnano.py"
+            os.system("%s %s%s %s" %
+                      (haddnano, "--basket-budget %g " % self.basketBudget if self.basketBudget else "",
+                       self.haddFileName, " ".join(outFileNames)))
+        if self.jobReport:
+            for outFileName in (outFileNames if self.rollingOutput or self.bufferMerger else [self.haddFileName]):
+                self.jobReport.addOutputFile(outFileName)
+            self.jobReport.save()
+
+    def beginJob(self, histFileName):
+        if histFileName != None and self.histDirName != None:
+            self.histFile = ROOT.TFile.Open(histFileName, "RECREATE")
         else:
             self.histFile = None
 
@@ -142,123 +342,347 @@ class PostProcessor:
             else:
                 m.beginJob()
 
-        fullClone = (len(self.modules) == 0)
-        outFileNames = []
-        t0 = time.time()
-        totEntriesRead = 0
-        for fname in self.inputFiles:
-            ffnames = []
-            if "," in fname:
-                fnames = fname.split(',')
-                fname, ffnames = fnames[0], fnames[1:]
+    def endJob(self):
+        for m in self.modules:
+            m.endJob()
+
+    def writeBranchSelections(self):
+        """Write what the branch selections keep and drop in each schema seen"""
+        if not os.path.exists(self.outputDir):
+            os.system("mkdir -p " + self.outputDir)
+        for sel, jsonName in ((self.branchsel, "branchSelection.json"), (self.outputbranchsel, "outputBranchSelection.json")):
+            if sel:
+                sel.writeResolved(os.path.join(self.outputDir, jsonName))
+                print("Wrote the branches kept by %s in %d schemas to %s" % (
+                    sel.fileName, len(sel.resolved), os.path.join(self.outputDir, jsonName)))
+
+    def reportMemory(self, jsonName):
+        if not self.memoryMonitor:
+            return
+        self.memoryMonitor.stop()
+        self.memoryMonitor.printSummary()
+        if not os.path.exists(self.outputDir):
+            os.system("mkdir -p " + self.outputDir)
+        self.memoryMonitor.writeJSON(os.path.join(self.outputDir, jsonName))
+
+    def runParallel(self, fileArgs):
+        """Process the input files in nWorkers forked processes.
 
-            # open input file
+           The workers inherit the modules as constructed in this process, run
+           beginJob/endJob on their own histogram file, and the histogram files
+           are merged at the end. With splitFiles, each file is split in
+           cluster-aligned entry ranges processed by different workers, and the
+           partial outputs are merged in entry order.
+           Returns the processFile results in the order of inputFiles.
+        """
+        ctx = multiprocessing.get_context("fork") if hasattr(
+            multiprocessing, "get_context") else multiprocessing
+        # tasks are (index of input file, processFile arguments)
+        tasks = []
+        toDelete = []
+        for ifile, fname in enumerate(self.inputFiles):
+            if not self.splitFiles:
+                tasks.append((ifile, (fname,) + fileArgs))
+                continue
+            mainName = fname.split(',')[0]
+            ftoread = mainName
             if self.prefetch:
-                ftoread, toBeDeleted = self.prefetchFile(fname)
-                inFile = ROOT.TFile.Open(ftoread)
-            else:
-                inFile = ROOT.TFile.Open(fname)
-
-            # get input tree
-            inTree = inFile.Get("Events")
-            if inTree == None:
-                inTree = inFile.Get("Friends")
-            nEntries = min(inTree.GetEntries() -
-                           self.firstEntry, self.maxEntries)
-            totEntriesRead += nEntries
-            # pre-skimming
-            elist, jsonFilter = preSkim(
-                inTree, self.json, self.cut, maxEntries=self.maxEntries, firstEntry=self.firstEntry)
-            if self.justcount:
-                print('Would select %d / %d entries from %s (%.2f%%)' % (elist.GetN() if elist else nEntries, nEntries, fname, (elist.GetN() if elist else nEntries) / (0.01 * nEntries) if nEntries else 0))
-                if self.prefetch:
-                    if toBeDeleted:
-                        os.unlink(ftoread)
+                # once here rather than in every worker
+                ftoread, toBeDeleted = self.prefetchFile(mainName)
+                if toBeDeleted:
+                    toDelete.append(ftoread)
+            outFileName = None if self.noOut else os.path.join(self.outputDir, os.path.basename(
+                mainName).replace(".root", fileArgs[0] + ".root"))
+            ranges = clusterAlignedRanges(
+                ftoread, self.nWorkers, self.firstEntry, self.maxEntries)
+            if not ranges:
+                ranges = [(self.firstEntry, self.maxEntries)]
+            for ipart, (first, n) in enumerate(ranges):
+                partName = outFileName.replace(".root", "_part%d.root" % ipart) if outFileName else None
+                tasks.append((ifile, (",".join([ftoread] + fname.split(',')[1:]),) + fileArgs + (first, n, partName, mainName)))
+        taskQueue = ctx.Queue()
+        messages = ctx.Queue()
+        if self.bufferMerger:
+            self.bufferMerger.queue = messages
+        nWorkers = min(self.nWorkers, len(tasks))
+        for itask in range(len(tasks)):
+            taskQueue.put(itask)
+        for iworker in range(nWorkers):
+            taskQueue.put(None)
+
+        histFileNames = [("%s.worker%d.root" % (self.histFileName.replace(".root", ""), iworker))
+                         if self.histFileName != None else None for iworker in range(nWorkers)]
+
+        def work(iworker):
+            try:
+                if self.splitFiles:
+                    self.prefetch = False  # already done
+                self.beginJob(histFileNames[iworker])
+                if self.memoryMonitor:
+                    self.memoryMonitor.start()
+                if self.metrics:
+                    self.metrics = self.metrics.forWorker(iworker, self.profiler)
+                    self.metrics.start()
+                while True:
+                    itask = taskQueue.get()
+                    if itask == None:
+                        break
+                    messages.put(("task", itask, self.processFile(*tasks[itask][1])))
+                self.endJob()
+                self.reportMemory("memoryProfile.worker%d.json" % iworker)
+                messages.put(("done", iworker, dict(
+                    profiler=self.profiler.state() if self.profiler else None,
+                    branchSelections=[sel.resolved if sel else None for sel in (self.branchsel, self.outputbranchsel)])))
+            except Exception:
+                messages.put(("error", iworker, traceback.format_exc()))
+
+        print("Processing %d files with %d workers (%d tasks)" % (len(self.inputFiles), nWorkers, len(tasks)))
+        workers = [ctx.Process(target=work, args=(iworker,))
+                   for iworker in range(nWorkers)]
+        for w in workers:
+            w.start()
+        if self.bufferMerger:
+            self.bufferMerger.open()
+        taskResults = [None] * len(tasks)
+        done = set()
+        while len(done) < nWorkers:
+            try:
+                kind, index, payload = messages.get(timeout=10)
+            except Empty:
+                # a worker killed (e.g. crash in ROOT, out of memory) doesn't send anything
+                dead = [iworker for iworker, w in enumerate(workers) if iworker not in done and not w.is_alive()]
+                if dead:
+                    for w in workers:
+                        w.terminate()
+                    raise RuntimeError("Worker %d died without reporting (exit code %s)" % (dead[0], workers[dead[0]].exitcode))
                 continue
+            if kind == "output":
+                self.bufferMerger.merge(payload)
+            elif kind == "task":
+                taskResults[index] = payload
+            elif kind == "done":
+                done.add(index)
+                if self.profiler:
+                    self.profiler.merge(payload["profiler"])
+                for sel, resolved in zip((self.branchsel, self.outputbranchsel), payload["branchSelections"]):
+                    if sel:
+                        sel.merge(resolved)
             else:
-                print('Pre-select %d entries out of %s (%.2f%%)' % (elist.GetN() if elist else nEntries, nEntries, (elist.GetN() if elist else nEntries) / (0.01 * nEntries) if nEntries else 0))
-                inAddFiles = []
-                inAddTrees = []
-            for ffname in ffnames:
-                inAddFiles.append(ROOT.TFile.Open(ffname))
-                inAddTree = inAddFiles[-1].Get("Events")
-                if inAddTree == None:
-                    inAddTree = inAddFiles[-1].Get("Friends")
-                inAddTrees.append(inAddTree)
-                inTree.AddFriend(inAddTree)
-
-            if fullClone:
-                # no need of a reader (no event loop), but set up the elist if available
-                if elist:
-                    inTree.SetEntryList(elist)
-            else:
-                # initialize reader
-                inTree = InputTree(inTree, elist)
+                for w in workers:
+                    w.terminate()
+                raise RuntimeError("Worker %d failed:\n%s" % (index, payload))
+        for w in workers:
+            w.join()
+        if self.bufferMerger:
+            self.bufferMerger.close()
+        for fname in toDelete:
+            os.unlink(fname)
+
+        if self.histFileName != None:
+            merger = ROOT.TFileMerger(False)
+            merger.OutputFile(self.histFileName, "RECREATE")
+            for histFileName in histFileNames:
+                merger.AddFile(histFileName)
+            if not merger.Merge():
+                raise RuntimeError("Could not merge the histogram files into %s" % self.histFileName)
+            for histFileName in histFileNames:
+                os.unlink(histFileName)
+
+        results = []
+        for ifile in range(len(self.inputFiles)):
+            parts = [taskResults[itask] for itask in range(len(tasks)) if tasks[itask][0] == ifile]
+            if not self.splitFiles:
+                results.append(parts[0])
+                continue
+            nall = None if self.justcount else sum(part[1] for part in parts)
+            nEntries = sum(part[2] for part in parts)
+            outFileName = None
+            partNames = [part[0] for part in parts if part[0]]
+            if partNames:
+                outFileName = partNames[0].replace("_part0.root", ".root")
+                if len(partNames) == 1:
+                    os.rename(partNames[0], outFileName)
+                else:
+                    haddnano = "./haddnano.py" if os.path.isfile(
+                        "./haddnano.py") else "haddnano.py"
+                    if os.system("%s %s%s %s" % (haddnano, "--basket-budget %g " % self.basketBudget if self.basketBudget else "",
+                                                 outFileName, " ".join(partNames))) != 0:
+                        raise RuntimeError("Could not merge the partial outputs into %s" % outFileName)
+                    for partName in partNames:
+                        os.unlink(partName)
+            results.append((outFileName, nall, nEntries))
+        return results
+
+    def processFile(self, fname, outpostfix, fullClone, compressionLevel, compressionAlgo,
+                    firstEntry=None, maxEntries=None, outFileName=None, inputName=None):
+        """Process one input file, returning (output file name, entries processed, entries read).
+
+           firstEntry and maxEntries default to the ones of the PostProcessor,
+           outFileName to the input name with outpostfix in outputDir,
+           inputName (the name of the input recorded in the output, e.g. the
+           original of a prefetched copy) to fname.
+        """
+        if firstEntry == None:
+            firstEntry = self.firstEntry
+        if maxEntries == None:
+            maxEntries = self.maxEntries
+        ffnames = []
+        if "," in fname:
+            fnames = fname.split(',')
+            fname, ffnames = fnames[0], fnames[1:]
+        if inputName == None:
+            inputName = fname
+
+        # open input file
+        if self.prefetch:
+            ftoread, toBeDeleted = self.prefetchFile(fname)
+            inFile = ROOT.TFile.Open(ftoread)
+        else:
+            inFile = ROOT.TFile.Open(fname)
+
+        # get input tree
+        inTree = inFile.Get("Events")
+        if inTree == None:
+            inTree = inFile.Get("Friends")
+        nEntries = min(inTree.GetEntries() -
+                       firstEntry, maxEntries)
+        # pre-skimming
+        cut = self.cut
+        preselectedBranches = set()
+        if self.pushDown and not fullClone and not self.justcount:
+            expressions, preselectedBranches = pushDownPreselection(self.modules, inTree)
+            if expressions:
+                print("Pre-selection of the modules: %s" % " && ".join(expressions))
+                cut = " && ".join("(%s)" % c for c in ([cut] if cut else []) + expressions)
+        elist, jsonFilter = preSkim(
+            inTree, self.json, cut, maxEntries=maxEntries, firstEntry=firstEntry,
+            nThreads=self.preskimThreads)
+        if self.justcount:
+            print('Would select %d / %d entries from %s (%.2f%%)' % (elist.GetN() if elist else nEntries, nEntries, fname, (elist.GetN() if elist else nEntries) / (0.01 * nEntries) if nEntries else 0))
+            if self.prefetch:
+                if toBeDeleted:
+                    os.unlink(ftoread)
+            return (None, None, nEntries)
+        else:
+            print('Pre-select %d entries out of %s (%.2f%%)' % (elist.GetN() if elist else nEntries, nEntries, (elist.GetN() if elist else nEntries) / (0.01 * nEntries) if nEntries else 0))
+            inAddFiles = []
+            inAddTrees = []
+        for ffname in ffnames:
+            inAddFiles.append(ROOT.TFile.Open(ffname))
+            inAddTree = inAddFiles[-1].Get("Events")
+            if inAddTree == None:
+                inAddTree = inAddFiles[-1].Get("Friends")
+            inAddTrees.append(inAddTree)
+            inTree.AddFriend(inAddTree)
+
+        if fullClone:
+            # no need of a reader (no event loop), but set up the elist if available
+            if elist:
+                inTree.SetEntryList(elist)
+        else:
+            # initialize reader
+            inTree = InputTree(inTree, elist)
+            # make at once the readers for the branches read in the previous files
+            inTree.declareBranches([b for b in self.readBranches if inTree.GetBranch(b)])
 
-            # prepare output file
-            if not self.noOut:
-                outFileName = os.path.join(self.outputDir, os.path.basename(
-                    fname).replace(".root", outpostfix + ".root"))
+        # prepare output file
+        if self.noOut or self.rollingOutput:
+            outFileName = None
+        elif self.bufferMerger:
+            # sent to the main process, only the name of the in-memory file
+            outFileName = os.path.basename(fname).replace(".root", outpostfix + ".root")
+        elif outFileName == None:
+            outFileName = os.path.join(self.outputDir, os.path.basename(
+                fname).replace(".root", outpostfix + ".root"))
+        if self.rollingOutput:
+            outTree = self.rollingOutput
+            outFile = outTree.addInputFile(inFile, inTree, firstEntry=firstEntry, jsonFilter=jsonFilter)
+        elif not self.noOut:
+            if self.bufferMerger:
+                outFile = self.bufferMerger.openFile(outFileName)
+            else:
                 outFile = ROOT.TFile.Open(
                     outFileName, "RECREATE", "", compressionLevel)
-                outFileNames.append(outFileName)
                 if compressionLevel:
                     outFile.SetCompressionAlgorithm(compressionAlgo)
-                # prepare output tree
-                if self.friend:
-                    outTree = FriendOutput(inFile, inTree, outFile)
-                else:
-                    outTree = FullOutput(
-                        inFile,
-                        inTree,
-                        outFile,
-                        branchSelection=self.branchsel,
-                        outputbranchSelection=self.outputbranchsel,
-                        fullClone=fullClone,
-                        maxEntries=self.maxEntries,
-                        firstEntry=self.firstEntry,
-                        jsonFilter=jsonFilter,
-                        provenance=self.provenance)
+            # prepare output tree
+            if self.deltaFriend:
+                outTree = DeltaFriendOutput(inFile, inTree, outFile, inputFileName=inputName)
+            elif self.friend:
+                outTree = FriendOutput(inFile, inTree, outFile)
             else:
-                outFile = None
-                outTree = None
-                if self.branchsel:
-                    self.branchsel.selectBranches(inTree)
-
-            # process events, if needed
-            if not fullClone:
-                eventRange = range(self.firstEntry, self.firstEntry +
-                                    nEntries) if nEntries > 0 and not elist else None
-                (nall, npass, timeLoop) = eventLoop(
-                    self.modules, inFile, outFile, inTree, outTree,
-                    eventRange=eventRange, maxEvents=self.maxEntries
-                )
-                print('Processed %d preselected entries from %s (%s entries). Finally selected %d entries' % (nall, fname, nEntries, npass))
-            else:
-                nall = nEntries
-                print('Selected %d / %d entries from %s (%.2f%%)' % (outTree.tree().GetEntries(), nall, fname, outTree.tree().GetEntries() / (0.01 * nall) if nall else 0))
-
-            # now write the output
-            if not self.noOut:
-                outTree.write()
-                outFile.Close()
-                print("Done %s" % outFileName)
-            if self.jobReport:
-                self.jobReport.addInputFile(fname, nall)
-            if self.prefetch:
-                if toBeDeleted:
-                    os.unlink(ftoread)
+                outTree = FullOutput(
+                    inFile,
+                    inTree,
+                    outFile,
+                    branchSelection=self.branchsel,
+                    outputbranchSelection=self.outputbranchsel,
+                    fullClone=fullClone,
+                    maxEntries=maxEntries,
+                    firstEntry=firstEntry,
+                    jsonFilter=jsonFilter,
+                    provenance=self.provenance)
+        if not self.noOut:
+            if self.systematicsLayout:
+                outTree.setSystematicsLayout(self.systematicsLayout)
+            if self.outputPolicy:
+                outTree.setOutputPolicy(self.outputPolicy)
+            if self.basketBudget and not fullClone:
+                outTree.setBasketBudget(BasketBudget(self.basketBudget * 1048576))
+            if self.compressionChoice:
+                outTree.setMetadata("CompressionChoice", self.compressionChoice)
+            outTree.protectBranches(preselectedBranches)
+            if self.bufferMerger:
+                outTree.setFlush(self.bufferMerger.flushEvery, lambda: self.bufferMerger.flush(outFile))
+        else:
+            outFile = None
+            outTree = None
+            if self.branchsel:
+                self.branchsel.selectBranches(inTree)
 
-        for m in self.modules:
-            m.endJob()
+        if self.cacheSize:
+            inTree.SetCacheSize(self.cacheSize)
+            if self.cacheBranches:
+                # also the ones copied to the output by FullOutput.fill
+                setCacheBranches(inTree, set(self.cacheBranches.selectedBranches(inTree)) | (
+                    outTree.requiredInputBranches() if outTree != None else set()))
+                inTree._cacheBranchesFixed = True
 
-        print("Total time %.1f sec. to process %i events. Rate = %.1f Hz." % ((time.time() - t0), totEntriesRead, totEntriesRead / (time.time() - t0)))
+        # process events, if needed
+        if not fullClone:
+            eventRange = range(firstEntry, firstEntry +
+                                nEntries) if nEntries > 0 and not elist else None
+            (nall, npass, timeLoop) = eventLoop(
+                self.modules, inFile, outFile, inTree, outTree,
+                eventRange=eventRange, maxEvents=maxEntries,
+                batchSize=self.batchSize, learnBranchUsage=self.learnBranchUsage,
+                profiler=self.profiler, memoryMonitor=self.memoryMonitor,
+                metrics=self.metrics
+            )
+            print('Processed %d preselected entries from %s (%s entries). Finally selected %d entries' % (nall, fname, nEntries, npass))
+            self.readBranches |= set(inTree._ttras.keys()) | set(inTree._ttrvs.keys())
+            if self.branchUsageFile:
+                self.usedBranches |= usedBranches(inTree)
+                writeBranchSelection(self.branchUsageFile, self.usedBranches)
+        else:
+            nall = nEntries
+            print('Selected %d / %d entries from %s (%.2f%%)' % (outTree.tree().GetEntries(), nall, fname, outTree.tree().GetEntries() / (0.01 * nall) if nall else 0))
 
-        if self.haddFileName:
-            haddnano = "./haddnano.py" if os.path.isfile(
-                "./haddnano.py") else "haddnano.py"
-            os.system("%s %s %s" %
-                      (haddnano, self.haddFileName, " ".join(outFileNames)))
-        if self.jobReport:
-            self.jobReport.addOutputFile(self.haddFileName)
-            self.jobReport.save()
+        if self.cacheSize:
+            stats = readStatistics(inTree)
+            print("Read %(bytesRead)d bytes in %(readCalls)d calls" % stats + (
+                ", TTreeCache of %(cacheSize)d bytes with %(cacheBranches)d branches: hit rate %(cacheHitRate).3f (relative %(cacheHitRateRel).3f), %(cacheReadCalls)d reads through the cache, %(noCacheReadCalls)d reads (%(noCacheBytesRead)d bytes) outside" % stats
+                if "cacheHitRate" in stats else ""))
+
+        # now write the output, the rolling output is written when its files are full
+        if not self.noOut and not self.rollingOutput:
+            outTree.write()
+            if self.bufferMerger:
+                self.bufferMerger.send(outFile)
+                outFileName = None
+            outFile.Close()
+            print("Done %s" % (outFileName if outFileName else fname))
+        if self.prefetch:
+            if toBeDeleted:
+                os.unlink(ftoread)
+        return (outFileName, nall, nEntries)
@@ -1,10 +1,48 @@
+import bisect
+import hashlib
 import json
+import numpy
 import re
 import ROOT
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 
 
+def treeColumns(tree, expressions, elist=None, chunkSize=1000000):
+    """Yield the values of up to 4 single-value expressions for the entries
+       of tree (of elist if given) as NumPy float64 arrays, chunkSize
+       entries at a time"""
+    oldList, oldEstimate = tree.GetEntryList(), tree.GetEstimate()
+    tree.SetEntryList(elist)
+    nEntries = elist.GetN() if elist else tree.GetEntries()
+    tree.SetEstimate(min(chunkSize, max(nEntries, 1)) + 1)
+    try:
+        for first in range(0, nEntries, chunkSize):
+            n = tree.Draw(":".join(expressions), "", "goff", chunkSize, first)
+            columns = []
+            for i in range(len(expressions)):
+                buff = tree.GetVal(i)
+                if n == 0:
+                    columns.append(numpy.zeros(0))
+                    continue
+                if hasattr(buff, 'reshape'):
+                    buff.reshape((n,))
+                else:
+                    buff.SetSize(n)
+                columns.append(numpy.frombuffer(buff, dtype=numpy.float64, count=n).copy())
+            yield tuple(columns)
+    finally:
+        tree.SetEntryList(oldList)
+        tree.SetEstimate(oldEstimate)
+
+
 class JSONFilter:
+    """Runs and luminosity blocks to keep, from a JSON {run: [[first lumi, last lumi], ...]}.
+
+       The lumi ranges are indexed as sorted intervals of run << 32 | lumi,
+       so that filterRunsLumis selects whole arrays of runs and lumis with
+       one binary search, and filterTree whole trees.
+    """
+
     def __init__(self, fname="", runsAndLumis={}):
         self.keep = {}
         if fname != "":
@@ -19,44 +57,225 @@ class JSONFilter:
         for run in list(self.keep.keys()):
             if len(self.keep[run]) == 0:
                 del self.keep[run]
+        # the overlapping and adjacent lumi ranges of a run are merged
+        intervals = []
+        for (start, end) in sorted(((run << 32) | int(l1), (run << 32) | int(l2))
+                                   for run, lumis in self.keep.items() for (l1, l2) in lumis if l1 <= l2):
+            if intervals and (start >> 32) == (intervals[-1][0] >> 32) and start <= intervals[-1][1] + 1:
+                intervals[-1][1] = max(intervals[-1][1], end)
+            else:
+                intervals.append([start, end])
+        self._starts = [i[0] for i in intervals]
+        self._ends = [i[1] for i in intervals]
+        self._startArray = numpy.array(self._starts, dtype=numpy.uint64)
+        self._endArray = numpy.array(self._ends, dtype=numpy.uint64)
+        self._runArray = numpy.array(sorted(self.keep.keys()), dtype=numpy.uint64)
 
     def filterRunLumi(self, run, lumi):
-        try:
-            for (l1, l2) in self.keep[run]:
-                if l1 <= lumi and lumi <= l2:
-                    return True
-            return False
-        except KeyError:
-            return False
+        key = (int(run) << 32) | int(lumi)
+        i = bisect.bisect_right(self._starts, key) - 1
+        return i >= 0 and key <= self._ends[i]
 
     def filterRunOnly(self, run):
         return (run in self.keep)
 
+    def filterRunsLumis(self, runs, lumis):
+        """Boolean array: whether each (runs[i], lumis[i]) is kept"""
+        keys = (numpy.asarray(runs).astype(numpy.uint64) << numpy.uint64(32)) | numpy.asarray(lumis).astype(numpy.uint64)
+        if not len(self._starts):
+            return numpy.zeros(len(keys), dtype=bool)
+        i = numpy.searchsorted(self._startArray, keys, side='right').astype(numpy.int64) - 1
+        return (i >= 0) & (keys <= self._endArray[numpy.maximum(i, 0)])
+
+    def filterRuns(self, runs):
+        """Boolean array: whether each of runs is kept"""
+        return numpy.isin(numpy.asarray(runs).astype(numpy.uint64), self._runArray)
+
+    def filterTree(self, tree, elist=None, runOnly=False):
+        """Entry numbers of the entries of tree (of elist if given) with a
+           run and lumi kept (only a run with runOnly, e.g. for Runs trees)"""
+        selected = [numpy.zeros(0)]
+        for columns in treeColumns(tree, ["Entry$", "run"] if runOnly else ["Entry$", "run", "luminosityBlock"], elist):
+            mask = self.filterRuns(columns[1]) if runOnly else self.filterRunsLumis(columns[1], columns[2])
+            selected.append(columns[0][mask])
+        return numpy.concatenate(selected).astype(numpy.int64)
+
     def runCut(self):
         return "%d <= run && run <= %s" % (min(self.keep.keys()), max(self.keep.keys()))
 
     def filterEList(self, tree, elist):
-        # FIXME this can be optimized for sure
-        tree.SetBranchStatus("*", 0)
-        tree.SetBranchStatus('run', 1)
-        tree.SetBranchStatus('luminosityBlock', 1)
         filteredList = ROOT.TEntryList('filteredList', 'filteredList')
-        if elist:
-            for i in range(elist.GetN()):
-                entry = elist.GetEntry(0) if i == 0 else elist.Next()
-                tree.GetEntry(entry)
-                if self.filterRunLumi(tree.run, tree.luminosityBlock):
-                    filteredList.Enter(entry)
-        else:
-            for entry in range(tree.GetEntries()):
-                tree.GetEntry(entry)
-                if self.filterRunLumi(tree.run, tree.luminosityBlock):
-                    filteredList.Enter(entry)
-        tree.SetBranchStatus("*", 1)
+        for entry in self.filterTree(tree, elist):
+            filteredList.Enter(int(entry))
         return filteredList
 
 
-def preSkim(tree, jsonInput=None, cutstring=None, maxEntries=None, firstEntry=0):
+# the selection of the entries of a tree with a compiled Cut class
+_selectCode = """
+#include <algorithm>
+#include <atomic>
+#include <memory>
+#include <string>
+#include <thread>
+#include <vector>
+#include "TEntryList.h"
+#include "TFile.h"
+#include "TMath.h"
+#include "TROOT.h"
+#include "TTree.h"
+#include "TTreeReader.h"
+#include "TTreeReaderValue.h"
+namespace nanoPreSkim {
+template <class Cut>
+TEntryList *select(TTree *tree, Long64_t first, Long64_t last, int nThreads)
+{
+   std::vector<std::pair<Long64_t, Long64_t>> ranges;
+   if (nThreads > 1 && tree->GetCurrentFile() && last - first > 1) {
+      // cluster-aligned ranges, a few per thread
+      const Long64_t target = std::max<Long64_t>(1, (last - first) / (4 * nThreads));
+      auto clusters = tree->GetClusterIterator(first);
+      Long64_t begin = first;
+      while (begin < last) {
+         clusters.Next();
+         Long64_t end = std::min(clusters.GetNextEntry(), last);
+         if (end <= begin) end = last;
+         if (end - begin >= target || end == last) {
+            ranges.emplace_back(begin, end);
+            begin = end;
+         }
+      }
+   }
+   std::vector<std::vector<Long64_t>> parts(std::max<size_t>(ranges.size(), 1));
+   bool ok = ranges.size() > 1;
+   if (ok) {
+      ROOT::EnableThreadSafety();
+      const std::string fileName = tree->GetCurrentFile()->GetName(), treeName = tree->GetName();
+      std::atomic<size_t> next(0);
+      std::atomic<bool> failed(false);
+      std::vector<std::thread> threads;
+      for (int i = 0; i < nThreads; ++i)
+         threads.emplace_back([&]() {
+            std::unique_ptr<TFile> file(TFile::Open(fileName.c_str()));
+            TTree *t = file ? dynamic_cast<TTree *>(file->Get(treeName.c_str())) : nullptr;
+            for (size_t r = next++; r < ranges.size(); r = next++)
+               if (!t || !Cut::select(t, ranges[r].first, ranges[r].second, parts[r]))
+                  failed = true;
+         });
+      for (auto &t : threads)
+         t.join();
+      ok = !failed;
+   }
+   if (!ok) {
+      parts.assign(1, std::vector<Long64_t>());
+      if (first < last && !Cut::select(tree, first, last, parts[0]))
+         return nullptr;
+   }
+   TEntryList *elist = new TEntryList("elist", "elist", tree);
+   elist->SetDirectory(nullptr); // owned by python
+   for (auto &part : parts)
+      for (auto entry : part)
+         elist->Enter(entry);
+   return elist;
+}
+}
+"""
+_cutCode = """
+namespace nanoPreSkim {
+struct Cut_%(name)s {
+   static bool select(TTree *tree, Long64_t first, Long64_t last, std::vector<Long64_t> &entries)
+   {
+      TTreeReader reader(tree);
+      %(readers)s
+      reader.SetEntriesRange(first, last);
+      Long64_t n = 0;
+      while (reader.Next()) {
+         ++n;
+         %(values)s
+         if ((%(expression)s) != 0)
+            entries.push_back(reader.GetCurrentEntry());
+      }
+      return n == last - first;
+   }
+};
+TEntryList *cut_%(name)s(TTree *tree, Long64_t first, Long64_t last, int nThreads)
+{
+   return select<Cut_%(name)s>(tree, first, last, nThreads);
+}
+}
+"""
+_leafTypes = set(["Bool_t", "Char_t", "UChar_t", "Short_t", "UShort_t", "Int_t",
+                  "UInt_t", "Long64_t", "ULong64_t", "Float_t", "Double_t"])
+_cutFunctions = {
+    "abs": "TMath::Abs", "fabs": "TMath::Abs", "sqrt": "TMath::Sqrt",
+    "exp": "TMath::Exp", "log": "TMath::Log", "log10": "TMath::Log10",
+    "TMath::Abs": "TMath::Abs", "TMath::Sqrt": "TMath::Sqrt", "TMath::Exp": "TMath::Exp",
+    "TMath::Log": "TMath::Log", "TMath::Log10": "TMath::Log10",
+    "TMath::Min": "TMath::Min", "TMath::Max": "TMath::Max",
+}
+_cutToken = re.compile(
+    r"\s*(?:(\d+\.?\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)|(\w+(?:::\w+)?)|(&&|\|\||[<>!=]=|[<>!()+\-*/,]))")
+_compiledCuts = {}  # C++ code: function
+
+
+def compileCut(tree, cut):
+    """Compile the TTreeFormula expression cut into a function selecting the
+       entries of tree, f(tree, first, last, nThreads) returning a TEntryList.
+
+       Only numbers, single-value branches, arithmetic, comparisons, logical
+       operators and a few functions are supported (None is returned
+       otherwise); all the values are doubles as in TTreeFormula, so that
+       the selection is the same.
+    """
+    cut = cut.strip()
+    pos = 0
+    expression = []
+    branches = []
+    while pos < len(cut):
+        m = _cutToken.match(cut, pos)
+        if not m:
+            return None
+        pos = m.end()
+        number, name, op = m.groups()
+        if number:
+            expression.append("((double)%s)" % number)
+        elif name:
+            if cut[pos:].lstrip().startswith("("):
+                if name not in _cutFunctions:
+                    return None
+                expression.append(_cutFunctions[name])
+                continue
+            # only the branches of tree itself, the threads open its file
+            # without the friends
+            branch = tree.GetListOfBranches().FindObject(name) if not tree.GetAlias(name) else None
+            leaf = branch.GetLeaf(name) if branch else None
+            if not leaf or leaf.GetLenStatic() != 1 or leaf.GetLeafCount() or leaf.GetTypeName() not in _leafTypes:
+                return None
+            if name not in [b for b, t in branches]:
+                branches.append((name, leaf.GetTypeName()))
+            expression.append("v%d" % [b for b, t in branches].index(name))
+        else:
+            expression.append(op)
+    if not branches:
+        return None
+    code = _cutCode % dict(
+        name="%(name)s",
+        readers="\n      ".join('TTreeReaderValue<%s> b%d(reader, "%s");' % (t, i, b) for i, (b, t) in enumerate(branches)),
+        values="\n         ".join("const double v%d = *b%d;" % (i, i) for i in range(len(branches))),
+        expression=" ".join(expression))
+    if code not in _compiledCuts:
+        if not _compiledCuts and not ROOT.gInterpreter.Declare(_selectCode):
+            return None
+        name = hashlib.sha1(code.encode()).hexdigest()[:16]
+        if not ROOT.gInterpreter.Declare(code % dict(name=name)):
+            return None
+        _compiledCuts[code] = getattr(ROOT.nanoPreSkim, "cut_" + name)
+    return _compiledCuts[code]
+
+
+def preSkim(tree, jsonInput=None, cutstring=None, maxEntries=None, firstEntry=0, nThreads=1, compiled=True):
+    """Return the TEntryList of the entries passing cutstring and the JSON,
+       and the JSONFilter. With compiled, the cut is compiled if possible
+       (see compileCut) and evaluated with nThreads threads."""
     if jsonInput == None and cutstring == None:
         return None, None
     cut = None
@@ -78,8 +297,16 @@ def preSkim(tree, jsonInput=None, cutstring=None, maxEntries=None, firstEntry=0)
                 "Error, found AltBranch$ in cut string, but it doesn't comply with the syntax this code can support. The cut is %r" % cut)
         cut = cut.replace(m.group(0), m.group(
             1) if tree.GetBranch(m.group(1)) else m.group(2))
-    tree.Draw('>>elist', cut, "entrylist", maxEntries, firstEntry)
-    elist = ROOT.gDirectory.Get('elist')
+    selectEntries = compileCut(tree, cut) if compiled else None
+    if selectEntries:
+        elist = selectEntries(tree, firstEntry, min(tree.GetEntries(), firstEntry + maxEntries), nThreads)
+        if elist != None:
+            ROOT.SetOwnership(elist, True)
+    if not selectEntries or elist == None:
+        if compiled:
+            print("Using TTree::Draw for the pre-selection %s" % cut)
+        tree.Draw('>>elist', cut, "entrylist", maxEntries, firstEntry)
+        elist = ROOT.gDirectory.Get('elist')
     if jsonInput:
         elist = jsonFilter.filterEList(tree, elist)
     return elist, jsonFilter
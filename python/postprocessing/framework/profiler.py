@@ -0,0 +1,108 @@
+import json
+import time
+
+_cpuTime = time.process_time if hasattr(time, 'process_time') else time.clock
+
+
+def moduleLabel(index, module):
+    """Name of a module instance in a chain, e.g. '12:JetSelection(selectedJets_jerUp)'"""
+    label = "%d:%s" % (index, type(module).__name__)
+    names = [str(getattr(module, a)) for a in ("outputName", "systName") if getattr(module, a, None) != None]
+    if names:
+        label += "(%s)" % ",".join(names)
+    return label
+
+
+class ModuleProfiler:
+    """Calls, rejections, wall and CPU time of each module of a chain.
+
+       Calls and rejections are counted for every event: stops[i] is the
+       number of events rejected by module i, stops[-1] the number of events
+       accepted by all, so that module i was called sum(stops[i:]) times.
+       The time of the analyze calls is measured every sampleEvery events
+       and scaled up to all the calls; analyzeBatch calls are always timed.
+    """
+
+    def __init__(self, modules, sampleEvery=10):
+        self.labels = [moduleLabel(i, m) for i, m in enumerate(modules)]
+        self.sampleEvery = sampleEvery
+        n = len(self.labels)
+        self.stops = [0] * (n + 1)
+        self.sampledCalls = [0] * n
+        self.wall = [0.] * n
+        self.cpu = [0.] * n
+        self._nAnalyze = 0
+
+    def analyze(self, modules, event, offset=0):
+        """Run analyze of modules (the ones of the chain starting at offset) on event"""
+        self._nAnalyze += 1
+        if self._nAnalyze % self.sampleEvery:
+            for im, m in enumerate(modules):
+                if not m.analyze(event):
+                    self.stops[offset + im] += 1
+                    return False
+            return True
+        for im, m in enumerate(modules):
+            w0, c0 = time.time(), _cpuTime()
+            ret = m.analyze(event)
+            self.wall[offset + im] += time.time() - w0
+            self.cpu[offset + im] += _cpuTime() - c0
+            self.sampledCalls[offset + im] += 1
+            if not ret:
+                self.stops[offset + im] += 1
+                return False
+        return True
+
+    def analyzeBatch(self, index, module, batch):
+        """Run analyzeBatch of the module at index in the chain on batch,
+           the rejections are counted by the caller with rejected()"""
+        w0, c0 = time.time(), _cpuTime()
+        ret = module.analyzeBatch(batch)
+        self.wall[index] += time.time() - w0
+        self.cpu[index] += _cpuTime() - c0
+        self.sampledCalls[index] += int(batch.mask.sum())
+        return ret
+
+    def rejected(self, index, n=1):
+        self.stops[index] += int(n)
+
+    def accepted(self, n=1):
+        self.stops[-1] += int(n)
+
+    def merge(self, state):
+        """Add the counters of another profiler of the same chain, as returned by state()"""
+        for key in ("stops", "sampledCalls", "wall", "cpu"):
+            setattr(self, key, [a + b for a, b in zip(getattr(self, key), state[key])])
+
+    def state(self):
+        return dict(stops=self.stops, sampledCalls=self.sampledCalls, wall=self.wall, cpu=self.cpu)
+
+    def summary(self):
+        """Return one dict per module, sorted by decreasing estimated wall time"""
+        ret = []
+        for im, label in enumerate(self.labels):
+            calls = sum(self.stops[im:])
+            scale = float(calls) / self.sampledCalls[im] if self.sampledCalls[im] else 0.
+            ret.append(dict(
+                module=label, calls=calls, rejected=self.stops[im],
+                acceptRate=1. - float(self.stops[im]) / calls if calls else 1.,
+                wallTime=self.wall[im] * scale, cpuTime=self.cpu[im] * scale))
+        return sorted(ret, key=lambda m: -m["wallTime"])
+
+    def printSummary(self, out=None):
+        summary = self.summary()
+        totWall = sum(m["wallTime"] for m in summary)
+        lines = ["%-60s %10s %10s %8s %10s %10s %6s" % ("module", "calls", "rejected", "accept", "wall [s]", "cpu [s]", "wall%")]
+        for m in summary:
+            lines.append("%-60s %10d %10d %7.2f%% %10.2f %10.2f %5.1f%%" % (
+                m["module"], m["calls"], m["rejected"], 100. * m["acceptRate"], m["wallTime"],
+                m["cpuTime"], 100. * m["wallTime"] / totWall if totWall else 0.))
+        text = "\n".join(lines) + "\n"
+        if out:
+            out.write(text)
+        else:
+            print(text)
+
+    def writeJSON(self, fname):
+        with open(fname, 'w') as f:
+            json.dump(dict(sampleEvery=self.sampleEvery, modules=self.summary()), f, indent=1)
@@ -20,8 +20,12 @@ def InputTree(tree, entrylist=None):
     tree.readBranch = types.MethodType(readBranch, tree)
     tree.gotoEntry = types.MethodType(_gotoEntry, tree)
     tree.readAllBranches = types.MethodType(_readAllBranches, tree)
+    tree.declareBranches = types.MethodType(declareBranches, tree)
     tree.entries = tree._ttreereader.GetEntries(False)
     tree._extrabranches = {}
+    tree._accessorTables = {}
+    tree._usedBranches = set()
+    tree._prunedBranches = set()
     return tree
 
 
@@ -51,6 +55,42 @@ def getValueReader(tree, branchName):
     return tree._ttrvs[branchName]
 
 
+def declareBranches(tree, branchNames):
+    """Make the readers for all the branches branchNames at once.
+
+       Called in beginFile, before the first entry is read, this creates them
+       in the TTreeReader of the file; later, it remakes the TTreeReader only
+       once for all of them, instead of once per branch read for the first time.
+    """
+    newBranches = []
+    for branchName in branchNames:
+        if branchName in tree._ttras or branchName in tree._ttrvs or branchName in newBranches:
+            continue
+        if not tree.GetBranch(branchName):
+            raise RuntimeError("Can't find branch '%s'" % branchName)
+        newBranches.append(branchName)
+    if not newBranches:
+        return
+    isClean = tree._ttreereader._isClean
+    for branchName in newBranches:
+        useBranch(tree, branchName)
+        leaf = tree.GetBranch(branchName).GetLeaf(branchName)
+        typ = leaf.GetTypeName()
+        tree._leafTypes[branchName] = typ
+        isValue = leaf.GetLen() == 1 and not bool(leaf.GetLeafCount())
+        if not isClean:
+            # made by _remakeAllReaders below
+            (tree._ttrvs if isValue else tree._ttras)[branchName] = None
+        elif isValue:
+            tree._ttrvs[branchName] = ROOT.TTreeReaderValue(typ)(tree._ttreereader, branchName)
+        else:
+            tree._ttras[branchName] = ROOT.TTreeReaderArray(typ)(tree._ttreereader, branchName)
+    if not isClean:
+        _remakeAllReaders(tree)
+        if tree.entry >= 0:
+            tree.gotoEntry(tree.entry, forceCall=True)
+
+
 def clearExtraBranches(tree):
     tree._extrabranches = {}
 
@@ -59,12 +99,28 @@ def setExtraBranch(tree, name, val):
     tree._extrabranches[name] = val
 
 
+class LazyValue(object):
+    """Value of an extra branch computed by get() only if a module reads it"""
+    __slots__ = ('get',)
+
+    def __init__(self, get):
+        self.get = get
+
+
+def getExtraBranch(tree, name):
+    """Return the value of an extra branch set by a module in this event"""
+    val = tree._extrabranches[name]
+    if type(val) is LazyValue:
+        val = tree._extrabranches[name] = val.get()
+    return val
+
+
 def readBranch(tree, branchName):
     """Return the branch value if the branch is a value, and a TreeReaderArray if the branch is an array"""
     if tree._ttreereader._isClean:
         raise RuntimeError("readBranch must not be called before calling gotoEntry")
     if branchName in tree._extrabranches:
-        return tree._extrabranches[branchName]
+        return getExtraBranch(tree, branchName)
     elif branchName in tree._ttras:
         return tree._ttras[branchName]
     elif branchName in tree._ttrvs:
@@ -89,9 +145,152 @@ def readBranch(tree, branchName):
             return _ar
 
 
+def accessorTable(tree, prefix):
+    """Return the table attribute -> accessor for branches named prefix+attribute.
+
+       An accessor is a function (event, index) -> value, returning the whole
+       branch value (or array reader) if index is None. The table is filled
+       lazily by getAccessor and is shared by all the objects with the same prefix.
+    """
+    try:
+        return tree._accessorTables[prefix]
+    except KeyError:
+        table = tree._accessorTables[prefix] = {}
+        return table
+
+
+def getAccessor(tree, table, prefix, name):
+    """Return the accessor for prefix+name, resolving it once for the table"""
+    acc = table.get(name)
+    if acc is None:
+        acc = _makeAccessor(tree, prefix + name)
+        # table may have been emptied by _remakeAllReaders while resolving
+        table[name] = acc
+    return acc
+
+
+def useBranch(tree, branchName):
+    """Record that branchName is read, enabling it back if it was pruned"""
+    tree._usedBranches.add(branchName)
+    if branchName in tree._prunedBranches:
+        print("Branch %s was not read before the input branches were pruned, enabling it back" % branchName)
+        tree._prunedBranches.discard(branchName)
+        tree.SetBranchStatus(branchName, 1)
+
+
+def usedBranches(tree):
+    """Return the names of the branches read so far, including the counters of the arrays"""
+    ret = set(tree._usedBranches)
+    for branchName in tree._usedBranches:
+        branch = tree.GetBranch(branchName)
+        if not branch:
+            continue
+        leafCount = branch.GetLeaf(branchName).GetLeafCount()
+        if bool(leafCount):
+            ret.add(leafCount.GetBranch().GetName())
+    return ret
+
+
+def pruneBranches(tree, keep=()):
+    """Disable the branches neither read so far nor in keep, return their names"""
+    used = usedBranches(tree) | set(keep)
+    for b in tree.GetListOfBranches():
+        branchName = b.GetName()
+        if branchName not in used and tree.GetBranchStatus(branchName):
+            tree.SetBranchStatus(branchName, 0)
+            tree._prunedBranches.add(branchName)
+    return tree._prunedBranches
+
+
+def setCacheBranches(tree, branchNames):
+    """Fill the TTreeCache with the branches branchNames only, ending its learning phase"""
+    if tree.GetCacheSize() <= 0:
+        return
+    tree.DropBranchFromCache("*", True)
+    for branchName in branchNames:
+        tree.AddBranchToCache(branchName, True)
+    tree.StopCacheLearningPhase()
+
+
+def currentTreeEntry(tree):
+    """Return the entry number in the TTree of the current entry (tree.entry counts the entries in the entry list)"""
+    if tree._entrylist:
+        return tree._entrylist.GetEntry(tree.entry)
+    else:
+        return tree.entry
+
+
+def readStatistics(tree):
+    """Return a dict with the read calls and bytes read from the file of tree, and the TTreeCache statistics"""
+    tfile = tree.GetCurrentFile()
+    stats = {"readCalls": tfile.GetReadCalls(), "bytesRead": tfile.GetBytesRead()}
+    cache = tfile.GetCacheRead(tree)
+    if cache and hasattr(cache, "GetEfficiency"):
+        stats.update({
+            "cacheSize": cache.GetBufferSize(),
+            "cacheBranches": cache.GetCachedBranches().GetEntries() if cache.GetCachedBranches() else 0,
+            "cacheHitRate": cache.GetEfficiency(),
+            "cacheHitRateRel": cache.GetEfficiencyRel(),
+            "cacheReadCalls": cache.GetReadCalls(),
+            "noCacheReadCalls": cache.GetNoCacheReadCalls(),
+            "noCacheBytesRead": cache.GetNoCacheBytesRead(),
+        })
+    return stats
+
+
 ####### PRIVATE IMPLEMENTATION PART #######
 
+_charLeafTypes = ('Char_t', 'UChar_t')
+
+
+def _makeAccessor(tree, branchName):
+    if not tree.GetBranch(branchName):
+        # only available if set by a module in this event
+        def get(event, index):
+            if branchName in event.__dict__:
+                val = event.__dict__[branchName]
+            else:
+                val = tree.readBranch(branchName)
+            return val if index is None else val[index]
+        return get
+    if branchName not in tree._extrabranches:
+        tree.readBranch(branchName)  # make the reader
+    else:
+        # readBranch would return the module value, make the reader explicitly
+        leaf = tree.GetBranch(branchName).GetLeaf(branchName)
+        if leaf.GetLen() == 1 and not bool(leaf.GetLeafCount()):
+            _makeValueReader(tree, leaf.GetTypeName(), branchName)
+        else:
+            _makeArrayReader(tree, leaf.GetTypeName(), branchName)
+        tree.gotoEntry(tree.entry, forceCall=True)
+    isChar = tree._leafTypes[branchName] in _charLeafTypes
+    if branchName in tree._ttras:
+        reader = tree._ttras[branchName]
+
+        def get(event, index):
+            if branchName in tree._extrabranches:
+                val = getExtraBranch(tree, branchName)
+                return val if index is None else val[index]
+            if index is None:
+                return reader
+            val = reader[index]
+            return ord(val) if isChar and type(val) == str else val
+    else:
+        reader = tree._ttrvs[branchName]
+
+        def get(event, index):
+            if branchName in tree._extrabranches:
+                val = getExtraBranch(tree, branchName)
+            else:
+                val = reader.Get()[0]
+                if isChar and type(val) == str:
+                    val = ord(val)
+            return val if index is None else val[index]
+    return get
+
+
 def _makeArrayReader(tree, typ, nam):
+    useBranch(tree, nam)
     if not tree._ttreereader._isClean:
         _remakeAllReaders(tree)
     ttra = ROOT.TTreeReaderArray(typ)(tree._ttreereader, nam)
@@ -101,6 +300,7 @@ def _makeArrayReader(tree, typ, nam):
 
 
 def _makeValueReader(tree, typ, nam):
+    useBranch(tree, nam)
     if not tree._ttreereader._isClean:
         _remakeAllReaders(tree)
     ttrv = ROOT.TTreeReaderValue(typ)(tree._ttreereader, nam)
@@ -122,17 +322,14 @@ def _remakeAllReaders(tree):
     tree._ttras = _ttras
     tree._ttreereader = _ttreereader
     tree._ttreereaderversion += 1
+    # accessors hold the old readers, empty the tables in place as objects
+    # keep a reference to them
+    for table in tree._accessorTables.values():
+        table.clear()
 
 
 def _readAllBranches(tree):
-    tree.GetEntry(_currentTreeEntry(tree))
-
-
-def _currentTreeEntry(tree):
-    if tree._entrylist:
-        return tree._entrylist.GetEntry(tree.entry)
-    else:
-        return tree.entry
+    tree.GetEntry(currentTreeEntry(tree))
 
 
 def _gotoEntry(tree, entry, forceCall=False):
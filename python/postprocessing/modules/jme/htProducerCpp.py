@@ -29,6 +29,7 @@ class htProducerCpp(Module):
         pass
 
     def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+        inputTree.declareBranches(["nJet", "Jet_pt"])
         self.initReaders(inputTree)  # initReaders must be called in beginFile
         self.out = wrappedOutputTree
         self.out.branch("HT_pt", "F")
@@ -3,10 +3,17 @@ import ROOT
 import numpy
 import sys
 
-if len(sys.argv) < 3:
-    print("Syntax: haddnano.py out.root input1.root input2.root ...")
-ofname = sys.argv[1]
-files = sys.argv[2:]
+args = sys.argv[1:]
+basketBudget = None
+if len(args) > 1 and args[0] == "--basket-budget":
+    # memory in MB for the baskets of each merged tree
+    from PhysicsTools.NanoAODTools.postprocessing.framework.basketbudget import BasketBudget
+    basketBudget = BasketBudget(float(args[1]) * 1048576)
+    args = args[2:]
+if len(args) < 2:
+    print("Syntax: haddnano.py [--basket-budget MB] out.root input1.root input2.root ...")
+ofname = args[0]
+files = args[1:]
 
 
 def zeroFill(tree, brName, brObj, allowNonBool=False):
@@ -50,7 +57,14 @@ for e in fileHandles[0].GetListOfKeys():
     inputs = ROOT.TList()
     isTree = obj.IsA().InheritsFrom(ROOT.TTree.Class())
     if isTree:
-        obj = obj.CloneTree(-1, "fast" if goFast else "")
+        if basketBudget and not goFast:
+            # fast merging copies the baskets as they are
+            inTree = obj
+            obj = inTree.CloneTree(0)
+            basketBudget.apply(obj, inTree.GetEntries(), reference=inTree)
+            obj.CopyEntries(inTree, -1, "")
+        else:
+            obj = obj.CloneTree(-1, "fast" if goFast else "")
         branchNames = set([x.GetName() for x in obj.GetListOfBranches()])
     for fh in fileHandles[1:]:
         otherObj = fh.GetListOfKeys().FindObject(name).ReadObj()
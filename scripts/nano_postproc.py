@@ -22,10 +22,24 @@ if __name__ == "__main__":
                       type="string", default=None, help="Branch selection input")
     parser.add_option("--bo", "--branch-selection-output", dest="branchsel_out",
                       type="string", default=None, help="Branch selection output")
+    parser.add_option("--export-branch-selection", dest="exportBranchSelection", action="store_true", default=False,
+                      help="Write the branches kept and dropped by the input and output branch selections to branchSelection.json and outputBranchSelection.json in the output directory")
     parser.add_option("--friend", dest="friend", action="store_true", default=False,
                       help="Produce friend trees in output (current default is to produce full trees)")
     parser.add_option("--full", dest="friend", action="store_false", default=False,
                       help="Produce full trees in output (this is the current default)")
+    parser.add_option("--delta-friend", dest="deltaFriend", action="store_true", default=False,
+                      help="Produce friend trees with only the selected entries, their entry number and the new branches, to be read with output.joinDeltaFriend")
+    parser.add_option("--systematics-layout", dest="systematicsLayout", type="string", default=None,
+                      help="Comma-separated systematic variations: the new branches <variable>_<syst> are written as one array branch <variable> over them")
+    parser.add_option("--output-policy", dest="outputPolicy", type="string", default=None,
+                      help="File with the storage types (type <pattern> <bool|uint8|int16|...>) and mantissa bits (precision <pattern> <bits>) of the new branches")
+    parser.add_option("--basket-budget", dest="basketBudget", type="float", default=None,
+                      help="Memory in MB for the baskets of each output tree: after a warm-up, the basket sizes and autoflush are chosen to fit in it (also for the final hadd)")
+    parser.add_option("--max-output-size", dest="maxOutputSize", type="float", default=None,
+                      help="Write the output of all the input files directly to files of about this many MB (a new file is started with the next input file once it is reached), named as the --haddFileName (default tree.root in the output directory) with _0, _1..., instead of one file per input file")
+    parser.add_option("--max-output-entries", dest="maxOutputEntries", type="long", default=None,
+                      help="Same as --max-output-size, with at most this many entries per output file")
     parser.add_option("--noout", dest="noOut", action="store_true",
                       default=False, help="Do not produce output, just run modules")
     parser.add_option("-P", "--prefetch", dest="prefetch", action="store_true", default=False,
@@ -41,7 +55,39 @@ if __name__ == "__main__":
     parser.add_option("-I", "--import", dest="imports", type="string", default=[], action="append",
                       nargs=2, help="Import modules (python package, comma-separated list of ")
     parser.add_option("-z", "--compression", dest="compression", type="string",
-                      default=("LZMA:9"), help="Compression: none, or (algo):(level) ")
+                      default=("LZMA:9"), help="Compression: none, (algo):(level), or auto[:speed|size|balanced] to choose it by compressing the first clusters of the first file with several settings")
+    parser.add_option("--preskim-threads", dest="preskimThreads", type="int", default=1,
+                      help="Threads evaluating the compiled pre-selection cut (-c) and JSON run range")
+    parser.add_option("--push-down", dest="pushDown", action="store_true", default=False,
+                      help="Add the preselection expressions of the modules to the pre-selection cut: the events they reject are not read, nor seen by the modules before them")
+    parser.add_option("-j", "--jobs", dest="nWorkers", type="int", default=1,
+                      help="Number of forked worker processes, each processing different input files")
+    parser.add_option("--buffer-merger", dest="bufferMerger", action="store_true", default=False,
+                      help="With -j, merge the output of the workers into one file (--haddFileName, default tree.root in the output directory) while they run, instead of one file per input file merged at the end")
+    parser.add_option("--split-files", dest="splitFiles", action="store_true", default=False,
+                      help="With -j, also split each input file in cluster-aligned entry ranges processed in parallel")
+    parser.add_option("--learn-branch-usage", dest="learnBranchUsage", type="int", default=None,
+                      help="Disable the input branches not read by the modules in the first N entries of each file")
+    parser.add_option("--branch-usage-file", dest="branchUsageFile", type="string", default=None,
+                      help="Write the input branches read by the modules to this file, in the keep/drop format")
+    parser.add_option("--cache-size", dest="cacheSize", type="int", default=None,
+                      help="Size in bytes of the TTreeCache of the input trees, and report the read statistics of each file")
+    parser.add_option("--cache-branches", dest="cacheBranches", type="string", default=None,
+                      help="Keep/drop file with the branches to put in the TTreeCache (e.g. the one from --branch-usage-file)")
+    parser.add_option("--async-prefetch", dest="asyncPrefetch", action="store_true", default=False,
+                      help="Enable the asynchronous prefetching of the TFile cache blocks")
+    parser.add_option("--profile", dest="profile", action="store_true", default=False,
+                      help="Measure calls, rejections and time of each module, written to moduleProfile.json in the output directory")
+    parser.add_option("--memory-monitor", dest="memoryMonitor", type="int", default=None,
+                      help="Sample the RSS and Python heap every N events and flag modules whose memory grows with the events, written to memoryProfile.json in the output directory")
+    parser.add_option("--metrics-json", dest="metricsFile", type="string", default=None,
+                      help="Append the progress of the job (events, rates, bytes read, RSS, module time shares) as JSON lines to this file")
+    parser.add_option("--metrics-prom", dest="metricsPromFile", type="string", default=None,
+                      help="Write the progress of the job in the Prometheus text format to this file, for the node exporter textfile collector")
+    parser.add_option("--metrics-interval", dest="metricsInterval", type="float", default=30.,
+                      help="Seconds between two updates of the metrics files")
+    parser.add_option("--batch-size", dest="batchSize", type="int", default=None,
+                      help="Process entries in chunks of this size, running modules that implement analyzeBatch vectorized")
 
     (options, args) = parser.parse_args()
 
@@ -83,6 +129,15 @@ if __name__ == "__main__":
                       modules=modules,
                       compression=options.compression,
                       friend=options.friend,
+                      deltaFriend=options.deltaFriend,
+                      outputPolicy=options.outputPolicy,
+                      basketBudget=options.basketBudget,
+                      maxOutputSize=options.maxOutputSize,
+                      maxOutputEntries=options.maxOutputEntries,
+                      bufferMerger=options.bufferMerger,
+                      preskimThreads=options.preskimThreads,
+                      pushDown=options.pushDown,
+                      systematicsLayout=options.systematicsLayout.split(",") if options.systematicsLayout else None,
                       postfix=options.postfix,
                       jsonInput=options.json,
                       noOut=options.noOut,
@@ -91,5 +146,19 @@ if __name__ == "__main__":
                       longTermCache=options.longTermCache,
                       maxEntries=options.maxEntries,
                       firstEntry=options.firstEntry,
-                      outputbranchsel=options.branchsel_out)
+                      outputbranchsel=options.branchsel_out,
+                      exportBranchSelection=options.exportBranchSelection,
+                      batchSize=options.batchSize,
+                      nWorkers=options.nWorkers,
+                      splitFiles=options.splitFiles,
+                      learnBranchUsage=options.learnBranchUsage,
+                      branchUsageFile=options.branchUsageFile,
+                      cacheSize=options.cacheSize,
+                      cacheBranches=options.cacheBranches,
+                      asyncPrefetch=options.asyncPrefetch,
+                      profile=options.profile,
+                      memoryMonitor=options.memoryMonitor,
+                      metricsFile=options.metricsFile,
+                      metricsPromFile=options.metricsPromFile,
+                      metricsInterval=options.metricsInterval)
     p.run()
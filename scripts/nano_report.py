@@ -1,34 +1,33 @@
 #!/usr/bin/env python
 # imported from https://github.com/CERN-PH-CMG/cmg-cmssw/blob/0c11a5a0a15c4c3e1a648c9707b06b08b747b0c0/PhysicsTools/Heppy/scripts/heppy_report.py
+from PhysicsTools.NanoAODTools.postprocessing.framework.preskimming import JSONFilter, treeColumns
 from optparse import OptionParser
 import json
+import numpy
 import ROOT
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 
 
-def root2map(tree):
-    tree.SetBranchStatus("*", 0)
-    tree.SetBranchStatus("run", 1)
-    tree.SetBranchStatus("luminosityBlock", 1)
+def root2map(tree, jsonFilter=None):
+    """Runs and lumi ranges of the entries of tree, only the ones in jsonFilter if given"""
+    runs, lumis = [numpy.zeros(0)], [numpy.zeros(0)]
+    for run, lumi in treeColumns(tree, ["run", "luminosityBlock"]):
+        if jsonFilter:
+            mask = jsonFilter.filterRunsLumis(run, lumi)
+            run, lumi = run[mask], lumi[mask]
+        runs.append(run)
+        lumis.append(lumi)
+    # sorted by run and lumi, without duplicates
+    keys = numpy.unique((numpy.concatenate(runs).astype(numpy.uint64) << numpy.uint64(32)) |
+                        numpy.concatenate(lumis).astype(numpy.uint64))
     jsonind = {}
-    for e in range(tree.GetEntries()):
-        tree.GetEntry(e)
-        run, lumi = tree.run, tree.luminosityBlock
-        if run not in jsonind:
-            jsonind[run] = [lumi]
-        else:
-            jsonind[run].append(lumi)
-    # remove duplicates
-    for run in jsonind:
-        jsonind[run] = list(set(jsonind[run]))
+    for key in keys.tolist():
+        jsonind.setdefault(key >> 32, []).append(key & 0xFFFFFFFF)
 
     nruns = len(jsonind)
     nlumis = sum(len(v) for v in jsonind.values())
     jsonmap = {}
     for r, lumis in jsonind.items():
-        if len(lumis) == 0:
-            continue  # shouldn't happen
-        lumis.sort()
         ranges = [[lumis[0], lumis[0]]]
         for lumi in lumis[1:]:
             if lumi == ranges[-1][1] + 1:
@@ -46,6 +45,8 @@ if __name__ == '__main__':
                       help="Name of the TTree with the luminosity blocks")
     parser.add_option("-o", "--out", dest="outputFile",
                       default="lumiSummary.json", help="Name of the output file")
+    parser.add_option("-j", "--json", dest="json", default=None,
+                      help="Only report the lumisections in this JSON file")
     (options, args) = parser.parse_args()
     if len(args) == 0:
         print('provide at least one input file in argument. Use -h to display help')
@@ -53,7 +54,7 @@ if __name__ == '__main__':
     chain = ROOT.TChain(options.treeName)
     for a in args:
         chain.Add(a)
-    summary = root2map(chain)
+    summary = root2map(chain, JSONFilter(options.json) if options.json else None)
     if summary:
         jmap, runs, lumis = summary
         json.dump(jmap, open(options.outputFile, 'w'))
@@ -0,0 +1,143 @@
+"""Small synthetic NanoAOD-like files for the tests of the framework"""
+import array
+import os
+import random
+import shutil
+import tempfile
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+ROOT.gROOT.SetBatch(True)
+
+
+def makeNanoFile(fname, nEvents=2000, seed=1, firstRun=1, nRuns=2, lumisPerRun=5, maxJets=6, autoFlush=200):
+    """Write fname with an Events tree (event variables, Jet and Muon
+       collections, triggers and flags), and the Runs and LuminosityBlocks
+       trees of its runs and lumis. Events have several clusters of autoFlush entries."""
+    rnd = random.Random(seed)
+    f = ROOT.TFile.Open(fname, "RECREATE")
+    tree = ROOT.TTree("Events", "Events")
+    tree.SetAutoFlush(autoFlush)
+    run = array.array('I', [0])
+    lumi = array.array('I', [0])
+    event = array.array('L', [0])
+    nJet = array.array('I', [0])
+    jetPt = array.array('f', [0.] * maxJets)
+    jetEta = array.array('f', [0.] * maxJets)
+    jetId = array.array('i', [0] * maxJets)
+    nMuon = array.array('I', [0])
+    muonPt = array.array('f', [0.] * maxJets)
+    metPt = array.array('f', [0.])
+    hlt = array.array('b', [0])
+    flag = array.array('b', [0])
+    tree.Branch("run", run, "run/i")
+    tree.Branch("luminosityBlock", lumi, "luminosityBlock/i")
+    tree.Branch("event", event, "event/l")
+    tree.Branch("nJet", nJet, "nJet/i")
+    tree.Branch("Jet_pt", jetPt, "Jet_pt[nJet]/F")
+    tree.Branch("Jet_eta", jetEta, "Jet_eta[nJet]/F")
+    tree.Branch("Jet_jetId", jetId, "Jet_jetId[nJet]/I")
+    tree.Branch("nMuon", nMuon, "nMuon/i")
+    tree.Branch("Muon_pt", muonPt, "Muon_pt[nMuon]/F")
+    tree.Branch("MET_pt", metPt, "MET_pt/F")
+    tree.Branch("HLT_IsoMu24", hlt, "HLT_IsoMu24/O")
+    tree.Branch("Flag_goodVertices", flag, "Flag_goodVertices/O")
+    lumis = [(firstRun + r, l + 1) for r in range(nRuns) for l in range(lumisPerRun)]
+    for i in range(nEvents):
+        run[0], lumi[0] = lumis[i * len(lumis) // nEvents]
+        # large event numbers, not exact as doubles
+        event[0] = (1 << 60) + 3 * i + 1
+        nJet[0] = rnd.randint(0, maxJets)
+        for j in range(nJet[0]):
+            jetPt[j] = rnd.expovariate(1 / 40.) + 15.
+            jetEta[j] = rnd.uniform(-4.7, 4.7)
+            jetId[j] = rnd.choice([0, 2, 6])
+        nMuon[0] = rnd.randint(0, 2)
+        for j in range(nMuon[0]):
+            muonPt[j] = rnd.expovariate(1 / 30.) + 5.
+        metPt[0] = rnd.expovariate(1 / 50.)
+        hlt[0] = rnd.random() < 0.4
+        flag[0] = rnd.random() < 0.95
+        tree.Fill()
+    tree.Write()
+
+    runs = ROOT.TTree("Runs", "Runs")
+    rrun = array.array('I', [0])
+    sumw = array.array('d', [0.])
+    runs.Branch("run", rrun, "run/i")
+    runs.Branch("genEventSumw", sumw, "genEventSumw/D")
+    for r in range(nRuns):
+        rrun[0] = firstRun + r
+        sumw[0] = 100. * (r + 1)
+        runs.Fill()
+    runs.Write()
+    lumiTree = ROOT.TTree("LuminosityBlocks", "LuminosityBlocks")
+    lrun = array.array('I', [0])
+    llumi = array.array('I', [0])
+    lumiTree.Branch("run", lrun, "run/i")
+    lumiTree.Branch("luminosityBlock", llumi, "luminosityBlock/i")
+    for r, l in lumis:
+        lrun[0], llumi[0] = r, l
+        lumiTree.Fill()
+    lumiTree.Write()
+    f.Close()
+    return fname
+
+
+def makeFriendFile(fname, mainFile, treeName="Events"):
+    """Write fname with a tree of the same entries as mainFile, with the branches Friend_x and Friend_y"""
+    inFile = ROOT.TFile.Open(mainFile)
+    n = inFile.Get(treeName).GetEntries()
+    inFile.Close()
+    f = ROOT.TFile.Open(fname, "RECREATE")
+    tree = ROOT.TTree(treeName, treeName)
+    x = array.array('f', [0.])
+    y = array.array('i', [0])
+    tree.Branch("Friend_x", x, "Friend_x/F")
+    tree.Branch("Friend_y", y, "Friend_y/I")
+    for i in range(n):
+        x[0] = 0.5 * i
+        y[0] = i % 7
+        tree.Fill()
+    tree.Write()
+    f.Close()
+    return fname
+
+
+def readTree(fname, treeName="Events"):
+    """Return {branch name: [value or tuple of values of each entry]} of a tree of fname"""
+    f = ROOT.TFile.Open(fname)
+    tree = f.Get(treeName)
+    leaves = [(b.GetName(), b.GetLeaf(b.GetName())) for b in tree.GetListOfBranches()]
+    ret = dict((name, []) for name, leaf in leaves)
+    for i in range(tree.GetEntries()):
+        tree.GetEntry(i)
+        for name, leaf in leaves:
+            if leaf.GetLeafCount() or leaf.GetLen() != 1:
+                ret[name].append(tuple(leaf.GetValue(j) for j in range(leaf.GetLen())))
+            else:
+                ret[name].append(leaf.GetValue(0) if leaf.GetTypeName() not in ("Long64_t", "ULong64_t") else
+                                 int(getattr(tree, name)))
+    f.Close()
+    return ret
+
+
+def keys(fname):
+    """Names of the keys of fname"""
+    f = ROOT.TFile.Open(fname)
+    ret = sorted(k.GetName() for k in f.GetListOfKeys())
+    f.Close()
+    return ret
+
+
+class TempDir:
+    """Temporary directory, removed at the end of a with block"""
+
+    def __enter__(self):
+        self.path = tempfile.mkdtemp(prefix="nanotest")
+        return self
+
+    def __exit__(self, *args):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __call__(self, *names):
+        return os.path.join(self.path, *names)
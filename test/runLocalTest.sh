@@ -2,6 +2,9 @@ function run_test()
 {
     cd $CMSSW_BASE/src/PhysicsTools/NanoAODTools || return 1
     echo
+    echo "==================== unit tests ==============="
+    python2 -m unittest discover -s test -p 'test_*.py' || return 1
+    echo
     echo "==================== 2016preVFP ==============="
     python2 processors/ST.py --year 2016preVFP --ntags 1 --isSignal --input=https://github.com/WbWbX/test-files/raw/main/nanox_211005/WbjToLNu_4f_2016preVFP.root || return 1
     echo
@@ -0,0 +1,119 @@
+"""The batch event loop (analyzeBatch) gives the same output as the event-by-event one"""
+import unittest
+import numpy
+import ROOT
+from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection, InputTree
+from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module, eventLoop
+from PhysicsTools.NanoAODTools.postprocessing.framework.output import FriendOutput
+from PhysicsTools.NanoAODTools.postprocessing.framework.postprocessor import PostProcessor
+from nanotestutils import TempDir, makeNanoFile, readTree
+
+
+class GoodJets(Module):
+    """Central jets and their HT, rejecting events with HT < 50"""
+
+    def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+        self.out = wrappedOutputTree
+        self.out.branch("HT", "F")
+        self.out.branch("GoodJet_pt", "F", lenVar="nGoodJet")
+
+    def analyze(self, event):
+        pts = [j.pt for j in Collection(event, "Jet") if abs(j.eta) < 2.4]
+        ht = numpy.array(pts, dtype=numpy.float64).sum()
+        self.out.fillBranch("HT", ht)
+        self.out.fillBranch("GoodJet_pt", pts)
+        return ht >= 50
+
+    def analyzeBatch(self, batch):
+        offsets, pt = batch.jagged("Jet_pt")
+        eta = batch.jagged("Jet_eta")[1]
+        good = numpy.abs(eta) < 2.4
+        ht = numpy.zeros(len(batch))
+        goodOffsets = numpy.zeros(len(batch) + 1, dtype=numpy.int64)
+        for k in range(len(batch)):
+            sel = good[offsets[k]:offsets[k + 1]]
+            ht[k] = pt[offsets[k]:offsets[k + 1]][sel].astype(numpy.float64).sum()
+            goodOffsets[k + 1] = goodOffsets[k] + sel.sum()
+        batch.fillBranch("HT", ht)
+        batch.fillBranch("GoodJet_pt", pt[good], goodOffsets)
+        return ht >= 50
+
+
+class LeadingGoodJet(Module):
+    """Event by event, reads the good jets made before, rejects the events without muons"""
+
+    def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+        self.out = wrappedOutputTree
+        self.out.branch("LeadGood_pt", "F")
+        self.out.branch("nGoodJetSeen", "I")
+
+    def analyze(self, event):
+        self.out.fillBranch("nGoodJetSeen", event.nGoodJet)
+        self.out.fillBranch("LeadGood_pt", event.GoodJet_pt[0] if event.nGoodJet else -1.)
+        return event.nMuon > 0
+
+
+class EventCopy(Module):
+    """Copies the 64-bit event number and MET, accepts all"""
+
+    def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+        self.out = wrappedOutputTree
+        self.out.branch("eventCopy", "l")
+        self.out.branch("MET_high", "O")
+
+    def analyze(self, event):
+        self.out.fillBranch("eventCopy", event.event)
+        self.out.fillBranch("MET_high", event.MET_pt > 40)
+        return True
+
+    def analyzeBatch(self, batch):
+        batch.fillBranch("eventCopy", batch.array("event"))
+        batch.fillBranch("MET_high", batch.array("MET_pt") > 40)
+        return None
+
+
+def modules():
+    return [GoodJets(), LeadingGoodJet(), EventCopy()]
+
+
+def runLoop(inName, outName, batchSize, filterOutput):
+    inFile = ROOT.TFile.Open(inName)
+    inTree = InputTree(inFile.Get("Events"))
+    outFile = ROOT.TFile.Open(outName, "RECREATE")
+    outTree = FriendOutput(inFile, inTree, outFile)
+    mods = modules()
+    for m in mods:
+        m.beginJob()
+    ret = eventLoop(mods, inFile, outFile, inTree, outTree, batchSize=batchSize,
+                    filterOutput=filterOutput, progress=None)
+    outTree.write()
+    outFile.Close()
+    inFile.Close()
+    return ret[:2]
+
+
+class TestBatch(unittest.TestCase):
+    def test_eventLoop(self):
+        with TempDir() as tmp:
+            makeNanoFile(tmp("in.root"))
+            for filterOutput in (True, False):
+                byEvent = runLoop(tmp("in.root"), tmp("event.root"), None, filterOutput)
+                for batchSize in (1, 64, 500):
+                    byBatch = runLoop(tmp("in.root"), tmp("batch.root"), batchSize, filterOutput)
+                    self.assertEqual(byEvent, byBatch)
+                    self.assertEqual(readTree(tmp("event.root"), "Friends"), readTree(tmp("batch.root"), "Friends"))
+
+    def test_postProcessor(self):
+        with TempDir() as tmp:
+            makeNanoFile(tmp("in.root"))
+            for name, batchSize in (("event", None), ("batch", 100)):
+                PostProcessor(tmp(name), [tmp("in.root")], modules=modules(), batchSize=batchSize,
+                              cut="nJet > 0", compression="none").run()
+            event, batch = readTree(tmp("event", "in_Skim.root")), readTree(tmp("batch", "in_Skim.root"))
+            self.assertTrue(len(event["event"]) > 0)
+            self.assertEqual(event, batch)
+            self.assertEqual(event["eventCopy"], event["event"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+"""BranchSelection sets the same branch status as the keep/drop lines applied one by one"""
+import random
+import re
+import unittest
+import ROOT
+from PhysicsTools.NanoAODTools.postprocessing.framework.branchselection import BranchSelection
+from nanotestutils import TempDir, makeFriendFile, makeNanoFile
+
+patterns = ["*", "n*", "Jet_*", "nJet", "Jet_pt", "*_pt", "Muon_?t", "*Jet*", "HLT_*",
+            "Friend*", "Friend_[xy]", "MET_pt"]
+regexes = ["Jet_.*", "n.*", "Friend.*", ".*_pt", "HLT_IsoMu24"]
+
+
+def selectOneByOne(tree, ops):
+    """The keep/drop lines applied with one TTree::SetBranchStatus each"""
+    tree.SetBranchStatus("*", 1)
+    names = [b.GetName() for b in tree.GetListOfBranches()]
+    for op, sel in ops:
+        stat = 1 if op.startswith("keep") else 0
+        if op.endswith("match"):
+            for n in names:
+                if re.match("(?:%s)$" % sel, n):
+                    tree.SetBranchStatus(n, stat)
+        else:
+            tree.SetBranchStatus(sel, stat)
+
+
+def status(trees):
+    return [(t.GetName(), b.GetName(), t.GetBranchStatus(b.GetName()))
+            for t in trees for b in t.GetListOfBranches()]
+
+
+class TestBranchSelection(unittest.TestCase):
+    def test_randomSelections(self):
+        rnd = random.Random(7)
+        with TempDir() as tmp:
+            makeNanoFile(tmp("in.root"), nEvents=10)
+            makeFriendFile(tmp("friend.root"), tmp("in.root"), treeName="Friends")
+            f = ROOT.TFile.Open(tmp("in.root"))
+            ff = ROOT.TFile.Open(tmp("friend.root"))
+            tree = f.Get("Events")
+            friend = ff.Get("Friends")
+            for withFriend in (False, True):
+                if withFriend:
+                    tree.AddFriend(friend)
+                for trial in range(100):
+                    ops = []
+                    for i in range(rnd.randint(1, 6)):
+                        keep = rnd.random() < 0.5
+                        if rnd.random() < 0.3:
+                            ops.append(("keepmatch" if keep else "dropmatch", rnd.choice(regexes)))
+                        else:
+                            ops.append(("keep" if keep else "drop", rnd.choice(patterns)))
+                    with open(tmp("sel.txt"), "w") as out:
+                        # the first line continued on the next one
+                        out.write("%s \\\n  %s # comment\n" % ops[0])
+                        for op in ops[1:]:
+                            out.write("%s %s\n" % op)
+                    trees = [tree, friend] if withFriend else [tree]
+                    selectOneByOne(tree, ops)
+                    expected = status(trees)
+                    tree.SetBranchStatus("*", 0)
+                    BranchSelection(tmp("sel.txt")).selectBranches(tree)
+                    self.assertEqual(status(trees), expected, ops)
+            ff.Close()
+            f.Close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+"""The output merged while the workers run has the entries of the files processed one by one"""
+import unittest
+from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
+from PhysicsTools.NanoAODTools.postprocessing.framework.postprocessor import PostProcessor
+from nanotestutils import TempDir, makeNanoFile, readTree
+
+
+class MuonPt(Module):
+    """Sum of the muon pts, rejecting the events without muons"""
+
+    def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+        self.out = wrappedOutputTree
+        self.out.branch("Muon_sumPt", "F")
+
+    def analyze(self, event):
+        self.out.fillBranch("Muon_sumPt", sum(event.Muon_pt[j] for j in range(event.nMuon)))
+        return event.nMuon > 0
+
+
+def concatenate(trees):
+    ret = dict((name, []) for name in trees[0])
+    for tree in trees:
+        for name, values in tree.items():
+            ret[name] += values
+    return ret
+
+
+def sortedRows(tree):
+    """The entries as rows of the values of the branches, sorted"""
+    names = sorted(tree)
+    return sorted(zip(*[tree[name] for name in names]))
+
+
+class TestBufferMerger(unittest.TestCase):
+    def test_sameEntries(self):
+        with TempDir() as tmp:
+            # different runs, so that the events of the files are different
+            inputs = [makeNanoFile(tmp("in%d.root" % i), nEvents=800, seed=i, firstRun=1 + 2 * i)
+                      for i in range(4)]
+            PostProcessor(tmp("seq"), inputs, cut="MET_pt > 20", modules=[MuonPt()],
+                          compression="none").run()
+            PostProcessor(tmp("merged"), inputs, cut="MET_pt > 20", modules=[MuonPt()],
+                          compression="none", nWorkers=2, bufferMerger=True, bufferMergerFlush=100,
+                          haddFileName=tmp("merged", "tree.root")).run()
+            seqNames = [tmp("seq", "in%d_Skim.root" % i) for i in range(4)]
+            for name in ("Events", "Runs", "LuminosityBlocks"):
+                expected = concatenate([readTree(f, name) for f in seqNames])
+                merged = readTree(tmp("merged", "tree.root"), name)
+                self.assertEqual(sorted(merged), sorted(expected))
+                self.assertEqual(sortedRows(merged), sortedRows(expected))
+
+    def test_rejectFriendOutput(self):
+        # friend trees must keep the entries of their input file
+        with TempDir() as tmp:
+            inputs = [makeNanoFile(tmp("in%d.root" % i), nEvents=50, seed=i) for i in range(2)]
+            self.assertRaises(RuntimeError, PostProcessor(
+                tmp("out"), inputs, modules=[MuonPt()], friend=True, nWorkers=2,
+                bufferMerger=True, compression="none").run)
+
+
+if __name__ == "__main__":
+    unittest.main()
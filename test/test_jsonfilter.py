@@ -0,0 +1,73 @@
+"""JSONFilter keeps the same runs, lumis and entries as a scan of the lumi ranges"""
+import random
+import unittest
+import numpy
+import ROOT
+from PhysicsTools.NanoAODTools.postprocessing.framework.preskimming import JSONFilter, preSkim
+from nanotestutils import TempDir, makeNanoFile
+
+
+def randomJSON(rnd, runs, maxLumi):
+    """Lumi ranges with overlapping, adjacent, single-lumi, empty and inverted ones"""
+    ret = {}
+    for run in runs:
+        if rnd.random() < 0.2:
+            continue
+        ranges = []
+        for i in range(rnd.randint(0, 5)):
+            first = rnd.randint(1, maxLumi)
+            ranges.append([first, first + rnd.randint(-1, 4)])
+        ret[str(run)] = ranges
+    return ret
+
+
+def scanRunLumi(runsAndLumis, run, lumi):
+    """Whether one of the ranges of run has lumi"""
+    return any(l1 <= lumi <= l2 for (l1, l2) in runsAndLumis.get(str(run), []))
+
+
+def entries(elist):
+    return [elist.GetEntry(i) for i in range(elist.GetN())] if elist else None
+
+
+class TestJSONFilter(unittest.TestCase):
+    def test_runsAndLumis(self):
+        rnd = random.Random(5)
+        for trial in range(200):
+            runsAndLumis = randomJSON(rnd, range(1, 8), 12)
+            jf = JSONFilter(runsAndLumis=runsAndLumis)
+            pairs = [(run, lumi) for run in range(0, 9) for lumi in range(0, 15)]
+            expected = [scanRunLumi(runsAndLumis, run, lumi) for run, lumi in pairs]
+            self.assertEqual([jf.filterRunLumi(run, lumi) for run, lumi in pairs], expected)
+            runs, lumis = numpy.array(pairs, dtype=numpy.uint32).T
+            self.assertEqual(list(jf.filterRunsLumis(runs, lumis)), expected)
+            expectedRuns = [len(runsAndLumis.get(str(run), [])) > 0 for run in range(0, 9)]
+            self.assertEqual(list(jf.filterRuns(numpy.arange(9))), expectedRuns)
+            self.assertEqual([jf.filterRunOnly(run) for run in range(0, 9)], expectedRuns)
+
+    def test_entries(self):
+        rnd = random.Random(11)
+        with TempDir() as tmp:
+            makeNanoFile(tmp("in.root"), nRuns=3, lumisPerRun=6)
+            f = ROOT.TFile.Open(tmp("in.root"))
+            tree = f.Get("Events")
+            runLumis = []
+            for i in range(tree.GetEntries()):
+                tree.GetEntry(i)
+                runLumis.append((tree.run, tree.luminosityBlock))
+            for trial in range(10):
+                runsAndLumis = randomJSON(rnd, range(1, 4), 6)
+                if not any(runsAndLumis.values()):
+                    continue
+                cut = "nJet > 1"
+                passCut = entries(preSkim(tree, cutstring=cut, compiled=False)[0])
+                expected = [i for i in passCut if scanRunLumi(runsAndLumis, *runLumis[i])]
+                elist, jf = preSkim(tree, jsonInput=runsAndLumis, cutstring=cut)
+                self.assertEqual(entries(elist), expected)
+                self.assertEqual(list(jf.filterTree(tree)),
+                                 [i for i in range(len(runLumis)) if scanRunLumi(runsAndLumis, *runLumis[i])])
+            f.Close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+"""FullOutput copies the selected input branches of the entries filled"""
+import unittest
+from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
+from PhysicsTools.NanoAODTools.postprocessing.framework.postprocessor import PostProcessor
+from nanotestutils import TempDir, makeNanoFile, readTree
+
+
+class HT(Module):
+    """HT of the jets, rejecting the events with HT < 60"""
+
+    def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+        self.out = wrappedOutputTree
+        self.out.branch("HT", "F")
+
+    def analyze(self, event):
+        ht = sum(event.Jet_pt[j] for j in range(event.nJet))
+        self.out.fillBranch("HT", ht)
+        return ht >= 60
+
+
+def expected(inValues, entries, dropped):
+    """The values of inValues of the entries with nJet > 1 and HT >= 60"""
+    selected = [i for i in entries if inValues["nJet"][i] > 1 and
+                sum(inValues["Jet_pt"][i]) >= 60]
+    return dict((name, [values[i] for i in selected])
+                for name, values in inValues.items() if name not in dropped)
+
+
+class TestFullOutput(unittest.TestCase):
+    def run_postProcessor(self, tmp, **kwargs):
+        with open(tmp("keep.txt"), "w") as f:
+            f.write("keep *\n")
+        with open(tmp("out.txt"), "w") as f:
+            f.write("keep *\ndrop Jet_jetId\ndrop HLT_*\n")
+        PostProcessor(tmp("out"), [tmp("in.root")], cut="nJet > 1", modules=[HT()],
+                      branchsel=tmp("keep.txt"), outputbranchsel=tmp("out.txt"),
+                      compression="none", **kwargs).run()
+        out = readTree(tmp("out", "in_Skim.root"))
+        self.assertTrue(len(out["event"]) > 0)
+        del out["HT"]
+        return out
+
+    def test_copiedBranches(self):
+        with TempDir() as tmp:
+            makeNanoFile(tmp("in.root"))
+            inValues = readTree(tmp("in.root"))
+            out = self.run_postProcessor(tmp)
+            self.assertEqual(out, expected(inValues, range(2000), ("Jet_jetId", "HLT_IsoMu24")))
+
+    def test_entryRange(self):
+        # the entries of the range, the first ones are not skipped a second time
+        with TempDir() as tmp:
+            makeNanoFile(tmp("in.root"))
+            inValues = readTree(tmp("in.root"))
+            out = self.run_postProcessor(tmp, firstEntry=500, maxEntries=700)
+            self.assertEqual(out, expected(inValues, range(500, 1200), ("Jet_jetId", "HLT_IsoMu24")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+"""The files processed by several workers are the same as processed sequentially"""
+import os
+import unittest
+from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
+from PhysicsTools.NanoAODTools.postprocessing.framework.postprocessor import PostProcessor
+from nanotestutils import TempDir, makeNanoFile, readTree
+
+
+class LeadingJet(Module):
+    """pt of the leading jet, rejecting the events without muons"""
+
+    def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+        self.out = wrappedOutputTree
+        self.out.branch("LeadJet_pt", "F")
+
+    def analyze(self, event):
+        self.out.fillBranch("LeadJet_pt", max(event.Jet_pt[j] for j in range(event.nJet)))
+        return event.nMuon > 0
+
+
+def process(tmp, outDir, inputs, **kwargs):
+    PostProcessor(tmp(outDir), inputs, cut="nJet > 0", modules=[LeadingJet()],
+                  compression="none", **kwargs).run()
+    return [readTree(tmp(outDir, os.path.basename(f).replace(".root", "_Skim.root"))) for f in inputs]
+
+
+class TestParallel(unittest.TestCase):
+    def test_files(self):
+        with TempDir() as tmp:
+            inputs = [makeNanoFile(tmp("in%d.root" % i), nEvents=700, seed=i) for i in range(3)]
+            sequential = process(tmp, "seq", inputs)
+            self.assertTrue(all(len(out["event"]) > 0 for out in sequential))
+            self.assertEqual(process(tmp, "par", inputs, nWorkers=2), sequential)
+
+    def test_splitFiles(self):
+        # the parts of a file are merged in entry order
+        with TempDir() as tmp:
+            inputs = [makeNanoFile(tmp("in.root"), nEvents=3000, autoFlush=100)]
+            sequential = process(tmp, "seq", inputs)
+            self.assertEqual(process(tmp, "split", inputs, nWorkers=3, splitFiles=True), sequential)
+            for name in ("Runs", "LuminosityBlocks"):
+                self.assertEqual(readTree(tmp("split", "in_Skim.root"), name),
+                                 readTree(tmp("seq", "in_Skim.root"), name))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+"""The compiled pre-selection selects the same entries as TTree::Draw"""
+import unittest
+import ROOT
+from PhysicsTools.NanoAODTools.postprocessing.framework.preskimming import compileCut, preSkim
+from nanotestutils import TempDir, makeFriendFile, makeNanoFile
+
+
+def entries(elist):
+    return [elist.GetEntry(i) for i in range(elist.GetN())] if elist else None
+
+
+class TestCompiledCut(unittest.TestCase):
+    cuts = [
+        "nJet > 2",
+        "MET_pt > 30 && (HLT_IsoMu24 || nMuon >= 2)",
+        "abs(MET_pt - 50) < 20 || !Flag_goodVertices",
+        "luminosityBlock*2 + run > 7",
+        "TMath::Max(nJet, nMuon) >= 3 && sqrt(MET_pt) > 4.5",
+    ]
+
+    def test_sameEntries(self):
+        with TempDir() as tmp:
+            makeNanoFile(tmp("in.root"), autoFlush=100)
+            f = ROOT.TFile.Open(tmp("in.root"))
+            tree = f.Get("Events")
+            for cut in self.cuts:
+                self.assertNotEqual(compileCut(tree, cut), None, cut)
+                for firstEntry, maxEntries in ((0, None), (150, 1234)):
+                    ref = entries(preSkim(tree, cutstring=cut, firstEntry=firstEntry,
+                                          maxEntries=maxEntries, compiled=False)[0])
+                    self.assertTrue(len(ref) > 0)
+                    for nThreads in (1, 4):
+                        elist = preSkim(tree, cutstring=cut, firstEntry=firstEntry,
+                                        maxEntries=maxEntries, nThreads=nThreads)[0]
+                        self.assertEqual(entries(elist), ref, (cut, firstEntry, nThreads))
+            f.Close()
+
+    def test_friendBranches(self):
+        # the threads don't see the friends, the cut is not compiled
+        with TempDir() as tmp:
+            makeNanoFile(tmp("in.root"))
+            makeFriendFile(tmp("friend.root"), tmp("in.root"))
+            f = ROOT.TFile.Open(tmp("in.root"))
+            ff = ROOT.TFile.Open(tmp("friend.root"))
+            tree = f.Get("Events")
+            tree.AddFriend(ff.Get("Events"))
+            cut = "Friend_y > 3 && nJet > 1"
+            self.assertEqual(compileCut(tree, cut), None)
+            ref = entries(preSkim(tree, cutstring=cut, compiled=False)[0])
+            self.assertEqual(entries(preSkim(tree, cutstring=cut, nThreads=4)[0]), ref)
+            ff.Close()
+            f.Close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+"""The rolling output files have the Runs and LuminosityBlocks of their events"""
+import os
+import unittest
+from PhysicsTools.NanoAODTools.postprocessing.framework.postprocessor import PostProcessor
+from nanotestutils import TempDir, makeNanoFile, readTree
+
+
+class TestRollingOutput(unittest.TestCase):
+    def check(self, maxOutputEntries, expectedEntries):
+        with TempDir() as tmp:
+            inputs = [makeNanoFile(tmp("in%d.root" % i), nEvents=500, seed=i, firstRun=1 + 2 * i)
+                      for i in range(3)]
+            os.mkdir(tmp("out"))
+            PostProcessor(tmp("out"), inputs, maxOutputEntries=maxOutputEntries,
+                          haddFileName=tmp("out", "tree.root"), compression="none").run()
+            outputs = [tmp("out", "tree_%d.root" % i) for i in range(len(expectedEntries))]
+            self.assertFalse(os.path.exists(tmp("out", "tree_%d.root" % len(expectedEntries))))
+
+            events, runs, lumis = [], [], []
+            for fname, nEntries in zip(outputs, expectedEntries):
+                out = readTree(fname)
+                outRuns = readTree(fname, "Runs")
+                outLumis = readTree(fname, "LuminosityBlocks")
+                self.assertEqual(len(out["event"]), nEntries)
+                # every event of the file has its run and lumi in the file
+                self.assertTrue(set(out["run"]) <= set(outRuns["run"]))
+                self.assertTrue(set(zip(out["run"], out["luminosityBlock"])) <=
+                                set(zip(outLumis["run"], outLumis["luminosityBlock"])))
+                events += out["event"]
+                runs += list(zip(outRuns["run"], outRuns["genEventSumw"]))
+                lumis += list(zip(outLumis["run"], outLumis["luminosityBlock"]))
+
+            inEvents, inRuns, inLumis = [], [], []
+            for fname in inputs:
+                inEvents += readTree(fname)["event"]
+                r = readTree(fname, "Runs")
+                inRuns += list(zip(r["run"], r["genEventSumw"]))
+                l = readTree(fname, "LuminosityBlocks")
+                inLumis += list(zip(l["run"], l["luminosityBlock"]))
+            # all the entries, runs and lumis once
+            self.assertEqual(events, inEvents)
+            self.assertEqual(sorted(runs), sorted(inRuns))
+            self.assertEqual(sorted(lumis), sorted(inLumis))
+
+    def test_rollEveryFile(self):
+        self.check(300, [500, 500, 500])
+
+    def test_rollAfterTwoFiles(self):
+        self.check(600, [1000, 500])
+
+
+if __name__ == "__main__":
+    unittest.main()